@@ -25,4 +25,8 @@ powershell -NoProfile -ExecutionPolicy Bypass -Command ^
 	"$patched = [regex]::Replace($c,'(?ms)^\s*Write-Host ""Installing features\.\.\.""\s*.*?Write-Host ""Done\.""','Write-Host ""Features installation skipped""' + [Environment]::NewLine); " ^
 	"Set-Content -LiteralPath $o1 -Value $patched -Encoding UTF8;"
 
-python -m nuitka --onefile --standalone --enable-plugins=pyqt5 --remove-output --windows-console-mode=disable --windows-uac-admin --output-dir=dist --output-filename=Talon.exe --follow-imports --windows-icon-from-ico=media\ICON.ico --include-data-dir=configs=configs --include-data-dir=media=media --include-data-dir=debloat_raven_scripts=debloat_raven_scripts --include-data-dir=external_scripts=external_scripts --include-package=screens --product-name="Talon" --company-name="Raven Development Team" --file-description="Simple utility to debloat Windows in 2 clicks." --file-version=%FileVersion% --product-version=%ProductVersion% --copyright="Copyright (c) 2025 Raven Development Team" --onefile-tempdir-spec="{CACHE_DIR}\RavenDevelopmentTeam\Talon\{VERSION}" talon.py
\ No newline at end of file
+:: The registry tweak catalogs ship pre-compiled so startup loads them without parsing JSON.
+python -m utilities.util_tweak_catalog configs\registry_tweaks.json configs\registry_tweaks.bin || exit /b 1
+python -m utilities.util_tweak_catalog configs\external_registry_writes.json configs\external_registry_writes.bin || exit /b 1
+
+python -m nuitka --onefile --standalone --enable-plugins=pyqt5 --remove-output --windows-console-mode=disable --windows-uac-admin --output-dir=dist --output-filename=Talon.exe --follow-imports --windows-icon-from-ico=media\ICON.ico --include-data-dir=configs=configs --include-data-dir=media=media --include-data-dir=debloat_raven_scripts=debloat_raven_scripts --include-data-dir=external_scripts=external_scripts --include-package=screens --include-package=debloat_components --product-name="Talon" --company-name="Raven Development Team" --file-description="Simple utility to debloat Windows in 2 clicks." --file-version=%FileVersion% --product-version=%ProductVersion% --copyright="Copyright (c) 2025 Raven Development Team" --onefile-tempdir-spec="{CACHE_DIR}\RavenDevelopmentTeam\Talon\{VERSION}" talon.py
\ No newline at end of file
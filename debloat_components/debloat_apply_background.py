@@ -3,15 +3,38 @@ import sys
 import ctypes
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
+from utilities.util_step_probe import SATISFIED, NOT_APPLIED
 
-def main():
+def _get_wallpaper_path() -> str:
     if getattr(sys, 'frozen', False):
         base_path = os.path.dirname(sys.executable)
     else:
         components_dir = os.path.dirname(os.path.abspath(__file__))
         base_path = os.path.dirname(components_dir)
     media_dir = os.path.join(base_path, 'media')
-    wallpaper_path = os.path.join(media_dir, 'desktop_background.png')
+    return os.path.join(media_dir, 'desktop_background.png')
+
+
+
+def probe():
+    SPI_GETDESKWALLPAPER = 0x0073
+    buffer = ctypes.create_unicode_buffer(512)
+    if not ctypes.windll.user32.SystemParametersInfoW(SPI_GETDESKWALLPAPER, len(buffer), buffer, 0):
+        raise ctypes.WinError()
+    current = os.path.normcase(os.path.abspath(buffer.value)) if buffer.value else ""
+    if current == os.path.normcase(os.path.abspath(_get_wallpaper_path())):
+        return SATISFIED
+    return NOT_APPLIED
+
+
+
+def plan():
+    return [(None, f"Set the desktop wallpaper to {_get_wallpaper_path()}")]
+
+
+
+def main():
+    wallpaper_path = _get_wallpaper_path()
     logger.info(f"Setting desktop background: {wallpaper_path}")
     if not os.path.exists(wallpaper_path):
         msg = f"Wallpaper file not found: {wallpaper_path}"
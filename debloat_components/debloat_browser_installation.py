@@ -1,11 +1,67 @@
 import os
 import sys
 import json
+import shutil
 import tempfile
 import subprocess
+from typing import Optional
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
 from utilities.util_powershell_handler import run_powershell_command
+from utilities.util_run_journal import is_committed, commit, record_outcome
+from utilities.util_step_probe import summarize, probes_enabled
+from utilities.util_step_timings import timed
+from utilities.util_trace import span
+from utilities.util_watchdog import StepTimeoutError, deadline
+from utilities.util_ps_bundle import BundleAction
+from utilities.util_process_engine import run_process
+from utilities.util_output_rules import PHASE, PROGRESS, Rule, RuleSet, report_progress
+from utilities.util_pipe_reader import log_line_batch
+from utilities.util_retry import RetryPolicy, TransientFailure, run_with_retry
+
+
+
+# Chocolatey occasionally hangs on a stuck download or installer prompt; past this
+# the install is killed and reported instead of holding up the whole run.
+CHOCO_INSTALL_TIMEOUT = 1800
+VCREDIST_DISPLAY_NAME = "Microsoft Visual C++ 2015–2022 Redistributable"
+CHOCO_BOOTSTRAP_COMMAND = (
+	"Set-ExecutionPolicy Bypass -Scope Process -Force; "
+	"[System.Net.ServicePointManager]::SecurityProtocol = "
+	"[System.Net.ServicePointManager]::SecurityProtocol -bor 3072; "
+	"iex ((New-Object System.Net.WebClient).DownloadString("
+	"'https://community.chocolatey.org/install.ps1'))"
+)
+CHOCO_RULES = RuleSet([
+	Rule(
+		PROGRESS,
+		r"Progress: Downloading (?P<package>\S+) \S*\.\.\. (?P<percent>\d+)%",
+		message="Downloading {package}",
+	),
+	Rule(
+		PHASE,
+		r"^(?P<package>\S+) package files install completed",
+		message="Running the {package} installer",
+	),
+])
+# Another msiexec or choco process holding its lock (1618 is ERROR_INSTALL_ALREADY_RUNNING)
+# and dropped downloads clear up on their own; anything else is reported straight away.
+CHOCO_RETRY = RetryPolicy(
+	3,
+	base_delay=15.0,
+	exit_codes=(1618,),
+	patterns=(
+		r"Unable to obtain lock file access",
+		r"Another installation is (?:currently )?in progress",
+		r"The operation has timed out",
+		r"Unable to connect to the remote server",
+		r"The remote name could not be resolved",
+	),
+)
+
+
+
+STEP_SLUG = "browser-installation"
 
 
 
@@ -23,7 +79,7 @@ def load_choice() -> str:
 
 
 
-def ensure_chocolatey():
+def ensure_chocolatey() -> bool:
 	try:
 		subprocess.run(
 			["choco", "-v"],
@@ -32,18 +88,13 @@ def ensure_chocolatey():
 			stderr=subprocess.DEVNULL
 		)
 		logger.info("Chocolatey already installed.")
+		return True
 	except (subprocess.CalledProcessError, FileNotFoundError):
 		logger.info("Chocolatey not found. Installing now...")
-		install_cmd = (
-			"Set-ExecutionPolicy Bypass -Scope Process -Force; "
-			"[System.Net.ServicePointManager]::SecurityProtocol = "
-			"[System.Net.ServicePointManager]::SecurityProtocol -bor 3072; "
-			"iex ((New-Object System.Net.WebClient).DownloadString("
-			"'https://community.chocolatey.org/install.ps1'))"
-		)
+		install_cmd = CHOCO_BOOTSTRAP_COMMAND
 		logger.info(f"Running install command: {install_cmd}")
 		try:
-			run_powershell_command(install_cmd)
+			run_powershell_command(install_cmd, timeout=CHOCO_INSTALL_TIMEOUT, retry=CHOCO_RETRY)
 			logger.info("Chocolatey install script executed.")
 			choco_exe = _get_choco_exe()
 			subprocess.run(
@@ -53,6 +104,7 @@ def ensure_chocolatey():
 				stderr=subprocess.DEVNULL
 			)
 			logger.info("Chocolatey installed and verified.")
+			return True
 		except Exception as e:
 			logger.error(f"Failed to install or verify Chocolatey: {e}")
 			show_error_popup(
@@ -63,41 +115,106 @@ def ensure_chocolatey():
 
 
 
-def _get_choco_exe() -> str:
+def _default_choco_dir() -> str:
+	return os.environ.get("ChocolateyInstall") or os.path.join(
+		os.environ.get("ProgramData", r"C:\\ProgramData"),
+		"chocolatey",
+	)
+
+
+
+def _find_choco_exe() -> Optional[str]:
+	# The install directory first, then PATH: Chocolatey installed somewhere custom
+	# without ChocolateyInstall set is still found through its bin folder on PATH.
 	env_path = os.environ.get("ChocolateyInstall")
 	if env_path:
 		choco = os.path.join(env_path, "bin", "choco.exe")
 		if os.path.exists(choco):
 			return choco
-	default_path = os.path.join(
-		os.environ.get("ProgramData", r"C:\\ProgramData"),
-		"chocolatey",
-		"bin",
-		"choco.exe",
-	)
-	return default_path if os.path.exists(default_path) else "choco"
+	default_path = os.path.join(_default_choco_dir(), "bin", "choco.exe")
+	if os.path.exists(default_path):
+		return default_path
+	return shutil.which("choco")
+
+
+
+def _get_choco_exe() -> str:
+	return _find_choco_exe() or "choco"
+
+
+
+def _get_choco_lib_dir() -> str:
+	# lib sits next to bin in the install directory choco.exe was found in.
+	choco = _find_choco_exe()
+	if choco is None:
+		install_dir = _default_choco_dir()
+	else:
+		install_dir = os.path.dirname(os.path.realpath(choco))
+		if os.path.basename(install_dir).lower() == "bin":
+			install_dir = os.path.dirname(install_dir)
+	return os.path.join(install_dir, "lib")
 
 
 
-def _install_choco_package(pkg_id: str, display_name: str):
+def _is_choco_package_installed(pkg_id: str) -> bool:
+	# Chocolatey keeps one folder per installed package under lib; checking for it
+	# avoids spawning choco just to find out there is nothing to do.
+	return os.path.isdir(os.path.join(_get_choco_lib_dir(), pkg_id))
+
+
+
+def _install_choco_package(pkg_id: str, display_name: str, timeout: float = CHOCO_INSTALL_TIMEOUT) -> bool:
+	# Returns whether the package is installed; failures are reported here and the
+	# user may choose to carry on without it.
+	if probes_enabled() and _is_choco_package_installed(pkg_id):
+		logger.info(f"{display_name} ({pkg_id}) is already installed, skipping.")
+		return True
 	choco_exe = _get_choco_exe()
 	logger.info(f"Installing via Chocolatey: {display_name} ({pkg_id})")
+
+	def attempt(number, last):
+		with span(f"choco install {pkg_id}", cat="chocolatey", package=pkg_id, attempt=number) as trace, \
+				deadline(f"choco install {pkg_id}", timeout):
+			result = run_process(
+				[choco_exe, "install", pkg_id, "-y"],
+				on_stdout=lambda lines: log_line_batch(f"choco [{pkg_id}] STDOUT", lines),
+				on_stderr=lambda lines: log_line_batch(f"choco [{pkg_id}] STDERR", lines),
+				rules=CHOCO_RULES,
+				on_rule=report_progress,
+			)
+			trace.set(child_pid=result.pid, exit_code=result.returncode)
+			if result.usage is not None:
+				trace.set(**result.usage.as_dict())
+		if result.returncode not in (0, 3010) and not last:
+			reason = CHOCO_RETRY.classify(result.returncode, result.output.tail())
+			if reason is not None:
+				raise TransientFailure(reason)
+		return result
 	try:
-		result = subprocess.run(
-			[choco_exe, "install", pkg_id, "-y"],
-			check=False
-		)
-		if result.returncode in (0, 3010):
-			if result.returncode == 3010:
+		result = run_with_retry(f"choco install {pkg_id}", CHOCO_RETRY, attempt)
+		returncode = result.returncode
+		if returncode in (0, 3010):
+			if returncode == 3010:
 				logger.info(f"Successfully installed {display_name}, reboot required.")
 			else:
 				logger.info(f"Successfully installed {display_name}.")
-			return
-		logger.error(f"Chocolatey exited with code {result.returncode} for {pkg_id}")
+			return True
+		summary = result.output.summary()
+		logger.error(f"Chocolatey exited with code {returncode} for {pkg_id}" + (f"\n{summary}" if summary else ""))
 		show_error_popup(
 			"A problem occurred with Chocolatey during installation. "
 			f"'{display_name}' could not be installed successfully.\n"
-			f"Chocolatey exit code: {result.returncode}",
+			f"Chocolatey exit code: {returncode}" + (f"\n\n{summary}" if summary else ""),
+			allow_continue=True
+		)
+	except StepTimeoutError as e:
+		if e.name != f"choco install {pkg_id}":
+			raise
+		logger.error(f"Chocolatey timed out installing {pkg_id}: {e}")
+		show_error_popup(
+			"Chocolatey stopped responding during installation. "
+			f"'{display_name}' could not be installed successfully.\n"
+			f"Error: {e}",
 			allow_continue=True
 		)
 	except Exception as e:
@@ -108,21 +225,80 @@ def _install_choco_package(pkg_id: str, display_name: str):
 			f"Error: {e}",
 			allow_continue=True
 		)
+	return False
 
 
 
-def install_vcredist():
+def install_vcredist() -> bool:
 	# Some people may say see this and say "why is a DEBLOATER installing BLOAT!?"
 	# This step is necessary to install dependencies that a very, very large amount of
 	# modern programs rely on. For example, Waterfox. These dependencies cannot reasonably
 	# be considered "bloat" as bloat is unnecessary, while these dependencies, a very large
 	# amount of the time, are necessary.
-	_install_choco_package("vcredist140", "Microsoft Visual C++ 2015–2022 Redistributable")
+	return _install_choco_package("vcredist140", VCREDIST_DISPLAY_NAME)
+
 
 
+def install_browser(pkg_id: str) -> bool:
+	return _install_choco_package(pkg_id, f"browser '{pkg_id}'")
 
-def install_browser(pkg_id: str):
-	_install_choco_package(pkg_id, f"browser '{pkg_id}'")
+
+
+def probe():
+	pkg_id = load_choice()
+	return summarize([
+		_find_choco_exe() is not None,
+		_is_choco_package_installed("vcredist140"),
+		_is_choco_package_installed(pkg_id),
+	])
+
+
+
+def plan():
+	try:
+		pkg_id = load_choice()
+	except Exception:
+		pkg_id = None
+	actions = [
+		("chocolatey", "Install Chocolatey from community.chocolatey.org if it is missing"),
+		("vcredist140", "choco install vcredist140 -y"),
+	]
+	if pkg_id:
+		actions.append((pkg_id, f"choco install {pkg_id} -y"))
+	else:
+		actions.append((None, "Install the browser picked on the browser selection screen"))
+	return actions
+
+
+
+def bundle_actions():
+	pkg_id = load_choice()
+	actions = []
+	if not is_committed(STEP_SLUG, "chocolatey") and _find_choco_exe() is None:
+		actions.append(BundleAction(STEP_SLUG, "chocolatey", "Install Chocolatey", command=CHOCO_BOOTSTRAP_COMMAND))
+	for action, display_name in (
+		("vcredist140", VCREDIST_DISPLAY_NAME),
+		(pkg_id, f"browser '{pkg_id}'"),
+	):
+		if is_committed(STEP_SLUG, action) or (probes_enabled() and _is_choco_package_installed(action)):
+			continue
+		# choco.exe may only exist once the bootstrap action earlier in the bundle has run.
+		command = (
+			"$root = if ($env:ChocolateyInstall) { $env:ChocolateyInstall } "
+			"else { Join-Path $env:ProgramData 'chocolatey' }; "
+			"$choco = Join-Path $root 'bin\\choco.exe'; "
+			"if (-not (Test-Path $choco)) { $choco = 'choco' }; "
+			f"& $choco install {action} -y"
+		)
+		actions.append(BundleAction(
+			STEP_SLUG,
+			action,
+			f"Install {display_name}",
+			command=command,
+			ok_exit_codes=(0, 3010),
+			fatal=False,
+		))
+	return actions
 
 
 
@@ -134,9 +310,21 @@ def main():
 		logger.error(f"Error reading browser choice: {e}")
 		show_error_popup(f"Internal error reading browser choice:\n{e}", allow_continue=False)
 		sys.exit(1)
-	ensure_chocolatey()
-	install_vcredist()
-	install_browser(pkg_id)
+	for action, func in (
+		("chocolatey", ensure_chocolatey),
+		("vcredist140", install_vcredist),
+		(pkg_id, lambda: install_browser(pkg_id)),
+	):
+		if is_committed(STEP_SLUG, action):
+			logger.info(f"Skipping {action} (already completed before the run was interrupted)")
+			continue
+		with timed(STEP_SLUG, action):
+			installed = func()
+		if installed:
+			commit(STEP_SLUG, action)
+		else:
+			# Left uncommitted (and the step with it) so --resume tries it again.
+			record_outcome(STEP_SLUG, "failed", action)
 
 
 
@@ -1,22 +1,78 @@
 import sys
-import winreg
 from utilities.util_logger import logger
-from utilities.util_powershell_handler import run_powershell_script
+from utilities.util_powershell_handler import run_powershell_script, resolve_script_path
 from utilities.util_error_popup import show_error_popup
+from utilities.util_modify_registry import read_values
+from utilities.util_registry_backend import HKEY_LOCAL_MACHINE, get_backend
+from utilities.util_step_probe import summarize
+from utilities.util_step_timings import timed
+from utilities.util_ps_bundle import BundleAction
+from utilities.util_retry import SERVICE_BUSY_RETRY
+
+
+
+STEP_SLUG = "configure-updates"
+UPDATE_POLICY_KEY = r"SOFTWARE\Policies\Microsoft\Windows\WindowsUpdate"
+# Values each script leaves behind; None only requires the value to exist.
+EXPECTED_POLICY_VALUES = {
+    "update_policy_changer_pro.ps1": {
+        "ExcludeUpdateClassifications": None,
+        "ExcludeWUDriversInQualityUpdate": 1,
+        "AUOptions": 2,
+    },
+    "update_policy_changer.ps1": {
+        "DeferQualityUpdates": 1,
+        "DeferQualityUpdatesPeriodInDays": 4,
+        "ProductVersion": "Windows 11",
+        "TargetReleaseVersion": 1,
+        "TargetReleaseVersionInfo": "24H2",
+    },
+}
 
 
 
 def _get_product_name() -> str:
     key_path = r"SOFTWARE\Microsoft\Windows NT\CurrentVersion"
-    access = winreg.KEY_READ
-    if hasattr(winreg, "KEY_WOW64_64KEY"):
-        access |= winreg.KEY_WOW64_64KEY
-    with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, key_path, 0, access) as key:
-        val, _ = winreg.QueryValueEx(key, "ProductName")
+    backend = get_backend()
+    with backend.open_key(HKEY_LOCAL_MACHINE, key_path) as key:
+        val, _ = backend.query_value(key, "ProductName")
         return str(val)
 
 
 
+def _select_script(product_name: str) -> str:
+    if any(x in product_name for x in ("Professional", "Pro", "Enterprise")):
+        return "update_policy_changer_pro.ps1"
+    return "update_policy_changer.ps1"
+
+
+
+def probe():
+    expected = EXPECTED_POLICY_VALUES[_select_script(_get_product_name())]
+    current = read_values(HKEY_LOCAL_MACHINE, UPDATE_POLICY_KEY, expected)
+    return summarize(
+        name in current and (value is None or current[name][0] == value)
+        for name, value in expected.items()
+    )
+
+
+
+def plan():
+    try:
+        product_name = _get_product_name()
+    except Exception:
+        return [(None, "Detect the Windows edition, then run update_policy_changer_pro.ps1 or update_policy_changer.ps1")]
+    script = _select_script(product_name)
+    return [(script, f"Run PowerShell script {script} (detected {product_name})")]
+
+
+
+def bundle_actions():
+    script = _select_script(_get_product_name())
+    return [BundleAction(STEP_SLUG, script, f"Run PowerShell script {script}", script=resolve_script_path(script))]
+
+
+
 def main():
     try:
         product_name = _get_product_name()
@@ -28,14 +84,11 @@ def main():
             allow_continue=False,
         )
         sys.exit(1)
-    if any(x in product_name for x in ("Professional", "Pro", "Enterprise")):
-        script = "update_policy_changer_pro.ps1"
-    else:
-        script = "update_policy_changer.ps1"
-
+    script = _select_script(product_name)
     logger.info(f"Executing PowerShell script: {script}")
     try:
-        run_powershell_script(script)
+        with timed(STEP_SLUG, script):
+            run_powershell_script(script, retry=SERVICE_BUSY_RETRY)
         logger.info(f"Successfully executed {script}")
     except Exception as e:
         logger.error(f"Failed to execute {script}: {e}")
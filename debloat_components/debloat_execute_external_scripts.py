@@ -9,6 +9,49 @@ import urllib.parse
 from utilities.util_logger import logger
 from utilities.util_powershell_handler import run_powershell_command
 from utilities.util_error_popup import show_error_popup
+from utilities.util_run_journal import is_committed, commit
+from utilities.util_step_timings import timed
+from utilities.util_trace import span
+from utilities.util_ps_bundle import BundleAction
+from utilities.util_output_rules import PHASE, SUCCESS, Rule, RuleSet
+from utilities.util_tweak_catalog import catalog_path, load_catalog
+
+
+
+STEP_SLUG = "execute-external-scripts"
+WIN11DEBLOAT_ARGS = [
+	'-Silent',
+	'-RemoveApps',
+	'-RemoveGamingApps',
+	'-DisableTelemetry',
+	'-DisableBing',
+	'-DisableSuggestions',
+	'-DisableLockscreenTips',
+	'-RevertContextMenu',
+	'-TaskbarAlignLeft',
+	'-HideSearchTb',
+	'-DisableWidgets',
+	'-DisableCopilot',
+	'-ClearStartAllUsers',
+	'-DisableDVR',
+	'-DisableStartRecommended',
+	'-ExplorerToThisPC',
+	'-DisableMouseAcceleration',
+	'-DisableDesktopSpotlight',
+	'-DisableSettings365Ads',
+	'-DisableSettingsHome',
+	'-DisablePaintAI',
+	'-DisableNotepadAI',
+	'-DisableStickyKeys',
+]
+# WinUtil keeps its window open after the tweaks, so its completion message is the
+# signal to stop it. Win11Debloat announces each change on a line starting "> ".
+WINUTIL_RULES = RuleSet([
+	Rule(SUCCESS, 'Tweaks are Finished', literal=True),
+])
+WIN11DEBLOAT_RULES = RuleSet([
+	Rule(PHASE, r"^> (?P<phase>.+?)\.*$"),
+])
 
 
 
@@ -31,8 +74,10 @@ def _download_config(url: str) -> str:
 		except Exception:
 			ctx = ssl.create_default_context()
 	request = urllib.request.Request(url, headers={"User-Agent": "Talon/1.0"})
-	with urllib.request.urlopen(request, timeout=30, context=ctx) as resp:
-		data = resp.read()
+	with span("download WinUtil config", cat="network", url=url) as trace:
+		with urllib.request.urlopen(request, timeout=30, context=ctx) as resp:
+			data = resp.read()
+		trace.set(bytes=len(data))
 	try:
 		json.loads(data.decode("utf-8-sig"))
 	except Exception as e:
@@ -45,12 +90,59 @@ def _download_config(url: str) -> str:
 
 
 
-def main(config_path=None):
+def _get_base_path() -> str:
 	if getattr(sys, 'frozen', False):
-		base_path = os.path.dirname(sys.executable)
+		return os.path.dirname(sys.executable)
+	components_dir = os.path.dirname(os.path.abspath(__file__))
+	return os.path.dirname(components_dir)
+
+
+
+def plan(config_path=None):
+	if config_path and isinstance(config_path, str) and _is_url(config_path):
+		config_desc = f"config downloaded from {config_path}"
 	else:
-		components_dir = os.path.dirname(os.path.abspath(__file__))
-		base_path = os.path.dirname(components_dir)
+		config_desc = config_path or os.path.join(_get_base_path(), 'configs', 'default.json')
+	return [
+		("winutil", f"Run ChrisTitusTech WinUtil -Run -NoUI with {config_desc}"),
+		("win11debloat", f"Run Raphi Win11Debloat {' '.join(WIN11DEBLOAT_ARGS)}"),
+	]
+
+
+
+def _winutil_tweaks(config_path=None):
+	# The WPFTweaks a local WinUtil config selects. A config given as a URL is only
+	# fetched when the step runs, so its tweaks are not known up front.
+	if config_path and isinstance(config_path, str) and _is_url(config_path):
+		return []
+	path = config_path or os.path.join(_get_base_path(), 'configs', 'default.json')
+	try:
+		with open(path, 'r', encoding='utf-8-sig') as f:
+			return list(json.load(f).get('WPFTweaks', []))
+	except Exception as e:
+		logger.warning(f"Could not read WinUtil tweaks from {path}: {e}")
+		return []
+
+
+
+def registry_writes(config_path=None):
+	# What the two scripts are known to write (configs/external_registry_writes.json,
+	# tagged by WinUtil tweak and Win11Debloat switch), in the order they run. These
+	# writes happen inside the scripts; the planner only checks Talon's own against them.
+	catalog = load_catalog(catalog_path("external_registry_writes"))
+	writes = []
+	for tweak_name in _winutil_tweaks(config_path):
+		for tweak in catalog.tagged(f"winutil:{tweak_name}"):
+			writes.append((f"WinUtil {tweak_name}", tweak.change(), False))
+	for arg in WIN11DEBLOAT_ARGS:
+		for tweak in catalog.tagged(f"win11debloat:{arg}"):
+			writes.append((f"Win11Debloat {arg}", tweak.change(), False))
+	return writes
+
+
+
+def _prepare_commands(config_path=None):
+	base_path = _get_base_path()
 	if config_path and isinstance(config_path, str) and _is_url(config_path):
 		try:
 			config_path = _download_config(config_path)
@@ -89,24 +181,6 @@ def main(config_path=None):
 			pass
 		sys.exit(1)
 	cmd1 = f"& '{winutil_path}' -Config '{config_path}' -Run -NoUI"
-	logger.info("Executing ChrisTitusTech WinUtil")
-	try:
-		run_powershell_command(
-			cmd1,
-			monitor_output=True,
-			termination_str='Tweaks are Finished',
-		)
-		logger.info("Successfully executed ChrisTitusTech WinUtil")
-	except Exception as e:
-		logger.error(f"Failed to execute ChrisTitusTech WinUtil: {e}")
-		try:
-			show_error_popup(
-				f"Failed to execute ChrisTitusTech WinUtil:\n{e}",
-				allow_continue=False,
-			)
-		except Exception:
-			pass
-		sys.exit(1)
 	win11debloat_path = os.path.join(base_path, 'external_scripts', 'Raphire-Win11Debloat-c523386', 'Win11Debloat.ps1')
 	if not os.path.exists(win11debloat_path):
 		logger.error(f"Bundled Win11Debloat script not found: {win11debloat_path}")
@@ -118,47 +192,69 @@ def main(config_path=None):
 		except Exception:
 			pass
 		sys.exit(1)
-	args2 = [
-		'-Silent',
-		'-RemoveApps',
-		'-RemoveGamingApps',
-		'-DisableTelemetry',
-		'-DisableBing',
-		'-DisableSuggestions',
-		'-DisableLockscreenTips',
-		'-RevertContextMenu',
-		'-TaskbarAlignLeft',
-		'-HideSearchTb',
-		'-DisableWidgets',
-		'-DisableCopilot',
-		'-ClearStartAllUsers',
-		'-DisableDVR',
-		'-DisableStartRecommended',
-		'-ExplorerToThisPC',
-		'-DisableMouseAcceleration',
-		'-DisableDesktopSpotlight',
-		'-DisableSettings365Ads',
-		'-DisableSettingsHome',
-		'-DisablePaintAI',
-		'-DisableNotepadAI',
-		'-DisableStickyKeys',
-	]
-	flags = ' '.join(args2)
+	flags = ' '.join(WIN11DEBLOAT_ARGS)
 	cmd2 = f"& '{win11debloat_path}' {flags}"
-	logger.info("Executing Raphi Win11Debloat")
-	try:
-		run_powershell_command(cmd2)
-		logger.info("Successfully executed Raphi Win11Debloat")
-	except Exception as e:
-		logger.error(f"Failed to execute Raphi Win11Debloat: {e}")
+	return cmd1, cmd2
+
+
+
+def bundle_actions(config_path=None):
+	cmd1, cmd2 = _prepare_commands(config_path)
+	actions = []
+	if not is_committed(STEP_SLUG, "winutil"):
+		actions.append(BundleAction(
+			STEP_SLUG,
+			"winutil",
+			"ChrisTitusTech WinUtil",
+			command=cmd1,
+			termination_str='Tweaks are Finished',
+		))
+	if not is_committed(STEP_SLUG, "win11debloat"):
+		actions.append(BundleAction(STEP_SLUG, "win11debloat", "Raphi Win11Debloat", command=cmd2))
+	return actions
+
+
+
+def main(config_path=None):
+	cmd1, cmd2 = _prepare_commands(config_path)
+	if is_committed(STEP_SLUG, "winutil"):
+		logger.info("Skipping ChrisTitusTech WinUtil (already completed before the run was interrupted)")
+	else:
+		logger.info("Executing ChrisTitusTech WinUtil")
 		try:
-			show_error_popup(
-				f"Failed to execute Raphi Win11Debloat:\n{e}",
-				allow_continue=False
-			)
-		except Exception:
-			pass
-		sys.exit(1)
+			with timed(STEP_SLUG, "winutil"):
+				run_powershell_command(cmd1, rules=WINUTIL_RULES)
+			logger.info("Successfully executed ChrisTitusTech WinUtil")
+		except Exception as e:
+			logger.error(f"Failed to execute ChrisTitusTech WinUtil: {e}")
+			try:
+				show_error_popup(
+					f"Failed to execute ChrisTitusTech WinUtil:\n{e}",
+					allow_continue=False,
+				)
+			except Exception:
+				pass
+			sys.exit(1)
+		commit(STEP_SLUG, "winutil")
+	if is_committed(STEP_SLUG, "win11debloat"):
+		logger.info("Skipping Raphi Win11Debloat (already completed before the run was interrupted)")
+	else:
+		logger.info("Executing Raphi Win11Debloat")
+		try:
+			with timed(STEP_SLUG, "win11debloat"):
+				run_powershell_command(cmd2, rules=WIN11DEBLOAT_RULES)
+			logger.info("Successfully executed Raphi Win11Debloat")
+		except Exception as e:
+			logger.error(f"Failed to execute Raphi Win11Debloat: {e}")
+			try:
+				show_error_popup(
+					f"Failed to execute Raphi Win11Debloat:\n{e}",
+					allow_continue=False
+				)
+			except Exception:
+				pass
+			sys.exit(1)
+		commit(STEP_SLUG, "win11debloat")
 
 	logger.info("All external debloat scripts executed successfully.")
 
@@ -1,19 +1,155 @@
+import os
 import sys
+import glob
 from utilities.util_logger import logger
-from utilities.util_powershell_handler import run_powershell_script
+from utilities.util_powershell_handler import run_powershell_script, resolve_script_path
 from utilities.util_error_popup import show_error_popup
+from utilities.util_run_journal import is_committed, commit
+from utilities.util_step_probe import summarize, probes_enabled
+from utilities.util_step_timings import timed
+from utilities.util_ps_bundle import BundleAction
+from utilities.util_retry import APPX_DEPLOYMENT_RETRY
+from utilities.util_modify_registry import TreeStats, delete_tree, key_exists
 
 
 
-def main():
-    scripts = [
-        "edge_vanisher.ps1",
-        "uninstall_oo.ps1",
+STEP_SLUG = "execute-raven-scripts"
+SCRIPTS = [
+    "edge_vanisher.ps1",
+    "uninstall_oo.ps1",
+]
+# Edge's leftover registry keys are removed in-process once edge_vanisher.ps1 has run,
+# instead of by Remove-Item -Recurse in the script.
+EDGE_REGISTRY_KEYS = [
+    ("HKLM", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge"),
+    ("HKLM", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge Update"),
+    ("HKLM", r"SOFTWARE\Microsoft\EdgeUpdate"),
+    ("HKCU", r"Software\Microsoft\Edge"),
+    ("HKLM", r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\msedge.exe"),
+    ("HKLM", r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft EdgeUpdate"),
+    ("HKLM", r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft EdgeUpdate"),
+    ("HKLM", r"SOFTWARE\Microsoft\Edge"),
+    ("HKLM", r"SOFTWARE\WOW6432Node\Microsoft\Edge"),
+    ("HKLM", r"SOFTWARE\WOW6432Node\Microsoft\EdgeUpdate"),
+    ("HKLM", r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge"),
+    ("HKLM", r"SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge Update"),
+]
+
+
+
+def _edge_removed() -> bool:
+    program_files_x86 = os.environ.get("ProgramFiles(x86)", r"C:\Program Files (x86)")
+    leftovers = [
+        os.path.join(program_files_x86, "Microsoft", "Edge", "Application", "msedge.exe"),
+        os.path.join(program_files_x86, "Microsoft", "Edge", "Application", "*", "Installer", "setup.exe"),
+        os.path.join(program_files_x86, "Microsoft", "EdgeUpdate", "MicrosoftEdgeUpdate.exe"),
+    ]
+    if any(glob.glob(path) for path in leftovers):
+        return False
+    return not any(key_exists(hive, key_path) for hive, key_path in EDGE_REGISTRY_KEYS)
+
+
+
+def _remove_edge_registry_keys():
+    total = TreeStats()
+    for hive, key_path in EDGE_REGISTRY_KEYS:
+        if key_exists(hive, key_path):
+            total.add(delete_tree(hive, key_path))
+    logger.info(f"Removed Edge registry keys: {total}")
+    if total.failed:
+        logger.warning(f"{total.failed} Edge registry keys could not be deleted")
+
+
+
+def _onedrive_and_outlook_removed() -> bool:
+    local_app_data = os.environ.get("LOCALAPPDATA", "")
+    program_files = os.environ.get("ProgramFiles", r"C:\Program Files")
+    leftovers = [
+        os.path.join(local_app_data, "Microsoft", "OneDrive", "OneDrive.exe"),
+        os.path.join(program_files, "WindowsApps", "Microsoft.OutlookForWindows*"),
     ]
-    for script in scripts:
+    return not any(glob.glob(path) for path in leftovers)
+
+
+
+_SCRIPT_PROBES = {
+    "edge_vanisher.ps1": _edge_removed,
+    "uninstall_oo.ps1": _onedrive_and_outlook_removed,
+}
+
+
+
+def _script_applied(script: str) -> bool:
+    try:
+        return _SCRIPT_PROBES[script]()
+    except Exception as e:
+        logger.warning(f"Could not check whether {script} was already applied: {e}")
+        return False
+
+
+
+def probe():
+    return summarize(_script_applied(script) for script in SCRIPTS)
+
+
+
+_SCRIPT_FOLLOW_UPS = {
+    "edge_vanisher.ps1": _remove_edge_registry_keys,
+}
+
+
+
+def plan():
+    return [(script, f"Run PowerShell script {script}") for script in SCRIPTS] + [
+        (None, f"Delete {len(EDGE_REGISTRY_KEYS)} Edge registry trees in-process")
+    ]
+
+
+
+def bundle_actions():
+    return [
+        BundleAction(STEP_SLUG, script, f"Run PowerShell script {script}", script=resolve_script_path(script))
+        for script in SCRIPTS
+        if not is_committed(STEP_SLUG, script)
+        and not (probes_enabled() and _script_applied(script))
+    ]
+
+
+
+def after_bundle():
+    # Bundled scripts run in PowerShell; their in-process follow-ups run once it is done.
+    for script, follow_up in _SCRIPT_FOLLOW_UPS.items():
+        if script in SCRIPTS:
+            follow_up()
+
+
+
+def _skip_script(script: str):
+    # The follow-ups only act on what is still there, so they run even when the
+    # script itself does not (e.g. Edge's files are gone but its keys are not).
+    follow_up = _SCRIPT_FOLLOW_UPS.get(script)
+    if follow_up is not None:
+        follow_up()
+
+
+
+def main():
+    for script in SCRIPTS:
+        if is_committed(STEP_SLUG, script):
+            logger.info(f"Skipping {script} (already completed before the run was interrupted)")
+            _skip_script(script)
+            continue
+        if probes_enabled() and _script_applied(script):
+            logger.info(f"Skipping {script} (its changes are already in place)")
+            _skip_script(script)
+            continue
         logger.info(f"Executing PowerShell script: {script}")
         try:
-            run_powershell_script(script)
+            with timed(STEP_SLUG, script):
+                run_powershell_script(script, retry=APPX_DEPLOYMENT_RETRY)
+                follow_up = _SCRIPT_FOLLOW_UPS.get(script)
+                if follow_up is not None:
+                    follow_up()
             logger.info(f"Successfully executed {script}")
         except Exception as e:
             logger.error(f"Failed to execute {script}: {e}")
@@ -25,6 +161,7 @@ def main():
             except Exception:
                 pass
             sys.exit(1)
+        commit(STEP_SLUG, script)
 
     logger.info("All debloat scripts executed successfully.")
 
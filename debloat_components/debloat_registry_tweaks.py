@@ -1,59 +1,77 @@
 import sys
-import winreg
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
-from utilities.util_modify_registry import set_value
+from utilities.util_modify_registry import UNCHANGED, WRITTEN, apply_batch, read_batch
+from utilities.util_registry_plan import get_registry_plan
+from utilities.util_step_probe import summarize, probes_enabled
+from utilities.util_tweak_catalog import get_catalog
 
 
 
-def main():
-    registry_modifications = [
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
-         "TaskbarAl", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize",
-         "AppsUseLightTheme", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize",
-         "SystemUsesLightTheme", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\GameDVR",
-         "AppCaptureEnabled", winreg.REG_DWORD, 0),
-        (winreg.HKEY_LOCAL_MACHINE,
-         r"SOFTWARE\Microsoft\PolicyManager\default\ApplicationManagement\AllowGameDVR",
-         "Value", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Control Panel\Desktop",
-         "MenuShowDelay", winreg.REG_SZ, "0"),
-        (winreg.HKEY_CURRENT_USER,
-         r"Control Panel\Desktop\WindowMetrics",
-         "MinAnimate", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
-         "ExtendedUIHoverTime", winreg.REG_DWORD, 1),
-        (winreg.HKEY_CURRENT_USER,
-         r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
-         "HideFileExt", winreg.REG_DWORD, 0),
-        (winreg.HKEY_CURRENT_USER,
-         r"Control Panel\Desktop",
-         "DragFullWindows", winreg.REG_SZ, "1"),
+STEP_SLUG = "registry-tweaks"
+
+
+
+def _changes():
+    # Every tweak in the catalog (configs/registry_tweaks.json), grouped by key.
+    return get_catalog().changes()
+
+
+
+def probe():
+    changes = _changes()
+    current = read_batch(changes)
+    return summarize(
+        previous == (change.value, change.value_type)
+        for change, previous in zip(changes, current)
+    )
+
+
+
+def registry_writes():
+    return [("catalog", tweak.change(), True) for tweak in get_catalog()]
+
+
+
+def plan():
+    return [
+        (None, f"Set {tweak.path} = {tweak.value!r}")
+        for tweak in get_catalog()
     ]
-    for hive, key_path, name, value_type, value in registry_modifications:
+
+
+
+def main():
+    # Values that already match are read, compared and left alone unless probes are off.
+    # With a registry plan the planned writes go out as usual; values an external script
+    # was expected to set earlier in the run are read back and written only if the
+    # script left them different.
+    registry_plan = get_registry_plan()
+    if registry_plan is None:
+        result = apply_batch(_changes(), skip_unchanged=probes_enabled())
+    else:
+        result = apply_batch(registry_plan.writes(STEP_SLUG), skip_unchanged=probes_enabled())
+        covered = registry_plan.covered(STEP_SLUG)
+        if covered:
+            verified = apply_batch(covered, skip_unchanged=True)
+            missed = len(verified.changes(WRITTEN)) + len(verified.failed)
+            if missed:
+                logger.warning(f"{missed} of {len(covered)} registry tweaks were not set by the external scripts")
+            for outcome in verified.outcomes:
+                result.add(outcome)
+    unchanged = len(result.changes(UNCHANGED))
+    if unchanged:
+        logger.info(f"{unchanged} registry tweaks already applied")
+    if not result.ok:
+        logger.error(f"Failed to apply {len(result.failed)} registry tweaks")
         try:
-            logger.info(f"Applying registry tweak: {key_path}\\{name} = {value!r} (type={value_type})")
-            set_value(hive, key_path, name, value, value_type)
-            logger.info(f"Successfully set {name}")
-        except Exception as e:
-            logger.error(f"Failed to apply registry tweak {name}: {e}")
-            try:
-                show_error_popup(
-                    f"Failed to apply registry tweak:\n{key_path}\\{name}\n\n{e}",
-                    allow_continue=False
-                )
-            except Exception:
-                pass
-            sys.exit(1)
+            show_error_popup(
+                f"Failed to apply registry tweaks:\n{result.summary()}",
+                allow_continue=False
+            )
+        except Exception:
+            pass
+        sys.exit(1)
 
     logger.info("All registry tweaks applied successfully.")
 
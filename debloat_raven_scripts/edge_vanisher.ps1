@@ -68,33 +68,6 @@ foreach ($path in $edgePaths) {
         Remove-Item -Path $path -Recurse -Force -ErrorAction SilentlyContinue
     }
 }
-# Clean Edge registry entries
-Write-Host "Cleaning Edge registry entries..." -ForegroundColor Cyan
-$edgeRegKeys = @(
-    "HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge",
-    "HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge Update",
-    "HKLM:\SOFTWARE\Microsoft\EdgeUpdate",
-    "HKCU:\Software\Microsoft\Edge",
-    "HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths\msedge.exe",
-    "HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft EdgeUpdate",
-    "HKLM:\SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft EdgeUpdate",
-    "HKLM:\SOFTWARE\Microsoft\Edge",
-    "HKLM:\SOFTWARE\WOW6432Node\Microsoft\Edge",
-    "HKLM:\SOFTWARE\WOW6432Node\Microsoft\EdgeUpdate",
-    "HKLM:\SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge",
-    "HKLM:\SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall\Microsoft Edge Update"
-)
-foreach ($key in $edgeRegKeys) {
-    if (Test-Path $key) {
-        Write-Host "Deleting registry key: $key" -ForegroundColor Cyan
-        Remove-Item -Path $key -Recurse -Force -ErrorAction SilentlyContinue
-        if (!(Test-Path $key)) {
-            Write-Host "Successfully deleted registry key: $key" -ForegroundColor Green
-        } else {
-            Write-Host "Failed to delete registry key: $key" -ForegroundColor Red
-        }
-    }
-}
 # Force uninstall EdgeUpdate
 $edgeUpdatePath = "${env:ProgramFiles(x86)}\Microsoft\EdgeUpdate\MicrosoftEdgeUpdate.exe"
 if (Test-Path $edgeUpdatePath) {
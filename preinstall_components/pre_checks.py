@@ -4,6 +4,9 @@ import subprocess
 from utilities.util_windows_check import check_windows_11_home_or_pro
 from utilities.util_error_popup import show_error_popup
 from utilities.util_logger import logger
+from utilities.util_trace import span
+from utilities.util_powershell_pool import get_pool
+from utilities.util_powershell_handler import pool_enabled
 from pathlib import Path
 import datetime
 
@@ -70,10 +73,20 @@ def _check_user(max_days):
     except Exception:
         return False
 
+def _query_count(cmd):
+    # Both queries run in a pooled PowerShell host, which later steps reuse.
+    if not pool_enabled():
+        return int(subprocess.check_output(["powershell", "-NoProfile", "-Command", cmd]))
+    output = []
+    result = get_pool().run(cmd, on_stdout=output.extend)
+    if result.status != 0:
+        raise RuntimeError(f"PowerShell query failed (code {result.status})")
+    return int("".join(output).strip())
+
 def _check_boot_count(max_boots):
     try:
         cmd = "(Get-WinEvent -FilterHashtable @{LogName='System'; ID=6005} | Measure-Object).Count"
-        count = int(subprocess.check_output(["powershell", "-NoProfile", "-Command", cmd]))
+        count = _query_count(cmd)
         return count <= max_boots
     except Exception:
         return False
@@ -81,16 +94,22 @@ def _check_boot_count(max_boots):
 def _check_updates(max_updates):
     try:
         cmd = '(New-Object -ComObject "Microsoft.Update.Session").CreateUpdateSearcher().Search("IsInstalled=1").Updates.Count'
-        count = int(subprocess.check_output(["powershell", "-NoProfile", "-Command", cmd]))
+        count = _query_count(cmd)
         return count <= max_updates
     except Exception:
         return False
 
+def _traced_check(name, check, *args):
+    with span(name, cat="precheck") as trace:
+        result = check(*args)
+        trace.set(result=result)
+    return result
+
 def check_system(max_days_since_user_creation=7, max_boots=5, max_updates=5):
     if not all([
-        _check_user(max_days_since_user_creation),
-        _check_boot_count(max_boots),
-        _check_updates(max_updates)
+        _traced_check("user profile age", _check_user, max_days_since_user_creation),
+        _traced_check("boot count", _check_boot_count, max_boots),
+        _traced_check("installed updates", _check_updates, max_updates)
     ]):
         logger.warning("Used windows installation detected!")
         show_error_popup("Warning!\nThis device does not appear to have a fresh installation of Windows.\n" \
@@ -98,8 +117,8 @@ def check_system(max_days_since_user_creation=7, max_boots=5, max_updates=5):
 
 
 def main() -> None:
-    check_windows_11_home_or_pro()
-    _check_temp_writable()
+    _traced_check("windows edition", check_windows_11_home_or_pro)
+    _traced_check("temp writable", _check_temp_writable)
     logger.info("Checking windows installation...")
     check_system()
 
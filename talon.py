@@ -1,62 +1,103 @@
 import os
 import subprocess
 import sys
+import tempfile
 import threading
 import argparse
+import multiprocessing
 from screens import load as load_screen
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QObject, QEvent, QTimer, QMetaObject, Qt, Q_ARG, pyqtSignal
 from utilities.util_admin_check import ensure_admin
-from utilities.util_internet_check import ensure_internet
-import preinstall_components.pre_checks as pre_checks
-import debloat_components.debloat_execute_raven_scripts as debloat_execute_raven_scripts
-import debloat_components.debloat_execute_external_scripts as debloat_execute_external_scripts
-import debloat_components.debloat_browser_installation as debloat_browser_installation
-import debloat_components.debloat_registry_tweaks as debloat_registry_tweaks
-import debloat_components.debloat_configure_updates as debloat_configure_updates
-import debloat_components.debloat_apply_background as debloat_apply_background
+from utilities.util_step_scheduler import run_steps
+from utilities.util_run_journal import start_journal, compute_config_hash, is_committed, commit, record_outcome
+from utilities.util_step_probe import SATISFIED, run_probe, set_probes_enabled
+from utilities.util_step_timings import get_timings, estimate, timed, format_duration
+from utilities.util_trace import enable_tracing, span, write_trace
+from utilities.util_watchdog import deadline
+from utilities.util_step_registry import StepSpec, discover_steps
+from utilities.util_output_rules import set_progress_listener
+from utilities.util_registry_journal import start_registry_journal, close_registry_journal, get_registry_journal
 from ui_components.ui_base_full import UIBaseFull
 from ui_components.ui_header_text import UIHeaderText
 from ui_components.ui_title_text import UITitleText
 from ui_components.ui_loading_spinner import UILoadingSpinner
+# Modules that pull in the registry backend, the process engine (asyncio, ssl) or
+# ctypes are imported where they are used, after ensure_admin where possible.
 
 
 
 _INSTALL_UI_BASE = None
-DEBLOAT_STEPS = [
-	(
+# Steps are declared by import path and only imported once scheduled. Steps whose
+# dependencies are met run concurrently unless they share a resource. Timeouts are the
+# default per-step deadlines in seconds, generous enough for slow hardware; when one
+# passes, the watchdog kills the step's process trees and the step fails as timed out.
+DEBLOAT_STEPS = discover_steps([
+	StepSpec(
 		"execute-raven-scripts",
 		"Executing initial debloating scripts...",
-		debloat_execute_raven_scripts.main,
+		"debloat_components.debloat_execute_raven_scripts:main",
+		resources=("appx", "edge"),
+		timeout=1200,
 	),
-	(
+	StepSpec(
 		"browser-installation",
 		"Installing your chosen browser...",
-		debloat_browser_installation.main,
+		"debloat_components.debloat_browser_installation:main",
+		# edge_vanisher.ps1 tears down Edge and its updater and registrations; a browser
+		# installed while it runs could lose the default-browser and file associations.
+		depends_on=("execute-raven-scripts",),
+		resources=("chocolatey", "network"),
+		timeout=2700,
 	),
-	(
+	StepSpec(
 		"execute-external-scripts",
 		"Debloating Windows...",
-		debloat_execute_external_scripts.main,
+		"debloat_components.debloat_execute_external_scripts:main",
+		depends_on=("execute-raven-scripts",),
+		resources=("appx", "user-registry", "services"),
+		timeout=5400,
+		takes_config=True,
 	),
-	(
+	StepSpec(
 		"registry-tweaks",
 		"Making some visual tweaks...",
-		debloat_registry_tweaks.main,
+		"debloat_components.debloat_registry_tweaks:main",
+		depends_on=("execute-external-scripts",),
+		resources=("user-registry",),
+		timeout=300,
 	),
-	(
+	StepSpec(
 		"configure-updates",
 		"Configuring Windows Update policies...",
-		debloat_configure_updates.main,
+		"debloat_components.debloat_configure_updates:main",
+		depends_on=("execute-external-scripts",),
+		resources=("update-policy", "services"),
+		timeout=600,
 	),
-	(
+	StepSpec(
 		"apply-background",
 		"Setting your desktop background...",
-		debloat_apply_background.main,
+		"debloat_components.debloat_apply_background:main",
+		depends_on=("execute-external-scripts",),
+		resources=("desktop",),
+		timeout=120,
 	),
-]
+])
+STEP_TIMEOUTS = {spec.slug: spec.timeout for spec in DEBLOAT_STEPS}
+
+
+
+def _parse_step_timeout(value: str):
+	slug, sep, seconds = value.partition("=")
+	if not sep or slug not in STEP_TIMEOUTS:
+		raise argparse.ArgumentTypeError(f"expected SLUG=SECONDS with SLUG one of {', '.join(STEP_TIMEOUTS)}")
+	try:
+		return slug, float(seconds)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"invalid number of seconds: {seconds!r}")
 
 
 
@@ -78,7 +119,91 @@ def parse_args(argv=None):
 		metavar="PATH",
 		help="Pass a custom WinUtil configuration to use instead of the default Talon configuration.",
 	)
-	for slug, _, _ in DEBLOAT_STEPS:
+	parser.add_argument(
+		"--plan",
+		action="store_true",
+		help="Print the actions a run would perform, with estimated durations from previous runs, without executing anything.",
+	)
+	parser.add_argument(
+		"--timings-file",
+		dest="timings_file",
+		metavar="PATH",
+		help="Read and record step timings in this file instead of the default location in %%TEMP%%\\talon.",
+	)
+	parser.add_argument(
+		"--trace-out",
+		dest="trace_out",
+		metavar="PATH",
+		help="Record a timeline of the run (steps, PowerShell processes, registry writes, checks, network calls) as Trace Event JSON for chrome://tracing or Perfetto.",
+	)
+	parser.add_argument(
+		"--bundle",
+		action="store_true",
+		help="Compile the PowerShell work of the run into a single script and run it in one PowerShell process.",
+	)
+	parser.add_argument(
+		"--bundle-out",
+		dest="bundle_out",
+		metavar="PATH",
+		help="Write the compiled PowerShell bundle for this configuration to PATH for review, without running anything.",
+	)
+	parser.add_argument(
+		"--no-powershell-pool",
+		dest="powershell_pool",
+		action="store_false",
+		help="Start a fresh PowerShell process for every script and command instead of reusing pooled hosts.",
+	)
+	parser.add_argument(
+		"--resume",
+		action="store_true",
+		help="Resume an interrupted run, skipping steps and actions that already completed with the same configuration.",
+	)
+	parser.add_argument(
+		"--rollback",
+		nargs="?",
+		const="",
+		metavar="PATH",
+		help="Undo the registry changes Talon made in its last run (or those recorded in the undo journal at PATH) and exit.",
+	)
+	parser.add_argument(
+		"--reg-file",
+		dest="reg_files",
+		metavar="PATH",
+		action="append",
+		default=[],
+		help="Import a .reg file after the debloat steps, recorded in the undo journal like Talon's own changes. May be given more than once.",
+	)
+	parser.add_argument(
+		"--export-reg",
+		dest="export_reg",
+		metavar="PATH",
+		help="When the run ends, write the registry keys it changed, with everything below them, to PATH as a .reg file.",
+	)
+	parser.add_argument(
+		"--no-probes",
+		dest="probes",
+		action="store_false",
+		help="Run every step in full, even when its probe reports the changes are already applied.",
+	)
+	parser.add_argument(
+		"--step-timeout",
+		dest="step_timeouts",
+		metavar="SLUG=SECONDS",
+		type=_parse_step_timeout,
+		action="append",
+		default=[],
+		help="Override the deadline of a step (0 disables it). May be given more than once.",
+	)
+	parser.add_argument(
+		"--max-parallel-steps",
+		dest="max_parallel_steps",
+		metavar="N",
+		type=int,
+		default=None,
+		help="Limit how many independent debloat steps may run at the same time (1 runs them strictly in order).",
+	)
+	for spec in DEBLOAT_STEPS:
+		slug = spec.slug
 		dest = f"skip_{slug.replace('-', '_')}_step"
 		parser.add_argument(
 			f"--skip-{slug}-step",
@@ -90,6 +215,11 @@ def parse_args(argv=None):
 
 
 
+def _is_skipped(args, slug: str) -> bool:
+	return getattr(args, f"skip_{slug.replace('-', '_')}_step", False)
+
+
+
 def run_screen(module_name: str):
 	logger.debug(f"Launching screen: {module_name}")
 	try:
@@ -179,6 +309,220 @@ def _build_install_ui():
 
 
 
+def _config_hash(args) -> str:
+	parts = [args.config or "default"]
+	if args.config and os.path.isfile(args.config):
+		with open(args.config, "rb") as f:
+			parts.append(f.read())
+	choice_file = os.path.join(os.environ.get("TEMP", tempfile.gettempdir()), "talon", "browser_choice.json")
+	if not args.skip_browser_installation_step and os.path.exists(choice_file):
+		with open(choice_file, "rb") as f:
+			parts.append(f.read())
+	return compute_config_hash(*parts)
+
+
+
+def _plan_registry_writes(args):
+	# Every step that is not skipped declares its registry writes (registry_writes hook)
+	# in step order, which is also dependency order; the resolved plan tells steps that
+	# write through util_modify_registry which of their writes are still needed.
+	from utilities.util_registry_plan import RegistryPlan
+	plan = RegistryPlan()
+	for spec in DEBLOAT_STEPS:
+		if _is_skipped(args, spec.slug):
+			continue
+		registry_writes = spec.hook("registry_writes")
+		if registry_writes is None:
+			continue
+		writes = registry_writes(args.config) if spec.takes_config else registry_writes()
+		for source, change, owned in writes:
+			plan.add(spec.slug, source, change, owned)
+	return plan.resolve()
+
+
+
+def _print_plan(args):
+	print("Talon run plan")
+	print(f"  WinUtil config: {args.config or 'default Talon configuration'}")
+	print(f"  Timings source: {get_timings().path}")
+	finish = {}
+	serial_total = 0.0
+	unknown = []
+	for spec in DEBLOAT_STEPS:
+		slug = spec.slug
+		if _is_skipped(args, slug):
+			print(f"\n[skipped] {slug}")
+			continue
+		plan = spec.hook("plan")
+		if plan is None:
+			actions = [(None, "Run step")]
+		elif spec.takes_config:
+			actions = plan(args.config)
+		else:
+			actions = plan()
+		action_estimates = [estimate(slug, action) for action, _ in actions if action]
+		step_estimate = estimate(slug)
+		if step_estimate is None and action_estimates and None not in action_estimates:
+			step_estimate = sum(action_estimates)
+		if step_estimate is None:
+			unknown.append(slug)
+		print(f"\n[{slug}] ~{format_duration(step_estimate)}")
+		for action, description in actions:
+			suffix = f" (~{format_duration(estimate(slug, action))})" if action else ""
+			print(f"  - {description}{suffix}")
+		step_estimate = step_estimate or 0.0
+		serial_total += step_estimate
+		finish[slug] = step_estimate + max((finish[dep] for dep in spec.depends_on if dep in finish), default=0.0)
+	print()
+	if args.headless:
+		print("Restart: suppressed (--headless)")
+	else:
+		print("Restart: shutdown /r /t 0")
+	print(f"Estimated duration: {format_duration(max(finish.values(), default=0.0))} with parallel steps, {format_duration(serial_total)} run one by one")
+	if unknown:
+		print(f"No recorded timings yet for: {', '.join(unknown)} (not included in the estimate)")
+	registry_plan = _plan_registry_writes(args)
+	print(f"Registry: {registry_plan.summary()}")
+	for line in registry_plan.conflict_lines():
+		print(f"  ! {line}")
+
+
+
+def _bundle_actions(spec, args):
+	bundle_actions = spec.hook("bundle_actions")
+	if spec.takes_config:
+		return bundle_actions(args.config)
+	return bundle_actions()
+
+
+
+def _bundled_steps(schedule):
+	# A step joins the bundle when it has PowerShell actions to contribute and every
+	# scheduled step it depends on is in the bundle too, since the bundle runs first.
+	specs = {spec.slug: spec for spec in DEBLOAT_STEPS}
+	scheduled = {slug for slug, _, _ in schedule}
+	bundled = []
+	for slug, depends_on, _ in schedule:
+		if specs[slug].hook("bundle_actions") is None:
+			continue
+		if all(dep in bundled or dep not in scheduled for dep in depends_on):
+			bundled.append(slug)
+	return bundled
+
+
+
+def _write_bundle_out(args):
+	from utilities.util_ps_bundle import compile_bundle, write_bundle
+	actions = []
+	for spec in DEBLOAT_STEPS:
+		if _is_skipped(args, spec.slug) or spec.hook("bundle_actions") is None:
+			continue
+		try:
+			actions.extend(_bundle_actions(spec, args))
+		except Exception as e:
+			print(f"Left {spec.slug} out of the bundle: {e}")
+	path = write_bundle(compile_bundle(actions), args.bundle_out)
+	print(f"Wrote PowerShell bundle with {len(actions)} actions to {path}")
+
+
+
+def _run_bundled_steps(args, slugs, step_timeouts, on_start):
+	from utilities.util_ps_bundle import run_bundle
+	from utilities.util_resource_usage import charge_to
+	specs = {spec.slug: spec for spec in DEBLOAT_STEPS}
+	actions = []
+	ready = []
+	for slug in slugs:
+		spec = specs[slug]
+		probe = spec.hook("probe")
+		if args.probes and probe is not None and run_probe(slug, probe) == SATISFIED:
+			logger.info(f"Skipping {slug} step (already applied)")
+			commit(slug)
+			continue
+		try:
+			actions.extend(_bundle_actions(spec, args))
+		except Exception as e:
+			logger.error(f"Failed to prepare {slug} for the PowerShell bundle: {e}")
+			show_error_popup(f"Failed to prepare the {slug} step:\n{e}", allow_continue=False)
+			sys.exit(1)
+		ready.append(slug)
+
+	def on_action_end(action):
+		if action.succeeded:
+			commit(action.step, action.action)
+			if action.duration is not None:
+				get_timings().record(action.step, action.action, action.duration)
+	timeouts = [step_timeouts.get(slug) for slug in ready]
+	timeout = sum(timeouts) if all(timeouts) else None
+	with span("powershell bundle", cat="step", steps=ready, actions=len(actions)), \
+			deadline("PowerShell bundle", timeout), charge_to("powershell-bundle"):
+		run_bundle(actions, on_action_start=on_start, on_action_end=on_action_end)
+	for action in actions:
+		if action.status is None or action.succeeded:
+			continue
+		message = f"{action.description} failed (exit code {action.status})"
+		if action.error:
+			message += f"\n{action.error}"
+		logger.error(message)
+		record_outcome(action.step, "failed", action.action)
+		show_error_popup(message, allow_continue=not action.fatal)
+		if action.fatal:
+			sys.exit(1)
+	for slug in ready:
+		after_bundle = specs[slug].hook("after_bundle")
+		if after_bundle is not None:
+			with span(f"{slug} after bundle", cat="step"), charge_to(slug):
+				after_bundle()
+		commit(slug)
+
+
+
+def _rollback_registry(path):
+	from utilities.util_modify_registry import rollback
+	try:
+		counts = rollback(path)
+	except FileNotFoundError as e:
+		print(f"No registry undo journal found: {e.filename}")
+		sys.exit(1)
+	except Exception as e:
+		logger.exception(f"Registry rollback failed: {e}")
+		show_error_popup(f"Failed to roll back registry changes:\n{e}", allow_continue=False)
+		sys.exit(1)
+	print(f"Registry rollback: {counts['restored']} restored, {counts['deleted']} deleted, {counts['failed']} failed")
+	if counts["failed"]:
+		sys.exit(1)
+
+
+
+def _import_reg_files(paths):
+	from utilities.util_reg_file import import_reg_file
+	from utilities.util_resource_usage import charge_to
+	for path in paths:
+		try:
+			with span("reg-file", cat="step", file=path), timed("reg-file", os.path.basename(path)), charge_to("reg-file"):
+				counts = import_reg_file(path)
+		except Exception as e:
+			logger.exception(f"Failed to import {path}: {e}")
+			show_error_popup(f"Failed to import registry file:\n{path}\n\n{e}", allow_continue=False)
+			raise
+		if counts["failed"]:
+			show_error_popup(f"Failed to apply {counts['failed']} entries of {path}. See talon.log for details.", allow_continue=True)
+
+
+
+def _export_reg(path):
+	from utilities.util_reg_file import export_touched
+	journal = get_registry_journal()
+	if journal is None:
+		return
+	journal.flush()
+	try:
+		export_touched(path, journal.path)
+	except Exception as e:
+		logger.exception(f"Failed to export registry changes to {path}: {e}")
+
+
+
 def _update_status(bus, label: UIHeaderText, message: str):
 	if label is None:
 		print(message)
@@ -193,10 +537,26 @@ def main(argv=None):
 	if args.headless:
 		args.developer_mode = True
 		args.skip_browser_installation_step = True
+	get_timings(args.timings_file)
+	if args.plan:
+		_print_plan(args)
+		return
+	if args.bundle_out:
+		_write_bundle_out(args)
+		return
 	ensure_admin()
+	if args.rollback is not None:
+		_rollback_registry(args.rollback or None)
+		return
+	from utilities.util_powershell_handler import set_pool_enabled
+	import preinstall_components.pre_checks as pre_checks
+	set_pool_enabled(args.powershell_pool)
+	if args.trace_out:
+		enable_tracing(args.trace_out)
 	logger.debug(f"Running with args {sys.argv[1:]}")
 	pre_checks.main()
 	if not args.headless:
+		from utilities.util_internet_check import ensure_internet
 		online = ensure_internet(allow_continue=True)
 		if online:
 			run_screen("screen_browser_select")
@@ -207,28 +567,93 @@ def main(argv=None):
 	status_label = None
 	spinner = None
 	bus = None
+	idle = None
 	if not args.developer_mode:
 		global _INSTALL_UI_BASE
 		app, status_label, _INSTALL_UI_BASE, spinner, bus = _build_install_ui()
 
+	start_journal(_config_hash(args), resume=args.resume)
+	# The registry undo journal is always recorded; a resumed run keeps adding to it.
+	start_registry_journal(append=args.resume)
+	set_probes_enabled(args.probes)
+
 	def debloat_sequence():
+		from utilities.util_registry_plan import set_registry_plan, log_registry_plan
+		from utilities.util_resource_usage import charge_to
+		from utilities.util_run_report import write_report, record_registry_plan
 		if bus is not None:
 			bus.start.emit()
 			bus.raiseit.emit()
-		for slug, message, func in DEBLOAT_STEPS:
-			if getattr(args, f"skip_{slug.replace('-', '_')}_step"):
+		steps = {spec.slug: spec for spec in DEBLOAT_STEPS}
+		step_timeouts = dict(STEP_TIMEOUTS, **dict(args.step_timeouts))
+		schedule = []
+		for spec in DEBLOAT_STEPS:
+			slug = spec.slug
+			if _is_skipped(args, slug):
 				logger.info(f"Skipping {slug} step")
 				continue
-			_update_status(bus, status_label, message)
-			try:
-				if func is debloat_execute_external_scripts.main:
-					func(args.config)
-				else:
-					func()
-			except Exception:
-				if bus is not None:
-					bus.stop.emit()
+			if is_committed(slug):
+				logger.info(f"Skipping {slug} step (already completed before the run was interrupted)")
+				continue
+			schedule.append((slug, spec.depends_on, spec.resources))
+		try:
+			registry_plan = _plan_registry_writes(args)
+		except Exception as e:
+			# Without a plan every step writes what it declares, as before.
+			logger.warning(f"Could not plan registry writes: {e}")
+		else:
+			log_registry_plan(registry_plan)
+			record_registry_plan(registry_plan.as_dict())
+			set_registry_plan(registry_plan)
+
+		def run_step(slug):
+			spec = steps[slug]
+			probe = spec.hook("probe")
+			if args.probes and probe is not None and run_probe(slug, probe) == SATISFIED:
+				logger.info(f"Skipping {slug} step (already applied)")
+				commit(slug)
 				return
+			_update_status(bus, status_label, spec.message)
+			scope = None
+			try:
+				with deadline(f"{slug} step", step_timeouts.get(slug)) as scope, \
+						span(slug, cat="step") as trace, timed(slug), charge_to(slug):
+					spec.run(args.config)
+			except BaseException:
+				if scope is not None and scope.timed_out:
+					logger.error(f"Step {slug} timed out after {step_timeouts[slug]:g}s")
+					trace.set(outcome="timeout")
+					record_outcome(slug, "timeout")
+				raise
+			commit(slug)
+
+		def on_bundle_action(action):
+			_update_status(bus, status_label, steps[action.step].message)
+
+		# Progress and phase markers matched in script output replace the status text.
+		set_progress_listener(lambda text: _update_status(bus, status_label, text))
+
+		try:
+			if args.bundle:
+				bundled = _bundled_steps(schedule)
+				schedule = [entry for entry in schedule if entry[0] not in bundled]
+				_run_bundled_steps(args, bundled, step_timeouts, on_bundle_action)
+			run_steps(schedule, run_step, max_workers=args.max_parallel_steps, idle=idle)
+			if args.reg_files:
+				_import_reg_files(args.reg_files)
+		except Exception:
+			if bus is not None:
+				bus.stop.emit()
+			return
+		finally:
+			set_progress_listener(None)
+			# Retried actions, how they ended and what each step's children cost; kept
+			# even when the run fails.
+			write_report()
+			if args.export_reg:
+				_export_reg(args.export_reg)
+			close_registry_journal()
+		write_trace()
 		if args.headless:
 			_update_status(bus, status_label, "Suppressing system restart due to --headless flag used")
 			if bus is not None:
@@ -241,6 +666,10 @@ def main(argv=None):
 			subprocess.call(["shutdown", "/r", "/t", "0"])
 
 	if args.developer_mode or args.headless:
+		# Steps run on worker threads; keep the Qt event loop turning here so error
+		# popups raised from those threads can still be shown.
+		app = QApplication.instance() or QApplication(sys.argv)
+		idle = app.processEvents
 		debloat_sequence()
 	else:
 		def start_thread():
@@ -251,4 +680,6 @@ def main(argv=None):
 
 
 if __name__ == "__main__":
+	# The script worker pool spawns Talon.exe itself in the frozen build.
+	multiprocessing.freeze_support()
 	main()
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.util_registry_backend import MemoryBackend, set_backend
+
+
+
+@pytest.fixture
+def memory_registry():
+    # Every registry call in the test goes to a fresh in-memory registry.
+    backend = MemoryBackend()
+    previous = set_backend(backend)
+    yield backend
+    set_backend(previous)
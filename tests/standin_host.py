@@ -0,0 +1,30 @@
+import sys
+import base64
+import subprocess
+
+# Stands in for the PowerShell host loop on machines without powershell.exe: same
+# request and DONE-marker protocol, but each request is run as Python. SystemExit ends
+# the host with its code, as `exit N` does in PowerShell; other exceptions are the
+# terminating errors the loop catches. native() runs a program and only records its
+# code, like a native command setting $LASTEXITCODE.
+def native(*cmd):
+    global LASTEXITCODE
+    LASTEXITCODE = subprocess.run(cmd).returncode
+
+
+
+LASTEXITCODE = 0
+for line in sys.stdin.buffer:
+    request_id, payload = line.decode("ascii").rstrip("\n").split(" ", 1)
+    status = 0
+    try:
+        exec(compile(base64.b64decode(payload).decode("utf-8"), "<command>", "exec"), {"__name__": "__command__", "native": native})
+    except SystemExit:
+        raise
+    except BaseException as e:
+        sys.stderr.write(f"{e}\n")
+        status = 1
+    sys.stdout.write(f"##TALON-DONE {request_id} {status}\n")
+    sys.stdout.flush()
+    sys.stderr.write(f"##TALON-DONE {request_id}\n")
+    sys.stderr.flush()
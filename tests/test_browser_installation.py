@@ -0,0 +1,20 @@
+import os
+import stat
+import debloat_components.debloat_browser_installation as browser_installation
+
+
+
+def test_chocolatey_on_path_is_found_with_its_lib_dir(monkeypatch, tmp_path):
+    bin_dir = tmp_path / "tools" / "choco" / "bin"
+    bin_dir.mkdir(parents=True)
+    for name in ("choco", "choco.exe"):
+        exe = bin_dir / name
+        exe.write_text("")
+        exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    (tmp_path / "tools" / "choco" / "lib" / "vcredist140").mkdir(parents=True)
+    monkeypatch.delenv("ChocolateyInstall", raising=False)
+    monkeypatch.setenv("ProgramData", str(tmp_path / "ProgramData"))
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ.get("PATH", ""))
+    assert browser_installation._find_choco_exe() is not None
+    assert browser_installation._get_choco_lib_dir() == str(tmp_path / "tools" / "choco" / "lib")
+    assert browser_installation._is_choco_package_installed("vcredist140")
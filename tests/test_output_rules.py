@@ -0,0 +1,21 @@
+import pytest
+from utilities.util_output_rules import FATAL, PROGRESS, Rule, RuleSet
+
+
+
+@pytest.mark.parametrize("pattern", [r"(?i)access denied", r"(\w+) \1", r"(?P<word>\w+) (?P=word)"])
+def test_patterns_that_break_the_alternation_are_rejected(pattern):
+    with pytest.raises(ValueError):
+        Rule(FATAL, pattern)
+
+
+
+def test_each_rule_reads_its_own_groups():
+    rules = RuleSet([
+        Rule(FATAL, r"(?i:access denied)"),
+        Rule(PROGRESS, r"(?P<current>\d+)/(?P<total>\d+)"),
+        Rule(PROGRESS, r"(?P<percent>\d+)%"),
+    ])
+    assert rules.match("ACCESS DENIED").kind == FATAL
+    assert rules.match("step 3/4").percent == 75
+    assert rules.match("done 40%").percent == 40
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import pytest
+from utilities.util_output_rules import PHASE, POWERSHELL_FATAL_RULES, Rule, RuleSet, set_progress_listener
+from utilities.util_powershell_handler import _script_invocation, run_powershell_command
+from utilities.util_powershell_pool import IDLE_CHECK, PowerShellPool, set_pool
+
+
+
+STANDIN_HOST = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin_host.py")]
+
+
+
+@pytest.fixture
+def pool():
+    pool = PowerShellPool(size=2, max_commands=5, command=STANDIN_HOST)
+    previous = set_pool(pool)
+    yield pool
+    set_pool(previous)
+    pool.close()
+
+
+
+def _collect():
+    lines = []
+    return lines, lines.extend
+
+
+
+def test_host_is_reused_and_output_comes_in_batches(pool):
+    lines, on_stdout = _collect()
+    batches = []
+    first = pool.run("for i in range(1000): print(f'line {i}')", on_stdout=lambda batch: (batches.append(len(batch)), on_stdout(batch)))
+    assert first.status == 0
+    assert lines == [f"line {i}" for i in range(1000)]
+    assert len(batches) < 1000
+    hosts = []
+    assert pool.run("print('again')", on_host=hosts.append).status == 0
+    assert hosts[0].commands_run == 2
+
+
+
+def test_only_exit_sets_the_status(pool):
+    # A failing native command leaves the status at 0, as it does under -File.
+    out, on_stdout = _collect()
+    result = pool.run(f"native({sys.executable!r}, '-c', 'raise SystemExit(4)')\nprint('after')", on_stdout=on_stdout)
+    assert (result.status, out) == (0, ["after"])
+    assert pool.run("raise SystemExit(7)").status == 7
+    assert pool.run("raise RuntimeError('boom')").status == 1
+
+
+
+def test_stderr_is_kept_apart_from_stdout(pool):
+    out, on_stdout = _collect()
+    err, on_stderr = _collect()
+    result = pool.run("import sys\nprint('out')\nsys.stderr.write('err\\n')", on_stdout=on_stdout, on_stderr=on_stderr)
+    assert (result.status, out, err) == (0, ["out"], ["err"])
+
+
+
+def test_fatal_rule_kills_the_host_without_waiting(pool):
+    hosts = []
+    start = time.monotonic()
+    result = pool.run(
+        "import time\nprint('File x.ps1 cannot be loaded because running scripts is disabled on this system.', flush=True)\ntime.sleep(30)",
+        rules=POWERSHELL_FATAL_RULES,
+        on_host=hosts.append,
+    )
+    assert time.monotonic() - start < 10
+    assert result.fatal is not None and result.status != 0
+    assert not hosts[0].alive()
+    assert pool.run("pass").status == 0
+
+
+
+def test_cancellation_is_seen_while_the_command_keeps_printing(pool):
+    batches = []
+    start = time.monotonic()
+    result = pool.run(
+        "import itertools\nfor i in itertools.count(): print(i, flush=True)",
+        on_stdout=batches.append,
+        cancelled=lambda: len(batches) >= 3,
+    )
+    assert time.monotonic() - start < 10
+    assert result.status != 0
+
+
+
+def test_cancellation_is_seen_while_the_command_is_quiet(pool):
+    start = time.monotonic()
+    result = pool.run("import time\ntime.sleep(30)", cancelled=lambda: time.monotonic() - start > 0.2)
+    assert time.monotonic() - start < 0.2 + IDLE_CHECK + 5
+    assert result.status != 0
+
+
+
+def test_host_exit_during_a_command(pool):
+    hosts = []
+    assert pool.run("import os\nos._exit(3)", on_host=hosts.append).status == 3
+    assert not hosts[0].alive()
+
+
+
+def test_command_through_the_handler_reports_rules(pool):
+    output = []
+    phases = []
+    set_progress_listener(phases.append)
+    try:
+        rc = run_powershell_command(
+            "print('> Disabling telemetry...')\nprint('done')",
+            rules=RuleSet([Rule(PHASE, r"^> (?P<phase>.+?)\.*$")]),
+            on_output=output.append,
+            pooled=True,
+        )
+    finally:
+        set_progress_listener(None)
+    assert rc == 0
+    assert output == ["> Disabling telemetry...", "done"]
+    assert phases == ["Disabling telemetry"]
+
+
+
+def test_switches_reach_the_script_as_parameters():
+    assert _script_invocation("C:\\Scripts\\it's.ps1", ["-Silent", "-Mode", "Full Run", "-5"]) == (
+        "& 'C:\\Scripts\\it''s.ps1' -Silent -Mode 'Full Run' '-5'"
+    )
@@ -0,0 +1,20 @@
+from utilities.util_modify_registry import create_key, key_exists
+import debloat_components.debloat_execute_raven_scripts as raven_scripts
+
+
+
+def test_edge_keys_removed_when_script_is_skipped(memory_registry, monkeypatch, tmp_path):
+    for variable in ("ProgramFiles(x86)", "ProgramFiles", "LOCALAPPDATA"):
+        monkeypatch.setenv(variable, str(tmp_path))
+    hive, key_path = raven_scripts.EDGE_REGISTRY_KEYS[0]
+    create_key(hive, key_path + "\\Child")
+    assert not raven_scripts._edge_removed()
+
+    def no_script(*args, **kwargs):
+        raise AssertionError("no script should run")
+
+    monkeypatch.setattr(raven_scripts, "run_powershell_script", no_script)
+    monkeypatch.setitem(raven_scripts._SCRIPT_PROBES, "edge_vanisher.ps1", lambda: True)
+    raven_scripts.main()
+    monkeypatch.undo()
+    assert not key_exists(hive, key_path)
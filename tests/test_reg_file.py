@@ -0,0 +1,41 @@
+from utilities.util_modify_registry import set_value
+from utilities.util_registry_backend import HKEY_CURRENT_USER, REG_DWORD
+from utilities.util_reg_file import KEY, _collapse, export_reg_file, read_reg_file
+
+
+
+def test_collapse_keeps_sibling_with_shared_prefix():
+    # "Foo Bar" sorts between "Foo" and "Foo\Sub" as a plain string.
+    roots = _collapse([
+        ("HKCU", "Software\\Foo"),
+        ("HKCU", "Software\\Foo Bar"),
+        ("HKCU", "Software\\Foo\\Sub"),
+        ("HKCU", "Software\\Foo-Baz\\Deep"),
+    ])
+    assert roots == [
+        (HKEY_CURRENT_USER, "Software\\Foo"),
+        (HKEY_CURRENT_USER, "Software\\Foo Bar"),
+        (HKEY_CURRENT_USER, "Software\\Foo-Baz\\Deep"),
+    ]
+
+
+
+def test_collapse_ignores_case():
+    roots = _collapse([("HKCU", "Software\\foo\\SUB"), ("HKCU", "SOFTWARE\\Foo")])
+    assert roots == [(HKEY_CURRENT_USER, "SOFTWARE\\Foo")]
+
+
+
+def test_export_writes_each_key_once(memory_registry, tmp_path):
+    set_value("HKCU", "Software\\Foo", "A", 1, REG_DWORD)
+    set_value("HKCU", "Software\\Foo\\Sub", "B", 2, REG_DWORD)
+    set_value("HKCU", "Software\\Foo Bar", "C", 3, REG_DWORD)
+    path = tmp_path / "export.reg"
+    counts = export_reg_file(str(path), [
+        ("HKCU", "Software\\Foo"),
+        ("HKCU", "Software\\Foo Bar"),
+        ("HKCU", "Software\\Foo\\Sub"),
+    ])
+    assert counts == {"keys": 3, "values": 3, "deleted": 0}
+    keys = [op.key_path for op in read_reg_file(str(path)) if op.op == KEY]
+    assert sorted(keys) == sorted(set(keys))
@@ -0,0 +1,59 @@
+from utilities.util_modify_registry import RegistryChange, read_batch
+from utilities.util_registry_plan import RegistryPlan, set_registry_plan
+import debloat_components.debloat_registry_tweaks as registry_tweaks
+
+
+
+def _change(value, name="V", key="Software\\Talon"):
+    return RegistryChange("HKCU", key, name, value)
+
+
+
+def test_later_owned_write_replaces_earlier():
+    plan = RegistryPlan()
+    plan.add("a", "first", _change(1))
+    plan.add("b", "second", _change(2, key="software\\talon", name="v"))
+    plan.resolve()
+    assert [change.value for change in plan.writes()] == [2]
+    assert len(plan.conflicts) == 1
+    assert plan.conflict_lines()[0].endswith("; b wins")
+
+
+
+def test_write_made_by_external_script_is_dropped():
+    plan = RegistryPlan()
+    plan.add("script", "external", _change(0), owned=False)
+    plan.add("tweaks", "catalog", _change(0))
+    plan.add("tweaks", "catalog", _change(1, name="Other"))
+    plan.resolve()
+    assert [change.name for change in plan.writes("tweaks")] == ["Other"]
+    assert [change.name for change in plan.covered("tweaks")] == ["V"]
+    assert len(plan.duplicates) == 1 and not plan.conflicts
+
+
+
+def test_external_write_with_other_data_keeps_owned_write():
+    plan = RegistryPlan()
+    plan.add("script", "external", _change(1), owned=False)
+    plan.add("tweaks", "catalog", _change(0))
+    plan.resolve()
+    assert [change.value for change in plan.writes()] == [0]
+    assert not plan.covered()
+
+
+
+def test_registry_tweaks_writes_covered_value_the_script_missed(memory_registry):
+    plan = RegistryPlan()
+    tweaks = registry_tweaks.registry_writes()
+    covered = tweaks[0][1]
+    plan.add("execute-external-scripts", "script", covered, owned=False)
+    for source, change, owned in tweaks:
+        plan.add(registry_tweaks.STEP_SLUG, source, change, owned)
+    set_registry_plan(plan.resolve())
+    try:
+        registry_tweaks.main()
+    finally:
+        set_registry_plan(None)
+    values = read_batch([change for _, change, _ in tweaks])
+    assert values[0] is not None and values[0][0] == covered.value
+    assert all(value is not None for value in values[1:])
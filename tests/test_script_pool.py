@@ -0,0 +1,82 @@
+import os
+import time
+import pytest
+from utilities.util_debloat_thread_handler import POOL_MODE, PROCESS_MODE, ScriptProcessHandler, run_scripts_threaded
+from utilities.util_script_pool import get_script_pool, shutdown_script_pool
+from utilities.util_watchdog import StepTimeoutError
+
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    quick = tmp_path / "quick.py"
+    quick.write_text("print('done')\n")
+    slow = tmp_path / "slow.py"
+    slow.write_text("import time\ntime.sleep(60)\n")
+    yield str(quick), str(slow)
+    shutdown_script_pool()
+
+
+
+def _alive(pid: int) -> bool:
+    # A killed worker stays a zombie until the executor reaps it, and signal 0 still
+    # reaches a zombie, so /proc is checked where there is one.
+    status = f"/proc/{pid}/status"
+    if os.path.exists("/proc"):
+        if not os.path.exists(status):
+            return False
+        with open(status) as f:
+            return not any(line.startswith("State:") and "Z" in line.split()[1] for line in f)
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+
+def test_pool_runs_scripts_in_workers(scripts):
+    quick, _ = scripts
+    results = run_scripts_threaded([quick, quick], max_workers=2, mode=POOL_MODE)
+    result = results[quick]
+    assert result.ok
+    assert result.output[-1].endswith("done")
+    assert result.pid != os.getpid()
+
+
+
+def test_timeout_kills_only_the_worker_running_the_script(scripts):
+    quick, slow = scripts
+    handler = ScriptProcessHandler(max_workers=2, timeout=5, mode=POOL_MODE)
+    handler.add_script(slow, priority=1)
+    handler.add_script(quick)
+    with pytest.raises(StepTimeoutError):
+        handler.run_all()
+    # The worker that ran the quick script survives the other script's timeout and
+    # takes the next script.
+    # A broken executor stops its other workers from a background thread; give it time.
+    worker = handler.results[quick].pid
+    time.sleep(1)
+    assert _alive(worker)
+    results = run_scripts_threaded([quick], max_workers=2, mode=POOL_MODE)
+    assert results[quick].ok
+
+
+
+def test_larger_request_grows_the_live_pool(scripts):
+    pool = get_script_pool(1)
+    lane = pool.acquire()
+    try:
+        assert get_script_pool(2) is pool
+        assert pool.max_workers == 2
+        assert _alive(lane.pid)
+    finally:
+        pool.release(lane)
+
+
+
+def test_process_mode_records_results(scripts):
+    quick, _ = scripts
+    result = run_scripts_threaded([quick], mode=PROCESS_MODE)[quick]
+    assert result.ok
+    assert result.output[-1].endswith("done")
@@ -0,0 +1,24 @@
+import sys
+import time
+import pytest
+from utilities.util_process_engine import run_process
+from utilities.util_watchdog import StepTimeoutError, deadline
+
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="process groups are a POSIX path")
+def test_deadline_kills_grandchildren():
+    # The grandchild holds the output pipes open; the run only ends if it is killed too.
+    parent = (
+        "import subprocess, sys, time\n"
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        "print('started', flush=True)\n"
+        "time.sleep(30)\n"
+    )
+    lines = []
+    start = time.monotonic()
+    with pytest.raises(StepTimeoutError):
+        with deadline("grandchildren", 2):
+            run_process([sys.executable, "-c", parent], on_stdout=lines.extend)
+    assert time.monotonic() - start < 15
+    assert lines == ["started"]
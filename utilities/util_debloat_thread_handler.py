@@ -1,107 +1,244 @@
+import os
 import sys
-import subprocess
-import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import heapq
+import contextvars
+from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
+from concurrent.futures.process import BrokenProcessPool
+from utilities.util_watchdog import StepTimeoutError, deadline, register_process, unregister_process
+from utilities.util_process_engine import CancelToken, run_process
+from utilities.util_output_capture import OutputCapture
+from utilities.util_pipe_reader import log_line_batch
+from utilities.util_script_pool import ScriptResult, get_script_pool
+from utilities.util_step_timings import get_timings
+from utilities.util_system_pressure import SAMPLE_INTERVAL, AdaptiveLimiter
+from utilities.util_retry import RetryPolicy, TransientFailure, run_with_retry
+from utilities.util_resource_usage import record_usage
+
+
+
+PROCESS_MODE = "process"
+POOL_MODE = "pool"
+
+
+
+class _QueuedScript:
+
+    __slots__ = ("path", "priority", "weight", "retry", "expected", "started")
+
+    def __init__(self, path: str, priority: int, weight: float, retry: Optional[RetryPolicy]):
+        self.path = path
+        self.priority = priority
+        self.weight = weight
+        self.retry = retry
+        self.expected = get_timings().estimate("script", os.path.basename(path)) or 0.0
+        self.started = None
+
+    def sort_key(self, index: int):
+        # Higher priority first, then the longest expected run: starting the scripts
+        # that will finish last as early as possible shortens the whole batch.
+        return (-self.priority, -self.expected, index)
 
 
 
 class ScriptProcessHandler:
 
-    def __init__(self, max_workers: int = None, stop_on_error: bool = True):
+    def __init__(self, max_workers: int = None, stop_on_error: bool = True, timeout: float = None, mode: str = PROCESS_MODE,
+                 retry: Optional[RetryPolicy] = None):
+        # In process mode every script gets a fresh interpreter. In pool mode scripts run
+        # as __main__ in a shared pool of pre-started worker processes, which skips the
+        # start-up cost (large for the onefile build) while keeping them out of Talon.
+        if mode not in (PROCESS_MODE, POOL_MODE):
+            raise ValueError(f"Unknown script execution mode: {mode!r}")
         self.scripts = []
         self.max_workers = max_workers
         self.stop_on_error = stop_on_error
-        self._cancel_event = threading.Event()
-        self._processes = []
-        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.mode = mode
+        # Default retry policy for scripts added without one of their own.
+        self.retry = retry
+        self.results = {}
+        # Cancelling the token kills every script still running, from any thread.
+        self._cancel = CancelToken()
 
-    def add_script(self, script_path: str):
-        self.scripts.append(script_path)
+    def add_script(self, script_path: str, priority: int = 0, weight: float = 1.0, retry: Optional[RetryPolicy] = None):
+        # Weight is how many concurrency slots the script occupies (2 for something
+        # like an installer that saturates the disk on its own).
+        self.scripts.append(_QueuedScript(script_path, priority, max(0.0, weight), retry or self.retry))
 
     def run_all(self):
         total = len(self.scripts)
-        workers = self.max_workers or total or 1
-        logger.info(f"Starting execution of {total} scripts with up to {workers} workers")
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            futures = {executor.submit(self._run_script, path): path for path in self.scripts}
+        limiter = AdaptiveLimiter(self.max_workers)
+        logger.info(f"Starting execution of {total} scripts with up to {limiter.max_limit} workers")
+        pending = [(queued.sort_key(index), queued) for index, queued in enumerate(self.scripts)]
+        heapq.heapify(pending)
+        running = {}
+        in_flight = 0.0
+        script = None
+        with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
             try:
-                for future in as_completed(futures):
-                    script = futures[future]
-                    future.result()
-                    logger.info(f"✔ Script succeeded: {script}")
+                while pending or running:
+                    # Admission is re-checked whenever a script finishes and at least once
+                    # per sample interval, so the limit follows memory and disk pressure.
+                    limit = limiter.limit(len(running))
+                    while pending and not self._cancel.cancelled:
+                        queued = pending[0][1]
+                        # A script heavier than the whole limit still runs, alone.
+                        if running and in_flight + queued.weight > limit:
+                            break
+                        heapq.heappop(pending)
+                        queued.started = time.monotonic()
+                        # Each worker runs in a copy of the caller's context so scripts stay
+                        # under the deadline of the step that launched them.
+                        future = executor.submit(contextvars.copy_context().run, self._run_script, queued)
+                        running[future] = queued
+                        in_flight += queued.weight
+                    if not running:
+                        break
+                    done, _ = wait(running, timeout=SAMPLE_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        queued = running.pop(future)
+                        in_flight -= queued.weight
+                        script = queued.path
+                        future.result()
+                        if not self._cancel.cancelled:
+                            get_timings().record("script", os.path.basename(script), time.monotonic() - queued.started)
+                        logger.info(f"✔ Script succeeded: {script}")
             except Exception as e:
                 logger.error(f"✖ Failure in script '{script}': {e}")
                 if self.stop_on_error:
                     logger.info("Cancelling remaining scripts...")
-                    self._cancel_event.set()
-                    self._terminate_all_processes()
+                    self._cancel.cancel(f"{script} failed")
                 raise
-        if self._cancel_event.is_set():
+        if self._cancel.cancelled:
             raise RuntimeError("Execution aborted due to earlier error")
 
-    def _run_script(self, script_path: str):
-        if self._cancel_event.is_set():
+    def _run_script(self, queued: _QueuedScript):
+        script_path = queued.path
+        # Retries share the script's deadline; a transient failure only skips the
+        # popup and abort while attempts remain.
+        with deadline(f"script {script_path}", self.timeout) as scope:
+
+            def attempt(number, last):
+                retry = None if last else queued.retry
+                if self.mode == POOL_MODE:
+                    self._run_script_in_pool(script_path, scope, retry)
+                else:
+                    self._run_script_in_scope(script_path, scope, retry)
+            run_with_retry(
+                f"script {os.path.basename(script_path)}",
+                queued.retry,
+                attempt,
+                cancelled=lambda: self._cancel.cancelled,
+            )
+
+    def _run_script_in_pool(self, script_path: str, scope, retry: Optional[RetryPolicy] = None):
+        if self._cancel.cancelled:
+            logger.warning(f"Skipping {script_path} (cancelled)")
+            return
+        pool = get_script_pool(self.max_workers)
+        lane = pool.acquire()
+        handle = None
+        remove_callback = None
+        broken = False
+        try:
+            logger.info(f"Running script in worker pool: {script_path}")
+            future = lane.submit(script_path)
+            # Workers cannot be interrupted mid-script, so a deadline or cancellation
+            # kills the one worker running this script; its lane is replaced on release.
+            handle = lane.worker_handle(future)
+            register_process(handle)
+            remove_callback = self._cancel.add_callback(lambda: future.cancel() or lane.kill())
+            result = future.result()
+        except BrokenProcessPool as e:
+            broken = True
+            expired = scope.expired()
+            if expired is not None:
+                raise StepTimeoutError(expired.name, expired.timeout) from e
+            if self._cancel.cancelled:
+                logger.warning(f"Terminated script due to cancellation: {script_path}")
+                return
+            raise RuntimeError(f"{script_path} failed: its worker process died") from e
+        except CancelledError:
+            logger.warning(f"Skipping {script_path} (cancelled)")
+            return
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+            if handle is not None:
+                unregister_process(handle)
+            pool.release(lane, broken=broken)
+        self.results[script_path] = result
+        if result.usage is not None:
+            record_usage(os.path.basename(script_path), result.usage)
+        log_line_batch(f"{script_path} OUTPUT", result.output)
+        if not result.ok:
+            reason = retry.classify(result.exit_code, result.output) if retry is not None else None
+            if reason is not None:
+                raise TransientFailure(reason)
+            summary = result.summary()
+            if result.traceback:
+                logger.error(f"{script_path} raised in worker pid={result.pid}:\n{result.traceback}")
+            logger.error(f"{script_path} exited with code {result.exit_code}" + (f"\n{summary}" if summary else ""))
+            show_error_popup(
+                f"Script '{script_path}' failed with exit code {result.exit_code}" + (f"\n\n{summary}" if summary else ""),
+                allow_continue=False,
+            )
+            raise RuntimeError(f"{script_path} failed (exit code {result.exit_code})")
+
+    def _run_script_in_scope(self, script_path: str, scope, retry: Optional[RetryPolicy] = None):
+        if self._cancel.cancelled:
             logger.warning(f"Skipping {script_path} (cancelled)")
             return
         logger.info(f"Launching script: {script_path}")
-        cmd = [sys.executable, script_path]
         try:
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1
+            result = run_process(
+                [sys.executable, script_path],
+                on_stdout=lambda lines: log_line_batch(f"{script_path} STDOUT", lines),
+                on_stderr=lambda lines: log_line_batch(f"{script_path} STDERR", lines),
+                cancel=self._cancel,
+                capture=OutputCapture(os.path.basename(script_path)),
             )
         except Exception as e:
             logger.exception(f"Failed to start process for {script_path}: {e}")
             raise
-        with self._lock:
-            self._processes.append(proc)
-        def _log_stream(pipe, log_fn, prefix):
-            for line in iter(pipe.readline, ''):
-                log_fn(f"{script_path} {prefix}: {line.rstrip()}")
-            pipe.close()
-        out_thread = threading.Thread(
-            target=_log_stream, args=(proc.stdout, logger.info, "STDOUT"), daemon=True
-        )
-        err_thread = threading.Thread(
-            target=_log_stream, args=(proc.stderr, logger.error, "STDERR"), daemon=True
+        expired = scope.expired()
+        if expired is not None:
+            raise StepTimeoutError(expired.name, expired.timeout)
+        if result.cancelled:
+            logger.warning(f"Terminated script due to cancellation: {script_path} (pid={result.pid})")
+            return
+        returncode = result.returncode or 0
+        self.results[script_path] = ScriptResult(
+            script_path,
+            returncode,
+            result.duration,
+            result.pid,
+            output=result.output.tail(),
+            spill_path=result.output.spill_path,
+            usage=result.usage,
         )
-        out_thread.start()
-        err_thread.start()
-        while proc.poll() is None:
-            if self._cancel_event.is_set():
-                logger.warning(
-                    f"Terminating script due to cancellation: {script_path} (pid={proc.pid})"
-                )
-                proc.terminate()
-                break
-        out_thread.join()
-        err_thread.join()
-        returncode = proc.returncode or 0
         if returncode != 0:
-            logger.error(f"{script_path} exited with code {returncode}")
-            show_error_popup(f"Script '{script_path}' failed with exit code {returncode}", allow_continue=False)
+            reason = retry.classify(returncode, result.output.tail()) if retry is not None else None
+            if reason is not None:
+                raise TransientFailure(reason)
+            summary = result.output.summary()
+            logger.error(f"{script_path} exited with code {returncode}" + (f"\n{summary}" if summary else ""))
+            show_error_popup(
+                f"Script '{script_path}' failed with exit code {returncode}" + (f"\n\n{summary}" if summary else ""),
+                allow_continue=False,
+            )
             raise RuntimeError(f"{script_path} failed (exit code {returncode})")
 
-    def _terminate_all_processes(self):
-        with self._lock:
-            for proc in self._processes:
-                if proc.poll() is None:
-                    try:
-                        logger.warning(f"Force-killing process pid={proc.pid}")
-                        proc.terminate()
-                    except Exception as e:
-                        logger.error(f"Error terminating pid={proc.pid}: {e}")
-
 
 
-def run_scripts_threaded(script_paths: list, max_workers: int = None):
-    handler = ScriptProcessHandler(max_workers=max_workers)
+def run_scripts_threaded(script_paths: list, max_workers: int = None, timeout: float = None, mode: str = PROCESS_MODE,
+                         retry: Optional[RetryPolicy] = None):
+    handler = ScriptProcessHandler(max_workers=max_workers, timeout=timeout, mode=mode, retry=retry)
     for path in script_paths:
         handler.add_script(path)
     handler.run_all()
+    return handler.results
@@ -5,6 +5,7 @@ from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
+from utilities.util_trace import span
 
 
 def ensure_internet(max_attempts: int = 3, url: str = "https://ravendevteam.org", timeout: int = 5, allow_continue: bool = False,) -> bool:
@@ -13,12 +14,14 @@ def ensure_internet(max_attempts: int = 3, url: str = "https://ravendevteam.org"
         try:
             logger.info(f"Checking internet connectivity (attempt {attempt}/{max_attempts})...")
             req = Request(url, headers={"User-Agent": "Talon/1.0"})
-            with urlopen(req, timeout=timeout, context=ssl_ctx) as resp:
-                status = getattr(resp, "status", None) or getattr(resp, "code", None)
-                logger.debug(f"Internet check HTTP status: {status}")
-                if status is None or 200 <= int(status) < 500:
-                    logger.info("Internet connectivity confirmed.")
-                    return True
+            with span("internet check", cat="network", url=url, attempt=attempt) as trace:
+                with urlopen(req, timeout=timeout, context=ssl_ctx) as resp:
+                    status = getattr(resp, "status", None) or getattr(resp, "code", None)
+                    trace.set(status=status)
+            logger.debug(f"Internet check HTTP status: {status}")
+            if status is None or 200 <= int(status) < 500:
+                logger.info("Internet connectivity confirmed.")
+                return True
         except (HTTPError, URLError, Exception) as e:
             logger.warning(f"Internet check failed: {e}")
             if attempt < max_attempts:
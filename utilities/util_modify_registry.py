@@ -1,27 +1,45 @@
-import winreg
-from typing import Any, Union, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union, Optional
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
+from utilities.util_trace import span
+from utilities.util_run_report import record_registry_diff
+from utilities.util_registry_journal import ABSENT, KEY_CREATED, TREE, VALUE, get_registry_journal, read_journal
+from utilities.util_registry_backend import (
+    HKEY_CLASSES_ROOT, HKEY_CURRENT_CONFIG, HKEY_CURRENT_USER, HKEY_LOCAL_MACHINE, HKEY_USERS,
+    REG_BINARY, REG_DWORD, REG_SZ, get_backend,
+)
 
 
 
-VIEW_FLAG = winreg.KEY_WOW64_64KEY if hasattr(winreg, 'KEY_WOW64_64KEY') else 0
+# Every registry call goes through the backend (winreg on Windows, an in-memory tree
+# elsewhere or when one is installed with set_backend), looked up per call so a
+# backend swapped in later takes effect.
 _HIVE_MAPPING = {
-    'HKLM': winreg.HKEY_LOCAL_MACHINE,
-    'HKEY_LOCAL_MACHINE': winreg.HKEY_LOCAL_MACHINE,
-    'HKCU': winreg.HKEY_CURRENT_USER,
-    'HKEY_CURRENT_USER': winreg.HKEY_CURRENT_USER,
-    'HKCR': winreg.HKEY_CLASSES_ROOT,
-    'HKEY_CLASSES_ROOT': winreg.HKEY_CLASSES_ROOT,
-    'HKU': winreg.HKEY_USERS,
-    'HKEY_USERS': winreg.HKEY_USERS,
-    'HKCC': winreg.HKEY_CURRENT_CONFIG,
-    'HKEY_CURRENT_CONFIG': winreg.HKEY_CURRENT_CONFIG,
+    'HKLM': HKEY_LOCAL_MACHINE,
+    'HKEY_LOCAL_MACHINE': HKEY_LOCAL_MACHINE,
+    'HKCU': HKEY_CURRENT_USER,
+    'HKEY_CURRENT_USER': HKEY_CURRENT_USER,
+    'HKCR': HKEY_CLASSES_ROOT,
+    'HKEY_CLASSES_ROOT': HKEY_CLASSES_ROOT,
+    'HKU': HKEY_USERS,
+    'HKEY_USERS': HKEY_USERS,
+    'HKCC': HKEY_CURRENT_CONFIG,
+    'HKEY_CURRENT_CONFIG': HKEY_CURRENT_CONFIG,
 }
 
 
 
-def _resolve_hive(hive: Union[str, int]) -> int:
+_HIVE_NAMES = {
+    HKEY_LOCAL_MACHINE: 'HKLM',
+    HKEY_CURRENT_USER: 'HKCU',
+    HKEY_CLASSES_ROOT: 'HKCR',
+    HKEY_USERS: 'HKU',
+    HKEY_CURRENT_CONFIG: 'HKCC',
+}
+
+
+
+def resolve_hive(hive: Union[str, int]) -> int:
     if isinstance(hive, int):
         return hive
     key = hive.upper()
@@ -31,6 +49,74 @@ def _resolve_hive(hive: Union[str, int]) -> int:
 
 
 
+def short_hive_name(hive_const: int) -> str:
+    return _HIVE_NAMES.get(hive_const, str(hive_const))
+
+
+
+def _open_for_write(hive_const: int, key_path: str):
+    # Opening first tells a new key from an existing one, so the undo journal can
+    # remove keys the run created.
+    backend = get_backend()
+    try:
+        return backend.open_key(hive_const, key_path, write=True)
+    except FileNotFoundError:
+        journal = get_registry_journal()
+        if journal is not None:
+            journal.key_created(short_hive_name(hive_const), _first_missing(hive_const, key_path))
+        return backend.create_key(hive_const, key_path)
+
+
+
+def _first_missing(hive_const: int, key_path: str) -> str:
+    # create_key creates every missing parent too; undo has to remove from the
+    # highest one that did not exist.
+    backend = get_backend()
+    parts = key_path.split("\\")
+    missing = len(parts)
+    while missing > 1:
+        try:
+            backend.open_key(hive_const, "\\".join(parts[:missing - 1])).Close()
+            break
+        except FileNotFoundError:
+            missing -= 1
+    return "\\".join(parts[:missing])
+
+
+
+def _snapshot_value(hive_const: int, key_path: str, name: str, previous: Optional[Tuple[Any, int]]):
+    journal = get_registry_journal()
+    if journal is not None:
+        journal.value(short_hive_name(hive_const), key_path, name, previous)
+
+
+
+def _flush_journal():
+    journal = get_registry_journal()
+    if journal is not None:
+        journal.flush()
+
+
+
+def _infer_type(value: Any) -> int:
+    if isinstance(value, int):
+        return REG_DWORD
+    if isinstance(value, str):
+        return REG_SZ
+    if isinstance(value, bytes):
+        return REG_BINARY
+    raise ValueError(f"Unsupported registry value type: {type(value)}")
+
+
+
+def _query(key, name: str) -> Optional[Tuple[Any, int]]:
+    try:
+        return get_backend().query_value(key, name)
+    except FileNotFoundError:
+        return None
+
+
+
 def set_value(
     hive: Union[str, int],
     key_path: str,
@@ -38,28 +124,192 @@ def set_value(
     value: Any,
     value_type: Optional[int] = None
 ) -> None:
-    try:
-        hive_const = _resolve_hive(hive)
-        if value_type is None:
-            if isinstance(value, int):
-                value_type = winreg.REG_DWORD
-            elif isinstance(value, str):
-                value_type = winreg.REG_SZ
-            elif isinstance(value, bytes):
-                value_type = winreg.REG_BINARY
-            else:
-                raise ValueError(f"Unsupported registry value type: {type(value)}")
-        access = winreg.KEY_WRITE | VIEW_FLAG
-        with winreg.CreateKeyEx(hive_const, key_path, 0, access) as key:
-            winreg.SetValueEx(key, name, 0, value_type, value)
-        logger.info(f"Set registry value: {hive}\\{key_path}\\{name} = {value!r} (type={value_type})")
-    except Exception as e:
-        logger.exception(f"Error setting registry value {hive}\\{key_path}\\{name}: {e}")
-        show_error_popup(
-            f"Failed to set registry value:\n{hive}\\{key_path}\\{name}\n\n{e}",
-            allow_continue=False
-        )
-        raise
+    with span("registry set", cat="registry", key=f"{hive}\\{key_path}", value=name):
+        try:
+            hive_const = resolve_hive(hive)
+            if value_type is None:
+                value_type = _infer_type(value)
+            with _open_for_write(hive_const, key_path) as key:
+                previous = _query(key, name)
+                if previous == (value, value_type):
+                    logger.debug(f"Registry value already set: {hive}\\{key_path}\\{name} = {value!r}")
+                    return
+                _snapshot_value(hive_const, key_path, name, previous)
+                get_backend().set_value(key, name, value_type, value)
+            _flush_journal()
+            old = "(absent)" if previous is None else repr(previous[0])
+            logger.info(f"Set registry value: {hive}\\{key_path}\\{name}: {old} -> {value!r} (type={value_type})")
+            record_registry_diff([f"{hive}\\{key_path}\\{name}: {old} -> {value!r}"])
+        except Exception as e:
+            logger.exception(f"Error setting registry value {hive}\\{key_path}\\{name}: {e}")
+            show_error_popup(
+                f"Failed to set registry value:\n{hive}\\{key_path}\\{name}\n\n{e}",
+                allow_continue=False
+            )
+            raise
+
+
+
+class RegistryChange:
+
+    __slots__ = ("hive", "key_path", "name", "value", "value_type")
+
+    def __init__(self, hive: Union[str, int], key_path: str, name: str, value: Any, value_type: Optional[int] = None):
+        self.hive = hive
+        self.key_path = key_path
+        self.name = name
+        self.value = value
+        self.value_type = value_type
+
+    @property
+    def path(self) -> str:
+        return f"{self.hive}\\{self.key_path}\\{self.name}"
+
+
+
+WRITTEN = "written"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+
+class ValueOutcome:
+
+    __slots__ = ("change", "status", "error", "previous")
+
+    def __init__(self, change: RegistryChange, status: str, error: Optional[Exception] = None,
+                 previous: Optional[Tuple[Any, int]] = None):
+        # previous is the (value, type) read before the write, or None if it was absent.
+        self.change = change
+        self.status = status
+        self.error = error
+        self.previous = previous
+
+
+
+class BatchResult:
+
+    def __init__(self):
+        # One outcome per change, in the order the changes were given.
+        self.outcomes: List[ValueOutcome] = []
+
+    def add(self, outcome: ValueOutcome):
+        self.outcomes.append(outcome)
+
+    def changes(self, status: str) -> List[RegistryChange]:
+        return [outcome.change for outcome in self.outcomes if outcome.status == status]
+
+    @property
+    def failed(self) -> List[Tuple[RegistryChange, Exception]]:
+        return [(outcome.change, outcome.error) for outcome in self.outcomes if outcome.status == FAILED]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def counts(self) -> Dict[str, int]:
+        counts = {}
+        for outcome in self.outcomes:
+            counts[outcome.status] = counts.get(outcome.status, 0) + 1
+        return counts
+
+    def diff(self) -> List[str]:
+        # One line per value actually written: "HKCU\Key\Name: old -> new".
+        return [
+            f"{outcome.change.path}: "
+            f"{'(absent)' if outcome.previous is None else repr(outcome.previous[0])} -> {outcome.change.value!r}"
+            for outcome in self.outcomes if outcome.status == WRITTEN
+        ]
+
+    def summary(self, max_failures: int = 10) -> str:
+        counts = self.counts()
+        text = ", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "no changes"
+        failed = self.failed
+        if failed:
+            text += "\n" + "\n".join(f"{change.path}: {error}" for change, error in failed[:max_failures])
+            if len(failed) > max_failures:
+                text += f"\n... and {len(failed) - max_failures} more"
+        return text
+
+
+
+def _group_by_key(changes: List[RegistryChange], outcomes: list) -> Dict[Tuple[int, str], List[Tuple[int, RegistryChange]]]:
+    # Key paths are case-insensitive; the first spelling seen is the one opened.
+    groups = {}
+    for index, change in enumerate(changes):
+        try:
+            hive_const = resolve_hive(change.hive)
+        except ValueError as e:
+            outcomes[index] = ValueOutcome(change, FAILED, e)
+            continue
+        groups.setdefault((hive_const, change.key_path.lower()), []).append((index, change))
+    return groups
+
+
+
+def read_batch(changes: Iterable[RegistryChange]) -> List[Optional[Tuple[Any, int]]]:
+    # Current (value, type) for each change, None where the key or value is absent,
+    # reading each key once.
+    changes = list(changes)
+    current = [None] * len(changes)
+    for (hive_const, _), members in _group_by_key(changes, [None] * len(changes)).items():
+        try:
+            key = get_backend().open_key(hive_const, members[0][1].key_path)
+        except FileNotFoundError:
+            continue
+        with key:
+            for index, change in members:
+                current[index] = _query(key, change.name)
+    return current
+
+
+
+def apply_batch(changes: Iterable[RegistryChange], skip_unchanged: bool = True) -> BatchResult:
+    # Opens each key once, reads the current values and writes only those that differ
+    # in value or type, so a re-run on a configured machine writes (and notifies
+    # Explorer about) nothing. Failures are collected per value instead of raised, so
+    # the caller reports them together.
+    changes = list(changes)
+    outcomes = [None] * len(changes)
+    backend = get_backend()
+    with span("registry batch", cat="registry", values=len(changes)) as trace:
+        groups = _group_by_key(changes, outcomes)
+        for (hive_const, _), members in groups.items():
+            key_path = members[0][1].key_path
+            try:
+                key = _open_for_write(hive_const, key_path)
+            except Exception as e:
+                logger.error(f"Error opening registry key {members[0][1].hive}\\{key_path}: {e}")
+                for index, change in members:
+                    outcomes[index] = ValueOutcome(change, FAILED, e)
+                continue
+            with key:
+                for index, change in members:
+                    previous = None
+                    try:
+                        value_type = change.value_type if change.value_type is not None else _infer_type(change.value)
+                        previous = _query(key, change.name)
+                        if skip_unchanged and previous == (change.value, value_type):
+                            outcomes[index] = ValueOutcome(change, UNCHANGED, previous=previous)
+                            continue
+                        _snapshot_value(hive_const, key_path, change.name, previous)
+                        backend.set_value(key, change.name, value_type, change.value)
+                        outcomes[index] = ValueOutcome(change, WRITTEN, previous=previous)
+                    except Exception as e:
+                        logger.error(f"Error setting registry value {change.path}: {e}")
+                        outcomes[index] = ValueOutcome(change, FAILED, e, previous)
+        _flush_journal()
+        result = BatchResult()
+        for outcome in outcomes:
+            result.add(outcome)
+        trace.set(keys=len(groups), **result.counts())
+    diff = result.diff()
+    logger.info(
+        f"Registry batch of {len(changes)} values in {len(groups)} keys: {result.summary()}"
+        + ("\n" + "\n".join(diff) if diff else "")
+    )
+    record_registry_diff(diff)
+    return result
 
 
 
@@ -69,10 +319,10 @@ def get_value(
     name: str
 ) -> Any:
     try:
-        hive_const = _resolve_hive(hive)
-        access = winreg.KEY_READ | VIEW_FLAG
-        with winreg.OpenKey(hive_const, key_path, 0, access) as key:
-            val, _ = winreg.QueryValueEx(key, name)
+        hive_const = resolve_hive(hive)
+        backend = get_backend()
+        with backend.open_key(hive_const, key_path) as key:
+            val, _ = backend.query_value(key, name)
             logger.info(f"Read registry value: {hive}\\{key_path}\\{name} = {val!r}")
             return val
     except FileNotFoundError:
@@ -88,26 +338,65 @@ def get_value(
 
 
 
+def read_values(
+    hive: Union[str, int],
+    key_path: str,
+    names: Iterable[str]
+) -> Dict[str, Tuple[Any, int]]:
+    values = {}
+    hive_const = resolve_hive(hive)
+    backend = get_backend()
+    try:
+        with backend.open_key(hive_const, key_path) as key:
+            for name in names:
+                try:
+                    values[name] = backend.query_value(key, name)
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return values
+
+
+
+def key_exists(
+    hive: Union[str, int],
+    key_path: str
+) -> bool:
+    try:
+        get_backend().open_key(resolve_hive(hive), key_path).Close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+
 def delete_value(
     hive: Union[str, int],
     key_path: str,
     name: str
 ) -> None:
-    try:
-        hive_const = _resolve_hive(hive)
-        access = winreg.KEY_WRITE | VIEW_FLAG
-        with winreg.OpenKey(hive_const, key_path, 0, access) as key:
-            winreg.DeleteValue(key, name)
-        logger.info(f"Deleted registry value: {hive}\\{key_path}\\{name}")
-    except FileNotFoundError:
-        logger.warning(f"Registry value to delete not found: {hive}\\{key_path}\\{name}")
-    except Exception as e:
-        logger.exception(f"Error deleting registry value {hive}\\{key_path}\\{name}: {e}")
-        show_error_popup(
-            f"Failed to delete registry value:\n{hive}\\{key_path}\\{name}\n\n{e}",
-            allow_continue=False
-        )
-        raise
+    with span("registry delete value", cat="registry", key=f"{hive}\\{key_path}", value=name):
+        try:
+            hive_const = resolve_hive(hive)
+            backend = get_backend()
+            with backend.open_key(hive_const, key_path, write=True) as key:
+                previous = _query(key, name)
+                if previous is None:
+                    raise FileNotFoundError(name)
+                _snapshot_value(hive_const, key_path, name, previous)
+                backend.delete_value(key, name)
+            _flush_journal()
+            logger.info(f"Deleted registry value: {hive}\\{key_path}\\{name}")
+        except FileNotFoundError:
+            logger.warning(f"Registry value to delete not found: {hive}\\{key_path}\\{name}")
+        except Exception as e:
+            logger.exception(f"Error deleting registry value {hive}\\{key_path}\\{name}: {e}")
+            show_error_popup(
+                f"Failed to delete registry value:\n{hive}\\{key_path}\\{name}\n\n{e}",
+                allow_continue=False
+            )
+            raise
 
 
 
@@ -115,41 +404,313 @@ def create_key(
     hive: Union[str, int],
     key_path: str
 ) -> None:
-    try:
-        hive_const = _resolve_hive(hive)
-        access = winreg.KEY_WRITE | VIEW_FLAG
-        with winreg.CreateKeyEx(hive_const, key_path, 0, access):
-            pass
-        logger.info(f"Created registry key: {hive}\\{key_path}")
-    except Exception as e:
-        logger.exception(f"Error creating registry key {hive}\\{key_path}: {e}")
-        show_error_popup(
-            f"Failed to create registry key:\n{hive}\\{key_path}\n\n{e}",
-            allow_continue=False
-        )
-        raise
+    with span("registry create key", cat="registry", key=f"{hive}\\{key_path}"):
+        try:
+            hive_const = resolve_hive(hive)
+            with _open_for_write(hive_const, key_path):
+                pass
+            _flush_journal()
+            logger.info(f"Created registry key: {hive}\\{key_path}")
+        except Exception as e:
+            logger.exception(f"Error creating registry key {hive}\\{key_path}: {e}")
+            show_error_popup(
+                f"Failed to create registry key:\n{hive}\\{key_path}\n\n{e}",
+                allow_continue=False
+            )
+            raise
 
 
 
 def delete_key(
     hive: Union[str, int],
-    key_path: str
+    key_path: str,
+    recursive: bool = False
 ) -> None:
-    try:
-        hive_const = _resolve_hive(hive)
-        if hasattr(winreg, 'DeleteKeyEx'):
-            winreg.DeleteKeyEx(hive_const, key_path, VIEW_FLAG, 0)
-        else:
-            parent_path, _, sub_key = key_path.rpartition('\\')
-            with winreg.OpenKey(hive_const, parent_path, 0, winreg.KEY_WRITE | VIEW_FLAG) as parent:
-                winreg.DeleteKey(parent, sub_key)
-        logger.info(f"Deleted registry key: {hive}\\{key_path}")
-    except FileNotFoundError:
-        logger.warning(f"Registry key to delete not found: {hive}\\{key_path}")
-    except Exception as e:
-        logger.exception(f"Error deleting registry key {hive}\\{key_path}: {e}")
-        show_error_popup(
-            f"Failed to delete registry key:\n{hive}\\{key_path}\n\n{e}",
-            allow_continue=False
-        )
-        raise
\ No newline at end of file
+    # Without recursive, a key that still has subkeys is refused like DeleteKeyEx does.
+    if recursive:
+        delete_tree(hive, key_path)
+        return
+    with span("registry delete key", cat="registry", key=f"{hive}\\{key_path}"):
+        try:
+            hive_const = resolve_hive(hive)
+            journal = get_registry_journal()
+            if journal is not None:
+                journal.tree(short_hive_name(hive_const), key_path, _collect_tree(hive_const, key_path)[0])
+            get_backend().delete_key(hive_const, key_path)
+            _flush_journal()
+            logger.info(f"Deleted registry key: {hive}\\{key_path}")
+        except FileNotFoundError:
+            logger.warning(f"Registry key to delete not found: {hive}\\{key_path}")
+        except Exception as e:
+            logger.exception(f"Error deleting registry key {hive}\\{key_path}: {e}")
+            show_error_popup(
+                f"Failed to delete registry key:\n{hive}\\{key_path}\n\n{e}",
+                allow_continue=False
+            )
+            raise
+
+
+
+class TreeStats:
+
+    __slots__ = ("keys", "values", "bytes", "failed")
+
+    def __init__(self):
+        # bytes estimates the registry space the subtree takes: UTF-16 key and value
+        # names plus value data, without the hive's own cell overhead.
+        self.keys = 0
+        self.values = 0
+        self.bytes = 0
+        self.failed = 0
+
+    def add_key(self, name: str, values: List[Tuple[str, Any, int]]):
+        self.keys += 1
+        self.values += len(values)
+        self.bytes += 2 * len(name) + sum(2 * len(value_name) + _value_size(value) for value_name, value, _ in values)
+
+    def add(self, other: "TreeStats"):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self) -> str:
+        text = f"{self.keys} keys, {self.values} values, ~{self.bytes / 1024:.1f} KB"
+        return text + (f", {self.failed} failed" if self.failed else "")
+
+
+
+def _value_size(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return 2 * (len(value) + 1)
+    if isinstance(value, (list, tuple)):
+        return sum(2 * (len(item) + 1) for item in value) + 2
+    if isinstance(value, int):
+        return 4 if 0 <= value <= 0xFFFFFFFF else 8
+    return len(value)
+
+
+
+def walk_tree(hive: Union[str, int], key_path: str) -> Iterator[Tuple[str, List[Tuple[str, Any, int]], List[str]]]:
+    # Yields (key path, values, subkey names) for the key and everything below it,
+    # parents before children, with an explicit stack instead of recursion so deep
+    # trees cannot hit the recursion limit. Each key is opened once and its values and
+    # subkeys enumerated in one go. Subkeys that disappear during the walk are skipped;
+    # a missing root raises FileNotFoundError.
+    hive_const = resolve_hive(hive)
+    backend = get_backend()
+    root = key_path.strip("\\")
+    stack = [root]
+    first = True
+    while stack:
+        path = stack.pop()
+        try:
+            with backend.open_key(hive_const, path) as key:
+                values = backend.enum_values(key)
+                names = backend.enum_keys(key)
+        except FileNotFoundError:
+            if first:
+                raise
+            continue
+        first = False
+        yield path, values, names
+        stack.extend(f"{path}\\{name}" for name in reversed(names))
+
+
+
+def _collect_tree(hive_const: int, key_path: str):
+    # The subtree as a journal tree, its key paths in walk order, and its stats.
+    nodes = {}
+    paths = []
+    stats = TreeStats()
+    root = key_path.strip("\\")
+    for path, values, _ in walk_tree(hive_const, root):
+        node = ([tuple(entry) for entry in values], [])
+        nodes[path.lower()] = node
+        if paths:
+            parent, _, name = path.rpartition("\\")
+            nodes[parent.lower()][1].append((name, node))
+        paths.append(path)
+        stats.add_key(path.rpartition("\\")[2], values)
+    return nodes[root.lower()], paths, stats
+
+
+
+def _delete_paths(hive_const: int, paths: List[str], stats: Optional[TreeStats] = None):
+    # Deletes in reverse walk order, so every key goes after its subkeys. With stats,
+    # failures are counted and the rest carries on; without, the first one raises.
+    backend = get_backend()
+    for path in reversed(paths):
+        try:
+            backend.delete_key(hive_const, path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            if stats is None:
+                raise
+            stats.failed += 1
+            logger.error(f"Error deleting registry key {short_hive_name(hive_const)}\\{path}: {e}")
+
+
+
+def export_tree(hive: Union[str, int], key_path: str):
+    # Returns (tree, stats); tree is (values, [(subkey name, tree), ...]) as in the
+    # undo journal, or None when the key does not exist.
+    with span("registry export tree", cat="registry", key=f"{hive}\\{key_path}") as trace:
+        try:
+            tree, _, stats = _collect_tree(resolve_hive(hive), key_path)
+        except FileNotFoundError:
+            logger.warning(f"Registry key to export not found: {hive}\\{key_path}")
+            return None, TreeStats()
+        trace.set(**stats.as_dict())
+    return tree, stats
+
+
+
+def delete_tree(hive: Union[str, int], key_path: str) -> TreeStats:
+    # Deletes a key with everything below it in-process. The whole subtree goes to the
+    # undo journal first. Keys that cannot be deleted are counted in stats.failed and
+    # logged; the rest of the subtree is still removed.
+    with span("registry delete tree", cat="registry", key=f"{hive}\\{key_path}") as trace:
+        try:
+            hive_const = resolve_hive(hive)
+            tree, paths, stats = _collect_tree(hive_const, key_path)
+            journal = get_registry_journal()
+            if journal is not None:
+                journal.tree(short_hive_name(hive_const), key_path, tree)
+                journal.flush()
+        except FileNotFoundError:
+            logger.warning(f"Registry key to delete not found: {hive}\\{key_path}")
+            return TreeStats()
+        except Exception as e:
+            logger.exception(f"Error reading registry key {hive}\\{key_path}: {e}")
+            show_error_popup(
+                f"Failed to delete registry key:\n{hive}\\{key_path}\n\n{e}",
+                allow_continue=False
+            )
+            raise
+        _delete_paths(hive_const, paths, stats)
+        trace.set(**stats.as_dict())
+    logger.info(f"Deleted registry tree {hive}\\{key_path}: {stats}")
+    return stats
+
+
+
+def copy_tree(
+    src_hive: Union[str, int],
+    src_path: str,
+    dst_hive: Union[str, int],
+    dst_path: str
+) -> TreeStats:
+    # Copies a key with everything below it, merging into the destination: values that
+    # already match are left alone, others are overwritten. Every write goes to the
+    # undo journal. stats counts what was copied; failures are counted and logged.
+    src_const = resolve_hive(src_hive)
+    dst_const = resolve_hive(dst_hive)
+    src_root = src_path.strip("\\")
+    dst_root = dst_path.strip("\\")
+    if src_const == dst_const and (dst_root.lower() + "\\").startswith(src_root.lower() + "\\"):
+        raise ValueError(f"Cannot copy {src_hive}\\{src_root} into itself")
+    stats = TreeStats()
+    backend = get_backend()
+    with span("registry copy tree", cat="registry", key=f"{src_hive}\\{src_root}", to=f"{dst_hive}\\{dst_root}") as trace:
+        for path, values, _ in walk_tree(src_const, src_root):
+            target = dst_root + path[len(src_root):]
+            stats.add_key(path.rpartition("\\")[2], values)
+            try:
+                with _open_for_write(dst_const, target) as key:
+                    for name, value, value_type in values:
+                        previous = _query(key, name)
+                        if previous == (value, value_type):
+                            continue
+                        _snapshot_value(dst_const, target, name, previous)
+                        backend.set_value(key, name, value_type, value)
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"Error copying registry key {src_hive}\\{path} to {dst_hive}\\{target}: {e}")
+        _flush_journal()
+        trace.set(**stats.as_dict())
+    logger.info(f"Copied registry tree {src_hive}\\{src_root} to {dst_hive}\\{dst_root}: {stats}")
+    return stats
+
+
+
+def _delete_tree(hive_const: int, key_path: str):
+    _delete_paths(hive_const, _collect_tree(hive_const, key_path)[1])
+
+
+
+def _write_tree(hive_const: int, key_path: str, tree):
+    backend = get_backend()
+    stack = [(key_path, tree)]
+    while stack:
+        path, (values, subkeys) = stack.pop()
+        with backend.create_key(hive_const, path) as key:
+            for name, value, value_type in values:
+                backend.set_value(key, name, value_type, value)
+        stack.extend((f"{path}\\{name}", subtree) for name, subtree in reversed(subkeys))
+
+
+
+def rollback(path: Optional[str] = None) -> Dict[str, int]:
+    # Replays the undo journal newest-first in one pass. Key handles stay open across
+    # records and are dropped only when a subtree is deleted or recreated under them.
+    records = read_journal(path)
+    counts = {"restored": 0, "deleted": 0, "failed": 0}
+    handles = {}
+    backend = get_backend()
+
+    def _key(hive_const, key_path, create):
+        cache_key = (hive_const, key_path.lower())
+        key = handles.get(cache_key)
+        if key is None:
+            key = backend.create_key(hive_const, key_path) if create else backend.open_key(hive_const, key_path, write=True)
+            handles[cache_key] = key
+        return key
+
+    def _drop(hive_const, key_path):
+        prefix = key_path.lower()
+        for cache_key in [k for k in handles if k[0] == hive_const and (k[1] == prefix or k[1].startswith(prefix + "\\"))]:
+            handles.pop(cache_key).Close()
+
+    with span("registry rollback", cat="registry", records=len(records)) as trace:
+        try:
+            for record in reversed(records):
+                where = f"{record.hive}\\{record.key_path}" + (f"\\{record.name}" if record.name is not None else "")
+                try:
+                    hive_const = resolve_hive(record.hive)
+                    if record.kind == VALUE:
+                        backend.set_value(_key(hive_const, record.key_path, True), record.name, record.value_type, record.value)
+                        counts["restored"] += 1
+                    elif record.kind == ABSENT:
+                        try:
+                            backend.delete_value(_key(hive_const, record.key_path, False), record.name)
+                            counts["deleted"] += 1
+                        except FileNotFoundError:
+                            pass
+                    elif record.kind == KEY_CREATED:
+                        _drop(hive_const, record.key_path)
+                        try:
+                            _delete_tree(hive_const, record.key_path)
+                            counts["deleted"] += 1
+                        except FileNotFoundError:
+                            pass
+                    elif record.kind == TREE:
+                        _drop(hive_const, record.key_path)
+                        _write_tree(hive_const, record.key_path, record.tree)
+                        counts["restored"] += 1
+                except Exception as e:
+                    counts["failed"] += 1
+                    logger.error(f"Failed to roll back {where}: {e}")
+        finally:
+            for key in handles.values():
+                key.Close()
+        trace.set(**counts)
+    logger.info(
+        f"Rolled back {len(records)} registry journal records: {counts['restored']} restored, "
+        f"{counts['deleted']} deleted, {counts['failed']} failed"
+    )
+    return counts
@@ -0,0 +1,116 @@
+import os
+import re
+import gzip
+import time
+import tempfile
+import threading
+from collections import deque
+from typing import List, Optional
+from utilities.util_logger import logger
+
+
+
+# How much recent output each invocation keeps in memory, and how many spill files
+# are kept around in %TEMP%\talon\output before the oldest are removed.
+TAIL_BYTES = 64 * 1024
+MAX_SPILL_FILES = 50
+
+
+
+def _get_spill_dir() -> str:
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', 'output')
+
+
+
+def _prune_spill_files(spill_dir: str):
+    try:
+        files = sorted(
+            (os.path.join(spill_dir, name) for name in os.listdir(spill_dir) if name.endswith(".log.gz")),
+            key=os.path.getmtime,
+        )
+        for path in files[:-MAX_SPILL_FILES]:
+            os.remove(path)
+    except Exception as e:
+        logger.debug(f"Failed to prune output spill files in {spill_dir}: {e}")
+
+
+
+class OutputCapture:
+
+    def __init__(self, name: str, limit: int = TAIL_BYTES, spill_dir: Optional[str] = None):
+        # Only the last `limit` bytes stay in memory. The first time older lines would
+        # be dropped, everything seen so far is written to a gzip file and every later
+        # line follows it there, so the full output survives at a flat memory cost.
+        self.name = name
+        self.limit = limit
+        self.spill_dir = spill_dir or _get_spill_dir()
+        self.spill_path: Optional[str] = None
+        self.total_bytes = 0
+        self.total_lines = 0
+        self._tail = deque()
+        self._tail_bytes = 0
+        self._spill = None
+        self._spill_failed = False
+        self._lock = threading.Lock()
+
+    def write(self, label: str, line: str):
+        self.write_many(label, [line])
+
+    def write_many(self, label: str, lines: List[str]):
+        prefix = f"[{label}] "
+        entries = [prefix + line for line in lines]
+        size = sum(map(len, entries)) + len(entries)
+        with self._lock:
+            self.total_bytes += size
+            self.total_lines += len(entries)
+            if self._spill:
+                self._spill.write("\n".join(entries) + "\n")
+            self._tail.extend(entries)
+            self._tail_bytes += size
+            while self._tail_bytes > self.limit and len(self._tail) > 1:
+                if self._spill is None and not self._spill_failed:
+                    self._open_spill()
+                self._tail_bytes -= len(self._tail.popleft()) + 1
+
+    def _open_spill(self):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.name)[:60]
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            _prune_spill_files(self.spill_dir)
+            path = os.path.join(self.spill_dir, f"{safe_name}-{stamp}-{os.getpid()}-{id(self):x}.log.gz")
+            spill = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+            for entry in self._tail:
+                spill.write(entry + "\n")
+        except Exception as e:
+            # Without a spill file the capture simply degrades to a tail-only buffer.
+            logger.warning(f"Failed to open output spill file for {self.name}: {e}")
+            self._spill_failed = True
+            return
+        self._spill = spill
+        self.spill_path = path
+        logger.debug(f"Output of {self.name} exceeded {self.limit} bytes; spilling to {path}")
+
+    def tail(self, max_lines: Optional[int] = None) -> List[str]:
+        with self._lock:
+            lines = list(self._tail)
+        return lines[-max_lines:] if max_lines else lines
+
+    def summary(self, max_lines: int = 12, max_width: int = 200) -> str:
+        lines = [line if len(line) <= max_width else line[:max_width] + "..." for line in self.tail(max_lines)]
+        if not lines:
+            return ""
+        text = "Last output:\n" + "\n".join(lines)
+        if self.spill_path:
+            text += f"\n\nFull output: {self.spill_path}"
+        return text
+
+    def close(self):
+        with self._lock:
+            spill, self._spill = self._spill, None
+        if spill:
+            try:
+                spill.close()
+            except Exception as e:
+                logger.warning(f"Failed to close output spill file {self.spill_path}: {e}")
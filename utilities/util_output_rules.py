@@ -0,0 +1,173 @@
+import re
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+from utilities.util_logger import logger
+
+
+
+SUCCESS = "success"
+FATAL = "fatal"
+PROGRESS = "progress"
+PHASE = "phase"
+
+_KINDS = (SUCCESS, FATAL, PROGRESS, PHASE)
+_NAMED_GROUP = re.compile(r"\(\?P<[A-Za-z_][A-Za-z0-9_]*>")
+# Backreferences and global inline flags such as (?i) mean something else, or nothing,
+# once a pattern is one branch of a RuleSet's alternation. Escaped backslashes and
+# parentheses are skipped; scoped flags like (?i:...) are fine.
+_UNCOMBINABLE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?[aiLmsux-]+\))")
+
+
+
+def _branch(index: int, pattern: str) -> str:
+    return f"(?P<r{index}>{_NAMED_GROUP.sub('(?:', pattern)})"
+
+
+
+class Rule:
+
+    __slots__ = ("kind", "pattern", "message", "regex")
+
+    def __init__(self, kind: str, pattern: str, *, message: Optional[str] = None, literal: bool = False):
+        # Progress rules capture either "percent" or "current" and "total"; message is a
+        # str.format template over the rule's named groups, used for the status label.
+        if kind not in _KINDS:
+            raise ValueError(f"Unknown output rule kind: {kind!r}")
+        self.kind = kind
+        self.pattern = re.escape(pattern) if literal else pattern
+        self.message = message
+        self.regex = re.compile(self.pattern)
+        try:
+            if _UNCOMBINABLE.search(self.pattern):
+                raise re.error("backreferences and global inline flags cannot be combined")
+            re.compile(_branch(0, self.pattern), re.MULTILINE)
+        except re.error as e:
+            raise ValueError(f"Output rule pattern {pattern!r} cannot join a rule set: {e}") from e
+
+
+
+class RuleMatch:
+
+    __slots__ = ("rule", "line", "groups", "percent", "text")
+
+    def __init__(self, rule: Rule, line: str, groups: Dict[str, str]):
+        self.rule = rule
+        self.line = line
+        self.groups = groups
+        self.percent = _percent(groups)
+        if rule.message:
+            try:
+                self.text = rule.message.format(**groups)
+            except (KeyError, IndexError):
+                self.text = rule.message
+        else:
+            self.text = groups.get("phase") or line.strip()
+
+    @property
+    def kind(self) -> str:
+        return self.rule.kind
+
+
+
+def _percent(groups: Dict[str, str]) -> Optional[int]:
+    try:
+        if groups.get("percent") is not None:
+            return max(0, min(100, int(float(groups["percent"]))))
+        if groups.get("current") is not None and groups.get("total"):
+            return max(0, min(100, int(100 * float(groups["current"]) / float(groups["total"]))))
+    except (ValueError, ZeroDivisionError):
+        pass
+    return None
+
+
+
+class RuleSet:
+
+    def __init__(self, rules: Sequence[Rule]):
+        # All rules are compiled into one alternation, so a line costs one scan no
+        # matter how many rules a script has. Inner named groups would clash across
+        # rules, so they become non-capturing here and are read back from the single
+        # matching rule's own pattern, applied to the matched span only.
+        self.rules = list(rules)
+        if not self.rules:
+            raise ValueError("A rule set needs at least one rule")
+        self._combined = re.compile("|".join(
+            _branch(index, rule.pattern) for index, rule in enumerate(self.rules)
+        ), re.MULTILINE)
+
+    def __add__(self, other: "RuleSet") -> "RuleSet":
+        return RuleSet(self.rules + other.rules)
+
+    def has(self, *kinds: str) -> bool:
+        return any(rule.kind in kinds for rule in self.rules)
+
+    def scan(self, lines: List[str]) -> Iterator[RuleMatch]:
+        # One search over the whole batch rules out the common case of no marker at
+        # all; only a batch that contains one is walked line by line.
+        if not self._combined.search("\n".join(lines)):
+            return
+        for line in lines:
+            match = self.match(line)
+            if match is not None:
+                yield match
+
+    def match(self, line: str) -> Optional[RuleMatch]:
+        m = self._combined.search(line)
+        if m is None:
+            return None
+        rule = self.rules[int(m.lastgroup[1:])]
+        groups = {}
+        if rule.kind in (PROGRESS, PHASE) or rule.message:
+            inner = rule.regex.match(m.group(m.lastgroup))
+            if inner is not None:
+                groups = inner.groupdict()
+        return RuleMatch(rule, line, groups)
+
+
+
+def success_rules(*markers: str) -> RuleSet:
+    return RuleSet([Rule(SUCCESS, marker, literal=True) for marker in markers])
+
+
+
+# Messages after which a PowerShell run cannot do anything useful, so waiting for
+# the process to exit only wastes time.
+POWERSHELL_FATAL_RULES = RuleSet([
+    Rule(FATAL, r"running scripts is disabled on this system"),
+    Rule(FATAL, r"is not digitally signed\. You cannot run this script"),
+])
+
+
+
+_listener_lock = threading.Lock()
+_progress_listener: Optional[Callable[[str], None]] = None
+_last_progress: Optional[str] = None
+
+
+
+def set_progress_listener(listener: Optional[Callable[[str], None]]):
+    global _progress_listener, _last_progress
+    with _listener_lock:
+        _progress_listener = listener
+        _last_progress = None
+
+
+
+def report_progress(match: RuleMatch):
+    global _last_progress
+    if match.kind not in (PROGRESS, PHASE):
+        return
+    text = match.text if match.percent is None else f"{match.text} ({match.percent}%)"
+    with _listener_lock:
+        # Repeated identical updates (Chocolatey prints the same percentage many times)
+        # are dropped so the UI only redraws when something changed.
+        if text == _last_progress:
+            return
+        _last_progress = text
+        listener = _progress_listener
+    logger.debug(f"Progress: {text}")
+    if listener is not None:
+        try:
+            listener(text)
+        except Exception as e:
+            logger.warning(f"Progress listener failed: {e}")
@@ -0,0 +1,170 @@
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+from utilities.util_pipe_reader import read_line_batches
+
+
+
+# Compares the old line-at-a-time pipe readers with the chunked reader on synthetic
+# output shaped like WinUtil's: many short lines, written as fast as the child can.
+#
+#   python -m utilities.util_pipe_benchmark --megabytes 32 --repeat 3
+_CHILD = r"""
+import sys
+target = int(sys.argv[1]) * 1024 * 1024
+out = sys.stdout.buffer
+written = 0
+n = 0
+while written < target:
+    block = b"".join(
+        b"[%07d] Applying tweak WPFTweaksTelemetry: setting HKLM\\SOFTWARE\\Policies\\Example value %d\r\n" % (n + i, i)
+        for i in range(1000)
+    )
+    out.write(block)
+    written += len(block)
+    n += 1000
+out.flush()
+"""
+
+
+
+class _DiscardHandler(logging.Handler):
+
+    def emit(self, record):
+        self.format(record)
+
+
+
+def _make_logger() -> logging.Logger:
+    # Every mode logs through the same formatter to a discarding handler, so the cost
+    # of a logging call per line (or per batch) is measured without filling talon.log.
+    log = logging.getLogger("talon.pipe_benchmark")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    if not log.handlers:
+        handler = _DiscardHandler()
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s [%(levelname)s] %(name)s %(module)s.%(funcName)s:%(lineno)d: %(message)s'
+        ))
+        log.addHandler(handler)
+    return log
+
+
+
+def _child_cmd(megabytes: int):
+    return [sys.executable, "-c", _CHILD, str(megabytes)]
+
+
+
+def _run_readline_threads(megabytes: int, log: logging.Logger) -> int:
+    proc = subprocess.Popen(
+        _child_cmd(megabytes),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        bufsize=1,
+    )
+    counts = {"STDOUT": 0, "STDERR": 0}
+
+    def _stream(pipe, label):
+        for line in iter(pipe.readline, ""):
+            counts[label] += 1
+            log.debug(f"bench {label}: {line.rstrip()}")
+        pipe.close()
+    threads = [
+        threading.Thread(target=_stream, args=(proc.stdout, "STDOUT"), daemon=True),
+        threading.Thread(target=_stream, args=(proc.stderr, "STDERR"), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    while proc.poll() is None:
+        time.sleep(0.1)
+    for t in threads:
+        t.join()
+    return counts["STDOUT"]
+
+
+
+async def _asyncio_child(megabytes: int, consume):
+    proc = await asyncio.create_subprocess_exec(
+        *_child_cmd(megabytes),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        limit=1024 * 1024,
+    )
+    counts = await asyncio.gather(consume(proc.stdout, "STDOUT"), consume(proc.stderr, "STDERR"))
+    await proc.wait()
+    return counts[0]
+
+
+
+def _run_asyncio_readline(megabytes: int, log: logging.Logger) -> int:
+    async def consume(stream, label):
+        lines = 0
+        while True:
+            line = await stream.readline()
+            if not line:
+                return lines
+            lines += 1
+            log.debug(f"bench {label}: {line.decode('utf-8', 'replace').rstrip()}")
+    return asyncio.run(_asyncio_child(megabytes, consume))
+
+
+
+def _run_chunked(megabytes: int, log: logging.Logger) -> int:
+    async def consume(stream, label):
+        lines = 0
+
+        def on_batch(batch):
+            nonlocal lines
+            lines += len(batch)
+            log.debug("\n".join(f"bench {label}: {line}" for line in batch))
+        await read_line_batches(stream, on_batch)
+        return lines
+    return asyncio.run(_asyncio_child(megabytes, consume))
+
+
+
+MODES = {
+    "readline-threads": _run_readline_threads,
+    "asyncio-readline": _run_asyncio_readline,
+    "chunked": _run_chunked,
+}
+
+
+
+def run_benchmark(megabytes: int = 16, repeat: int = 3):
+    log = _make_logger()
+    print(f"Pipe reader benchmark: {megabytes} MB of synthetic output, best of {repeat}")
+    print(f"{'mode':<18} {'lines':>9} {'wall s':>8} {'cpu s':>8} {'MB/s':>8}")
+    for name, runner in MODES.items():
+        best = None
+        for _ in range(repeat):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            lines = runner(megabytes, log)
+            sample = (time.perf_counter() - wall, time.process_time() - cpu, lines)
+            if best is None or sample[0] < best[0]:
+                best = sample
+        wall, cpu, lines = best
+        print(f"{name:<18} {lines:>9} {wall:>8.2f} {cpu:>8.2f} {megabytes / wall:>8.1f}")
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare child-output pipe readers")
+    parser.add_argument("--megabytes", type=int, default=16, help="Amount of output the child writes.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the fastest is reported.")
+    args = parser.parse_args(argv)
+    run_benchmark(args.megabytes, args.repeat)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import codecs
+import logging
+from typing import Callable, List
+from utilities.util_logger import logger
+
+
+
+# Reads are this large so a chatty child costs one syscall per 64 KiB rather than one
+# per line. A line longer than MAX_LINE is handed on in pieces instead of buffering forever.
+CHUNK_SIZE = 64 * 1024
+MAX_LINE = 1024 * 1024
+
+
+
+class LineSplitter:
+
+    def __init__(self, encoding: str = "utf-8"):
+        # The incremental decoder carries a multi-byte character split across two reads
+        # over to the next chunk, so decoding never happens line by line.
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._pending = ""
+
+    def feed(self, data: bytes) -> List[str]:
+        text = self._pending + self._decoder.decode(data)
+        if "\r" in text:
+            # A trailing \r may be the first half of a \r\n split across reads.
+            held = text.endswith("\r")
+            if held:
+                text = text[:-1]
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+            if held:
+                text += "\r"
+        lines = text.split("\n")
+        self._pending = lines.pop()
+        if len(self._pending) > MAX_LINE:
+            lines.append(self._pending)
+            self._pending = ""
+        return lines
+
+    def flush(self) -> List[str]:
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        text = text.rstrip("\r")
+        return text.replace("\r\n", "\n").replace("\r", "\n").split("\n") if text else []
+
+
+
+async def read_line_batches(stream, on_batch: Callable[[List[str]], None], chunk_size: int = CHUNK_SIZE) -> int:
+    # Returns the number of bytes read. Each batch holds every complete line from one read.
+    splitter = LineSplitter()
+    total = 0
+    while True:
+        data = await stream.read(chunk_size)
+        if not data:
+            break
+        total += len(data)
+        lines = splitter.feed(data)
+        if lines:
+            on_batch(lines)
+    lines = splitter.flush()
+    if lines:
+        on_batch(lines)
+    return total
+
+
+
+def pump_line_batches(pipe, on_batch: Callable[[List[str]], None], chunk_size: int = CHUNK_SIZE) -> int:
+    # Blocking counterpart of read_line_batches for a pipe read on a thread of its own,
+    # such as a long-lived PowerShell host's. read1 returns whatever is buffered rather
+    # than waiting for a full chunk.
+    splitter = LineSplitter()
+    read = getattr(pipe, "read1", pipe.read)
+    total = 0
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        total += len(data)
+        lines = splitter.feed(data)
+        if lines:
+            on_batch(lines)
+    lines = splitter.flush()
+    if lines:
+        on_batch(lines)
+    return total
+
+
+
+def log_line_batch(prefix: str, lines: List[str]):
+    # One record per batch instead of one per line; logging's findCaller frame walk
+    # dominated the cost of chatty scripts. Nothing is formatted unless DEBUG is on.
+    if lines and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("\n".join(f"{prefix}: {line}" for line in lines))
@@ -1,12 +1,282 @@
 import os
+import re
 import sys
-import subprocess
-import threading
 import tempfile
-import time
-from typing import List, Optional, Sequence, Union
+from typing import Callable, List, Optional, Sequence, Union
 from utilities.util_logger import logger
 from utilities.util_error_popup import show_error_popup
+from utilities.util_trace import span
+from utilities.util_watchdog import StepTimeoutError, deadline, register_process, unregister_process
+from utilities.util_powershell_pool import get_pool
+from utilities.util_process_engine import CancelToken, run_process
+from utilities.util_output_capture import OutputCapture
+from utilities.util_output_rules import POWERSHELL_FATAL_RULES, SUCCESS, RuleSet, report_progress
+from utilities.util_pipe_reader import log_line_batch
+from utilities.util_retry import RetryPolicy, TransientFailure, run_with_retry
+from utilities.util_resource_usage import record_usage, start_measurement
+
+
+
+def resolve_script_path(script: str) -> str:
+    if os.path.isabs(script):
+        return script
+    # Prefer embedded scripts bundled with the app, fallback to temp download location
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(sys.executable)
+    else:
+        utilities_dir = os.path.dirname(os.path.abspath(__file__))
+        base_path = os.path.dirname(utilities_dir)
+    embedded_path = os.path.join(base_path, 'debloat_raven_scripts', script)
+    if os.path.exists(embedded_path):
+        return embedded_path
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', script)
+
+
+
+_pool_enabled = True
+
+
+
+def set_pool_enabled(enabled: bool):
+    global _pool_enabled
+    _pool_enabled = enabled
+
+
+
+def pool_enabled() -> bool:
+    return _pool_enabled
+
+
+
+def _use_pool(pooled: Optional[bool], monitor_output: bool, rules: Optional[RuleSet]) -> bool:
+    # Stopping at a success marker means killing the process once it appears, which
+    # would throw away a pooled host, so those runs keep a process of their own.
+    # Progress, phase and fatal rules work on pooled hosts too.
+    if monitor_output or (rules is not None and rules.has(SUCCESS)):
+        return False
+    return _pool_enabled if pooled is None else pooled
+
+
+
+def _cancelled(cancel: Optional[CancelToken]) -> Callable[[], bool]:
+    return lambda: cancel is not None and cancel.cancelled
+
+
+
+def _ps_quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+
+_PARAMETER = re.compile(r"-[A-Za-z_]\w*:?")
+
+
+
+def _script_invocation(script_path: str, args: Optional[List[str]]) -> str:
+    # What -File would do with the same arguments: parameter names and switches such
+    # as -Silent stay bare so PowerShell binds them; everything else is a literal.
+    parts = ["&", _ps_quote(script_path)]
+    for arg in args or []:
+        parts.append(arg if _PARAMETER.fullmatch(arg) else _ps_quote(arg))
+    return " ".join(parts)
+
+
+
+def _finish(
+    trace,
+    scope,
+    rc: int,
+    capture: OutputCapture,
+    failure_message: str,
+    failure_error: str,
+    allow_continue_on_fail: bool,
+    retry: Optional[RetryPolicy] = None,
+) -> int:
+    if capture.spill_path:
+        trace.set(output_file=capture.spill_path)
+    expired = scope.expired()
+    if expired is not None:
+        trace.set(outcome="timeout")
+        raise StepTimeoutError(expired.name, expired.timeout)
+    if rc != 0:
+        reason = retry.classify(rc, capture.tail()) if retry is not None else None
+        if reason is not None:
+            trace.set(outcome="transient", transient=reason)
+            raise TransientFailure(reason)
+        summary = capture.summary()
+        logger.error(f"PowerShell exited with code {rc}" + (f"\n{summary}" if summary else ""))
+        show_error_popup(
+            f"{failure_message} (exit code {rc})" + (f"\n\n{summary}" if summary else ""),
+            allow_continue=allow_continue_on_fail,
+        )
+        raise RuntimeError(f"{failure_error} (code {rc})")
+    logger.debug(f"PowerShell completed successfully (code {rc})")
+    return rc
+
+
+
+def _run_in_pool(
+    body: str,
+    *,
+    name: str,
+    log_prefix: str,
+    failure_message: str,
+    failure_error: str,
+    trace_args: dict,
+    rules: Optional[RuleSet],
+    cancel: Optional[CancelToken],
+    allow_continue_on_fail: bool,
+    timeout: Optional[float],
+    on_output: Optional[Callable[[str], None]],
+    retry: Optional[RetryPolicy] = None,
+) -> int:
+    with span(f"powershell {name}", cat="powershell", pooled=True, **trace_args) as trace, \
+            deadline(f"PowerShell {name}", timeout) as scope:
+        hosts = []
+        measurements = []
+        cancel_callbacks = []
+        capture = OutputCapture(name)
+
+        # Output lines go to the capture and DEBUG only; a failure reports the tail.
+        def _on_stdout(lines):
+            if on_output is not None:
+                for text in lines:
+                    on_output(text)
+            log_line_batch(f"{log_prefix} STDOUT", lines)
+
+        def _on_stderr(lines):
+            log_line_batch(f"{log_prefix} STDERR", lines)
+
+        def _on_host(host):
+            # The watchdog kills the host if the deadline passes, and cancelling kills it
+            # at once even while the command is quiet; the pool then replaces it.
+            hosts.append(host)
+            trace.set(child_pid=host.pid, host_commands=host.commands_run + 1)
+            register_process(host.proc)
+            if cancel is not None:
+                cancel_callbacks.append(cancel.add_callback(host.kill))
+            # The host outlives the command; only what this command adds is charged.
+            measurements.append(start_measurement(host.pid))
+
+        def _cancelled():
+            if cancel is not None and cancel.cancelled:
+                logger.warning("Killing PowerShell due to external cancellation.")
+                return True
+            return scope.cancelled()
+
+        try:
+            result = get_pool().run(
+                body,
+                on_stdout=_on_stdout,
+                on_stderr=_on_stderr,
+                cancelled=_cancelled,
+                on_host=_on_host,
+                rules=rules + POWERSHELL_FATAL_RULES if rules else POWERSHELL_FATAL_RULES,
+                on_rule=report_progress,
+                capture=capture,
+            )
+        except Exception as e:
+            logger.exception(f"Failed to run PowerShell in a pooled host: {e}")
+            show_error_popup(
+                f"Error launching PowerShell:\n{e}",
+                allow_continue=allow_continue_on_fail,
+            )
+            raise
+        finally:
+            capture.close()
+            for remove_callback in cancel_callbacks:
+                remove_callback()
+            for host in hosts:
+                unregister_process(host.proc)
+            for measurement in measurements:
+                if measurement is not None:
+                    usage = measurement.finish()
+                    record_usage(name, usage)
+                    trace.set(**usage.as_dict())
+        rc = result.status
+        trace.set(
+            exit_code=rc,
+            stdout_bytes=result.stdout_bytes,
+            stderr_bytes=result.stderr_bytes,
+        )
+        if result.fatal is not None:
+            trace.set(fatal=result.fatal.line.strip())
+            failure_message = f"{failure_message}: {result.fatal.line.strip()}"
+            rc = rc or 1
+        return _finish(trace, scope, rc, capture, failure_message, failure_error, allow_continue_on_fail, retry)
+
+
+
+def _run_dedicated(
+    cmd: List[str],
+    *,
+    name: str,
+    log_prefix: str,
+    launch_message: str,
+    failure_message: str,
+    failure_error: str,
+    trace_args: dict,
+    monitor_output: bool,
+    termination_str: Optional[str],
+    rules: Optional[RuleSet],
+    cancel: Optional[CancelToken],
+    allow_continue_on_fail: bool,
+    timeout: Optional[float],
+    on_output: Optional[Callable[[str], None]],
+    retry: Optional[RetryPolicy] = None,
+) -> int:
+    with span(f"powershell {name}", cat="powershell", **trace_args) as trace, \
+            deadline(f"PowerShell {name}", timeout) as scope:
+
+        # Output lines go to the capture and DEBUG only; a failure reports the tail.
+        def _on_stdout(lines):
+            if on_output is not None:
+                for text in lines:
+                    on_output(text)
+            log_line_batch(f"{log_prefix} STDOUT", lines)
+
+        def _on_stderr(lines):
+            log_line_batch(f"{log_prefix} STDERR", lines)
+
+        try:
+            result = run_process(
+                cmd,
+                on_stdout=_on_stdout,
+                on_stderr=_on_stderr,
+                cancel=cancel,
+                stop_on=termination_str if monitor_output else None,
+                rules=rules + POWERSHELL_FATAL_RULES if rules else POWERSHELL_FATAL_RULES,
+                on_rule=report_progress,
+                on_start=lambda handle: trace.set(child_pid=handle.pid),
+                capture=OutputCapture(name),
+            )
+        except Exception as e:
+            logger.exception(f"Failed to start PowerShell: {e}")
+            show_error_popup(
+                f"{launch_message}\n{e}",
+                allow_continue=allow_continue_on_fail,
+            )
+            raise
+        rc = result.returncode or 0
+        trace.set(
+            exit_code=rc,
+            stdout_bytes=result.stdout_bytes,
+            stderr_bytes=result.stderr_bytes,
+        )
+        if result.usage is not None:
+            trace.set(**result.usage.as_dict())
+        if result.fatal is not None:
+            trace.set(fatal=result.fatal.line.strip())
+            failure_message = f"{failure_message}: {result.fatal.line.strip()}"
+            rc = rc or 1
+        elif result.matched and rc != 0:
+            logger.info(
+                f"PowerShell terminated after its success marker. "
+                f"Treating exit code {rc} as success."
+            )
+            rc = 0
+        return _finish(trace, scope, rc, result.output, failure_message, failure_error, allow_continue_on_fail, retry)
 
 
 
@@ -16,108 +286,60 @@ def run_powershell_script(
     *,
     monitor_output: bool = False,
     termination_str: Optional[str] = None,
-    cancel_event: Optional[threading.Event] = None,
+    rules: Optional[RuleSet] = None,
+    cancel: Optional[CancelToken] = None,
     allow_continue_on_fail: bool = False,
+    timeout: Optional[float] = None,
+    on_output: Optional[Callable[[str], None]] = None,
+    pooled: Optional[bool] = None,
+    retry: Optional[RetryPolicy] = None,
 ) -> int:
-    if not os.path.isabs(script):
-        # Prefer embedded scripts bundled with the app, fallback to temp download location
-        if getattr(sys, 'frozen', False):
-            base_path = os.path.dirname(sys.executable)
-        else:
-            utilities_dir = os.path.dirname(os.path.abspath(__file__))
-            base_path = os.path.dirname(utilities_dir)
-        embedded_path = os.path.join(base_path, 'debloat_raven_scripts', script)
-        if os.path.exists(embedded_path):
-            script_path = embedded_path
-        else:
-            temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
-            script_path = os.path.join(temp_dir, 'talon', script)
-    else:
-        script_path = script
+    script_path = resolve_script_path(script)
     if not os.path.exists(script_path):
         msg = f"PowerShell script not found: {script_path}"
         logger.error(msg)
         raise FileNotFoundError(msg)
-    cmd = [
-        "powershell.exe",
-        "-NoProfile",
-        "-ExecutionPolicy", "Bypass",
-        "-File", script_path
-    ] + (args or [])
-    logger.info(f"Launching PowerShell: {' '.join(cmd)}")
-    try:
-        creationflags = 0
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            bufsize=1,
-            creationflags=creationflags,
-        )
-    except Exception as e:
-        logger.exception(f"Failed to start PowerShell process: {e}")
-        show_error_popup(
-            f"Error launching PowerShell script:\n{e}",
-            allow_continue=allow_continue_on_fail,
-        )
-        raise
-    termination_detected = False
-
-    def _stream(pipe, log_fn, label):
-        nonlocal termination_detected
-        for line in iter(pipe.readline, ""):
-            text = line.rstrip()
-            log_fn(f"PSCRIPT [{os.path.basename(script_path)}] {label}: {text}")
-            if monitor_output and termination_str and termination_str in text:
-                logger.info(f"Termination string '{termination_str}' detected.")
-                termination_detected = True
-                try:
-                    proc.terminate()
-                except Exception:
-                    pass
-                break
-        pipe.close()
-    threads = []
-    for pipe, fn, lbl in (
-        (proc.stdout, logger.info, "STDOUT"),
-        (proc.stderr, logger.error, "STDERR"),
-    ):
-        t = threading.Thread(target=_stream, args=(pipe, fn, lbl), daemon=True)
-        t.start()
-        threads.append(t)
-    while proc.poll() is None:
-        if cancel_event and cancel_event.is_set():
-            logger.warning("Killing PowerShell due to external cancellation.")
-            try:
-                proc.terminate()
-            except Exception:
-                pass
-            break
-        time.sleep(0.1)
-    for t in threads:
-        t.join()
-    rc = proc.returncode or 0
-    if termination_detected and monitor_output and rc != 0:
-        logger.info(
-            f"PowerShell terminated after detecting '{termination_str}'. "
-            f"Treating exit code {rc} as success."
-        )
-        rc = 0
-    if rc != 0:
-        logger.error(f"PowerShell exited with code {rc}")
-        show_error_popup(
-            f"PowerShell script '{os.path.basename(script_path)}' failed (exit code {rc})",
-            allow_continue=allow_continue_on_fail,
-        )
-        raise RuntimeError(
-            f"PowerShell script failed: {script_path} (code {rc})"
-        )
+    name = os.path.basename(script_path)
+    options = dict(
+        name=name,
+        log_prefix=f"PSCRIPT [{name}]",
+        failure_message=f"PowerShell script '{name}' failed",
+        failure_error=f"PowerShell script failed: {script_path}",
+        trace_args={"script": script_path},
+        cancel=cancel,
+        allow_continue_on_fail=allow_continue_on_fail,
+        timeout=timeout,
+        on_output=on_output,
+    )
+    # Scripts keep their own -File process unless asked otherwise: called with & in a
+    # pooled host, a script's `exit N` only sets $LASTEXITCODE, which any failing
+    # native command sets too, so the host cannot report it the way -File does.
+    if _use_pool(bool(pooled), monitor_output, rules):
+        body = _script_invocation(script_path, args)
+
+        def attempt(number, last):
+            logger.info(f"Running PowerShell script in pooled host: {script_path} {' '.join(args or [])}")
+            return _run_in_pool(body, rules=rules, retry=None if last else retry, **options)
     else:
-        logger.debug(f"PowerShell completed successfully (code {rc})")
-    return rc
+        cmd = [
+            "powershell.exe",
+            "-NoProfile",
+            "-ExecutionPolicy", "Bypass",
+            "-File", script_path
+        ] + (args or [])
+
+        def attempt(number, last):
+            logger.info(f"Launching PowerShell: {' '.join(cmd)}")
+            return _run_dedicated(
+                cmd,
+                launch_message="Error launching PowerShell script:",
+                monitor_output=monitor_output,
+                termination_str=termination_str,
+                rules=rules,
+                retry=None if last else retry,
+                **options,
+            )
+    return run_with_retry(f"PowerShell script {name}", retry, attempt, cancelled=_cancelled(cancel))
 
 
 
@@ -126,91 +348,51 @@ def run_powershell_command(
     *,
     monitor_output: bool = False,
     termination_str: Optional[str] = None,
-    cancel_event: Optional[threading.Event] = None,
+    rules: Optional[RuleSet] = None,
+    cancel: Optional[CancelToken] = None,
     allow_continue_on_fail: bool = False,
+    timeout: Optional[float] = None,
+    on_output: Optional[Callable[[str], None]] = None,
+    pooled: Optional[bool] = None,
+    retry: Optional[RetryPolicy] = None,
 ) -> int:
     if not isinstance(command, str):
         command = "".join(command)
-    cmd = [
-        "powershell.exe",
-        "-NoProfile",
-        "-ExecutionPolicy",
-        "Bypass",
-        "-Command",
-        command,
-    ]
-    logger.info(f"Launching PowerShell command: {command}")
-    creationflags = 0
-    try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            bufsize=1,
-            creationflags=creationflags,
-        )
-    except Exception as e:
-        logger.exception(f"Failed to start PowerShell command: {e}")
-        show_error_popup(
-            f"Error launching PowerShell:\n{e}",
-            allow_continue=allow_continue_on_fail,
-        )
-        raise
-    termination_detected = False
-
-
-
-    def _stream(pipe, log_fn, label):
-        nonlocal termination_detected
-        for line in iter(pipe.readline, ""):
-            text = line.rstrip()
-            log_fn(f"PCOMMAND {label}: {text}")
-            if monitor_output and termination_str and termination_str in text:
-                logger.info(f"Termination string '{termination_str}' detected.")
-                termination_detected = True
-                try:
-                    proc.terminate()
-                except Exception:
-                    pass
-                break
-        pipe.close()
-    threads = []
-    for pipe, fn, lbl in (
-        (proc.stdout, logger.info, "STDOUT"),
-        (proc.stderr, logger.error, "STDERR"),
-    ):
-        t = threading.Thread(target=_stream, args=(pipe, fn, lbl), daemon=True)
-        t.start()
-        threads.append(t)
-    while proc.poll() is None:
-        if cancel_event and cancel_event.is_set():
-            logger.warning("Killing PowerShell due to external cancellation.")
-            try:
-                proc.terminate()
-            except Exception:
-                pass
-            break
-        time.sleep(0.1)
-
-    for t in threads:
-        t.join()
-    rc = proc.returncode or 0
-    if termination_detected and monitor_output and rc != 0:
-        logger.info(
-            f"PowerShell terminated after detecting '{termination_str}'. "
-            f"Treating exit code {rc} as success."
-        )
-        rc = 0
-    if rc != 0:
-        logger.error(f"PowerShell exited with code {rc}")
-        show_error_popup(
-            f"PowerShell command failed (exit code {rc})",
-            allow_continue=allow_continue_on_fail,
-        )
-        raise RuntimeError(f"PowerShell command failed (code {rc})")
+    options = dict(
+        name="command",
+        log_prefix="PCOMMAND",
+        failure_message="PowerShell command failed",
+        failure_error="PowerShell command failed",
+        trace_args={"command": command[:200]},
+        cancel=cancel,
+        allow_continue_on_fail=allow_continue_on_fail,
+        timeout=timeout,
+        on_output=on_output,
+    )
+    if _use_pool(pooled, monitor_output, rules):
+
+        def attempt(number, last):
+            logger.info(f"Running PowerShell command in pooled host: {command}")
+            return _run_in_pool(command, rules=rules, retry=None if last else retry, **options)
     else:
-        logger.debug(f"PowerShell completed successfully (code {rc})")
-    return rc
+        cmd = [
+            "powershell.exe",
+            "-NoProfile",
+            "-ExecutionPolicy",
+            "Bypass",
+            "-Command",
+            command,
+        ]
+
+        def attempt(number, last):
+            logger.info(f"Launching PowerShell command: {command}")
+            return _run_dedicated(
+                cmd,
+                launch_message="Error launching PowerShell:",
+                monitor_output=monitor_output,
+                termination_str=termination_str,
+                rules=rules,
+                retry=None if last else retry,
+                **options,
+            )
+    return run_with_retry(f"PowerShell command {command[:80]}", retry, attempt, cancelled=_cancelled(cancel))
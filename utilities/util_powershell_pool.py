@@ -0,0 +1,285 @@
+import base64
+import atexit
+import itertools
+import queue
+import subprocess
+import threading
+from typing import Callable, List, Optional
+from utilities.util_logger import logger
+from utilities.util_watchdog import OWN_SESSION, kill_process_tree
+from utilities.util_output_capture import OutputCapture
+from utilities.util_output_rules import FATAL, RuleMatch, RuleSet
+from utilities.util_pipe_reader import pump_line_batches
+
+
+
+DONE_MARKER = "##TALON-DONE"
+# How often a command that prints nothing is checked for cancellation. Deadlines do
+# not wait for this: the watchdog kills the host, which ends its output.
+IDLE_CHECK = 1.0
+
+# The host reads one request per line from stdin: "<id> <base64 UTF-8 script>". It runs
+# the script, writes its output to stdout (error records to stderr), then closes the
+# request with a DONE marker on both streams so the reader knows both are drained.
+# Status follows -File: 0 unless the script throws a terminating error (1). A native
+# command's $LASTEXITCODE does not count; an explicit `exit N` ends the host itself,
+# and the pool reports N from its exit code.
+_HOST_LOOP = r"""$ErrorActionPreference = 'Continue'
+$ProgressPreference = 'SilentlyContinue'
+$utf8 = New-Object System.Text.UTF8Encoding $false
+[Console]::OutputEncoding = $utf8
+$stdin = New-Object System.IO.StreamReader ([Console]::OpenStandardInput(), $utf8)
+while ($null -ne ($line = $stdin.ReadLine())) {
+    $id, $payload = $line.Split(' ', 2)
+    $status = 0
+    try {
+        $body = [ScriptBlock]::Create($utf8.GetString([Convert]::FromBase64String($payload)))
+        & $body *>&1 | ForEach-Object {
+            if ($_ -is [System.Management.Automation.ErrorRecord]) { [Console]::Error.WriteLine("$_") }
+            else { [Console]::Out.WriteLine("$_") }
+        }
+    } catch {
+        [Console]::Error.WriteLine($_.Exception.Message)
+        $status = 1
+    }
+    [Console]::Out.WriteLine("##TALON-DONE $id $status")
+    [Console]::Error.WriteLine("##TALON-DONE $id")
+}
+"""
+
+HOST_COMMAND = [
+    "powershell.exe",
+    "-NoProfile",
+    "-ExecutionPolicy", "Bypass",
+    "-EncodedCommand", base64.b64encode(_HOST_LOOP.encode("utf-16-le")).decode("ascii"),
+]
+
+
+
+class HostResult:
+
+    __slots__ = ("status", "fatal", "stdout_bytes", "stderr_bytes")
+
+    def __init__(self, status: int, fatal: Optional[RuleMatch], stdout_bytes: int, stderr_bytes: int):
+        self.status = status
+        self.fatal = fatal
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+
+
+
+class PowerShellHost:
+
+    _ids = itertools.count(1)
+
+    def __init__(self, command: List[str]):
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+            start_new_session=OWN_SESSION,
+        )
+        self.pid = self.proc.pid
+        self.commands_run = 0
+        # Each pipe is read in large chunks on its own thread; the queue carries one
+        # batch of lines per read, and None once the pipe is closed.
+        self._batches = queue.Queue()
+        for pipe, label in ((self.proc.stdout, "STDOUT"), (self.proc.stderr, "STDERR")):
+            threading.Thread(target=self._pump, args=(pipe, label), name=f"pwsh-host-{self.pid}-{label.lower()}", daemon=True).start()
+        logger.debug(f"Started PowerShell host pid={self.pid}")
+
+    def _pump(self, pipe, label):
+        try:
+            pump_line_batches(pipe, lambda lines: self._batches.put((label, lines)))
+        finally:
+            self._batches.put((label, None))
+            pipe.close()
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def execute(
+        self,
+        script: str,
+        on_stdout: Optional[Callable[[List[str]], None]] = None,
+        on_stderr: Optional[Callable[[List[str]], None]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+        rules: Optional[RuleSet] = None,
+        on_rule: Optional[Callable[[RuleMatch], None]] = None,
+        capture: Optional[OutputCapture] = None,
+    ) -> HostResult:
+        # Output is handed on in batches, as run_process does. A FATAL rule match kills
+        # the host straight away; cancellation is checked after every batch, and every
+        # IDLE_CHECK seconds while the command is quiet.
+        request_id = next(self._ids)
+        payload = base64.b64encode(script.encode("utf-8")).decode("ascii")
+        self.commands_run += 1
+        self.proc.stdin.write(f"{request_id} {payload}\n".encode("ascii"))
+        self.proc.stdin.flush()
+        done = f"{DONE_MARKER} {request_id}"
+        status = None
+        fatal = None
+        stderr_done = False
+        open_streams = 2
+        counts = {"STDOUT": 0, "STDERR": 0}
+        killed = False
+        while (status is None or not stderr_done) and open_streams:
+            if not killed and cancelled is not None and cancelled():
+                logger.warning(f"Killing PowerShell host pid={self.pid} to cancel its command")
+                self.kill()
+                killed = True
+            try:
+                label, lines = self._batches.get(timeout=IDLE_CHECK)
+            except queue.Empty:
+                if not self.alive():
+                    # Killed, but a grandchild still holds the pipes open.
+                    break
+                continue
+            if lines is None:
+                open_streams -= 1
+                continue
+            if label == "STDOUT":
+                if lines[-1].startswith(done + " "):
+                    try:
+                        status = int(lines.pop()[len(done) + 1:])
+                    except ValueError:
+                        status = 1
+            elif lines[-1] == done:
+                lines.pop()
+                stderr_done = True
+            if not lines:
+                continue
+            counts[label] += sum(map(len, lines)) + len(lines)
+            if capture is not None:
+                capture.write_many(label, lines)
+            callback = on_stdout if label == "STDOUT" else on_stderr
+            if callback is not None:
+                callback(lines)
+            if rules is not None:
+                for match in rules.scan(lines):
+                    if on_rule is not None:
+                        on_rule(match)
+                    if match.kind == FATAL and fatal is None:
+                        logger.error(f"Fatal output detected: {match.line.strip()}")
+                        fatal = match
+                        self.kill()
+                        killed = True
+        if status is None:
+            # The host died part way through (killed, or the command called exit).
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.kill()
+            status = self.proc.returncode or 1
+            logger.warning(f"PowerShell host pid={self.pid} exited during a command (code {self.proc.returncode})")
+        return HostResult(status, fatal, counts["STDOUT"], counts["STDERR"])
+
+    def kill(self):
+        if not self.alive():
+            return
+        try:
+            kill_process_tree(self.pid)
+        except Exception:
+            self.proc.kill()
+
+    def close(self):
+        try:
+            # Closing stdin ends the host's read loop, so it exits on its own.
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.kill()
+        logger.debug(f"Stopped PowerShell host pid={self.pid} after {self.commands_run} commands")
+
+
+
+class PowerShellPool:
+
+    def __init__(self, size: int = 4, max_commands: int = 25, command: Optional[List[str]] = None):
+        # Hosts are recycled after max_commands so state one script leaves behind
+        # (loaded modules, variables, leaked memory) cannot build up for the whole run.
+        self.command = list(command or HOST_COMMAND)
+        self.max_commands = max_commands
+        self._slots = threading.Semaphore(size)
+        self._idle: List[PowerShellHost] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self) -> PowerShellHost:
+        self._slots.acquire()
+        try:
+            with self._lock:
+                while self._idle:
+                    host = self._idle.pop()
+                    if host.alive():
+                        return host
+            return PowerShellHost(self.command)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, host: PowerShellHost):
+        try:
+            with self._lock:
+                if not self._closed and host.alive() and host.commands_run < self.max_commands:
+                    self._idle.append(host)
+                    return
+            host.close()
+        finally:
+            self._slots.release()
+
+    def run(
+        self,
+        script: str,
+        *,
+        on_stdout: Optional[Callable[[List[str]], None]] = None,
+        on_stderr: Optional[Callable[[List[str]], None]] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+        on_host: Optional[Callable[[PowerShellHost], None]] = None,
+        rules: Optional[RuleSet] = None,
+        on_rule: Optional[Callable[[RuleMatch], None]] = None,
+        capture: Optional[OutputCapture] = None,
+    ) -> HostResult:
+        host = self.acquire()
+        try:
+            if on_host is not None:
+                on_host(host)
+            return host.execute(script, on_stdout, on_stderr, cancelled, rules, on_rule, capture)
+        except BaseException:
+            host.kill()
+            raise
+        finally:
+            self.release(host)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            hosts, self._idle = self._idle, []
+        for host in hosts:
+            host.close()
+
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+
+def get_pool() -> PowerShellPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PowerShellPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+
+def set_pool(pool: Optional[PowerShellPool]) -> Optional[PowerShellPool]:
+    # Returns the previous pool so tests can run a stand-in host and put it back.
+    global _pool
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    return previous
@@ -0,0 +1,217 @@
+import os
+import time
+import asyncio
+import threading
+import subprocess
+from typing import Callable, List, Optional, Sequence
+from utilities.util_logger import logger
+from utilities.util_watchdog import OWN_SESSION, kill_process_tree, register_process, unregister_process
+from utilities.util_output_capture import OutputCapture
+from utilities.util_output_rules import FATAL, SUCCESS, RuleMatch, RuleSet, success_rules
+from utilities.util_pipe_reader import read_line_batches
+from utilities.util_resource_usage import ResourceUsage, record_usage, start_measurement
+
+
+
+# How much unread output asyncio buffers per pipe before it stops reading from the child.
+_BUFFER_LIMIT = 1024 * 1024
+
+
+
+class CancelToken:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+        self.cancelled = False
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cancellation callback failed: {e}")
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+
+class ProcessResult:
+
+    __slots__ = ("args", "pid", "returncode", "duration", "stdout_bytes", "stderr_bytes", "cancelled", "matched", "fatal", "output", "usage")
+
+    def __init__(self, args, pid, returncode, duration, stdout_bytes, stderr_bytes, cancelled, matched, fatal, output, usage=None):
+        self.args = list(args)
+        self.pid = pid
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.cancelled = cancelled
+        self.matched = matched
+        self.fatal: Optional[RuleMatch] = fatal
+        self.output = output
+        self.usage: Optional[ResourceUsage] = usage
+
+    @property
+    def ok(self) -> bool:
+        return self.fatal is None and (self.returncode == 0 or self.matched)
+
+
+
+class ProcessHandle:
+
+    # Popen-like view of an asyncio process for code on other threads, chiefly the
+    # watchdog, which needs pid, poll() and kill().
+    def __init__(self, proc, loop):
+        self._proc = proc
+        self._loop = loop
+        self.pid = proc.pid
+
+    def poll(self) -> Optional[int]:
+        return self._proc.returncode
+
+    def kill(self):
+        if self._proc.returncode is None:
+            self._loop.call_soon_threadsafe(self._kill)
+
+    def _kill(self):
+        try:
+            self._proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+
+async def _pump(stream, callback, counts, label, on_match, capture):
+    def _on_batch(lines):
+        capture.write_many(label, lines)
+        if callback is not None:
+            callback(lines)
+        if on_match is not None:
+            on_match(lines)
+    counts[label] = await read_line_batches(stream, _on_batch)
+
+
+
+async def _run(cmd, on_stdout, on_stderr, cancel, rules, on_rule, creationflags, on_start, capture):
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        limit=_BUFFER_LIMIT,
+        creationflags=creationflags,
+        start_new_session=OWN_SESSION,
+    )
+    handle = ProcessHandle(proc, loop)
+    measurement = start_measurement(proc.pid)
+    usage = None
+    stop = asyncio.Event()
+    state = {"matched": False, "cancelled": False, "fatal": None}
+    counts = {"STDOUT": 0, "STDERR": 0}
+
+    def _request_stop():
+        state["cancelled"] = True
+        loop.call_soon_threadsafe(stop.set)
+
+    def _match(lines):
+        for match in rules.scan(lines):
+            _handle_match(match)
+
+    def _handle_match(match):
+        text = match.line
+        if on_rule is not None:
+            on_rule(match)
+        if match.kind == SUCCESS and not state["matched"]:
+            logger.info(f"Success marker detected: {text.strip()}")
+            state["matched"] = True
+            stop.set()
+        elif match.kind == FATAL and state["fatal"] is None:
+            # A known-fatal message ends the run now instead of when the process exits.
+            logger.error(f"Fatal output detected: {text.strip()}")
+            state["fatal"] = match
+            stop.set()
+
+    remove_callback = cancel.add_callback(_request_stop) if cancel is not None else None
+    register_process(handle)
+    try:
+        if on_start is not None:
+            on_start(handle)
+        readers = asyncio.ensure_future(asyncio.gather(
+            _pump(proc.stdout, on_stdout, counts, "STDOUT", _match if rules else None, capture),
+            _pump(proc.stderr, on_stderr, counts, "STDERR", _match if rules else None, capture),
+        ))
+        stopper = asyncio.ensure_future(stop.wait())
+        await asyncio.wait({readers, stopper}, return_when=asyncio.FIRST_COMPLETED)
+        if stop.is_set() and proc.returncode is None:
+            if state["cancelled"] or state["fatal"] is not None:
+                logger.warning(f"Killing process tree of pid={proc.pid}")
+                await loop.run_in_executor(None, kill_process_tree, proc.pid)
+            else:
+                try:
+                    proc.terminate()
+                except ProcessLookupError:
+                    pass
+        stopper.cancel()
+        await readers
+        returncode = await proc.wait()
+    finally:
+        unregister_process(handle)
+        capture.close()
+        if remove_callback is not None:
+            remove_callback()
+        if measurement is not None:
+            # Read once the process has been waited for, so the counters are final.
+            usage = measurement.finish()
+            record_usage(capture.name, usage)
+    return ProcessResult(
+        cmd, proc.pid, returncode, time.monotonic() - start,
+        counts["STDOUT"], counts["STDERR"], state["cancelled"], state["matched"], state["fatal"], capture, usage,
+    )
+
+
+
+def run_process(
+    cmd: Sequence[str],
+    *,
+    on_stdout: Optional[Callable[[List[str]], None]] = None,
+    on_stderr: Optional[Callable[[List[str]], None]] = None,
+    cancel: Optional[CancelToken] = None,
+    stop_on: Optional[str] = None,
+    rules: Optional[RuleSet] = None,
+    on_rule: Optional[Callable[[RuleMatch], None]] = None,
+    creationflags: int = 0,
+    on_start: Optional[Callable[[ProcessHandle], None]] = None,
+    capture: Optional[OutputCapture] = None,
+) -> ProcessResult:
+    # Each call drives its own event loop on the calling thread: both pipes are read
+    # by one loop in large chunks and output callbacks receive batches of lines, and process exit, output and cancellation are all awaited rather
+    # than polled. The process is registered with the current deadline scope, and its
+    # output is kept in a bounded capture that the result exposes for error reporting.
+    if cancel is not None and cancel.cancelled:
+        raise RuntimeError(f"Not starting {cmd[0]}: {cancel.reason}")
+    if stop_on:
+        rules = success_rules(stop_on) + rules if rules else success_rules(stop_on)
+    if capture is None:
+        capture = OutputCapture(os.path.basename(cmd[0]))
+    return asyncio.run(_run(list(cmd), on_stdout, on_stderr, cancel, rules, on_rule, creationflags, on_start, capture))
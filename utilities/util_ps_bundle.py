@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence
+from utilities.util_logger import logger
+from utilities.util_powershell_handler import run_powershell_script
+
+
+
+MARKER_PREFIX = "##TALON-"
+
+# Every action runs through Invoke-TalonAction, which brackets its output with
+# BEGIN/END markers carrying the exit status. All streams are merged into the
+# pipeline so Write-Host output (which WinUtil uses for its completion message)
+# can be matched against a stop string. A failed fatal action ends the bundle,
+# which always exits 0 so that the Python side decides how to report failures.
+_PRELUDE = r"""$ErrorActionPreference = 'Continue'
+$ProgressPreference = 'SilentlyContinue'
+
+function Invoke-TalonAction {
+    param([string]$Id, [scriptblock]$Body, [string]$StopOn, [int[]]$OkCodes, [bool]$Fatal)
+    Write-Output "##TALON-BEGIN $Id"
+    $global:LASTEXITCODE = 0
+    $status = 0
+    $stopped = $false
+    try {
+        do {
+            & $Body *>&1 | ForEach-Object {
+                "$_"
+                if ($StopOn -and "$_".Contains($StopOn)) { $stopped = $true; break }
+            }
+        } while ($false)
+        if (-not $stopped -and $LASTEXITCODE) { $status = $LASTEXITCODE }
+    } catch {
+        Write-Output "##TALON-ERROR $Id $($_.Exception.Message)"
+        $status = 1
+    }
+    Write-Output "##TALON-END $Id $status"
+    if ($Fatal -and ($OkCodes -notcontains $status)) {
+        Write-Output "##TALON-ABORT $Id"
+        exit 0
+    }
+}
+"""
+
+
+
+class BundleAction:
+
+    def __init__(
+        self,
+        step: str,
+        action: str,
+        description: str,
+        *,
+        script: Optional[str] = None,
+        args: Sequence[str] = (),
+        command: Optional[str] = None,
+        termination_str: Optional[str] = None,
+        ok_exit_codes: Sequence[int] = (0,),
+        fatal: bool = True,
+    ):
+        if (script is None) == (command is None):
+            raise ValueError("A bundle action needs exactly one of script or command")
+        self.step = step
+        self.action = action
+        self.description = description
+        self.script = script
+        self.args = list(args)
+        self.command = command
+        self.termination_str = termination_str
+        self.ok_exit_codes = tuple(ok_exit_codes)
+        self.fatal = fatal
+        self.status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status is not None and self.status in self.ok_exit_codes
+
+
+
+def _ps_quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+
+def _body(action: BundleAction) -> str:
+    if action.script is not None:
+        return " ".join(["&", _ps_quote(action.script)] + [_ps_quote(arg) for arg in action.args])
+    return action.command
+
+
+
+def compile_bundle(actions: Sequence[BundleAction]) -> str:
+    parts = [_PRELUDE]
+    for index, action in enumerate(actions):
+        parts.append(f"\n# [{index}] {action.step} / {action.action}: {action.description}")
+        parts.append(
+            f"Invoke-TalonAction -Id {index} "
+            f"-StopOn {_ps_quote(action.termination_str or '')} "
+            f"-OkCodes @({', '.join(str(code) for code in action.ok_exit_codes)}) "
+            f"-Fatal ${'true' if action.fatal else 'false'} "
+            f"-Body {{\n{_body(action)}\n}}"
+        )
+    parts.append("\nexit 0\n")
+    return "\n".join(parts)
+
+
+
+def write_bundle(script: str, path: Optional[str] = None) -> str:
+    if path is None:
+        # Bundles are content-addressed so an identical plan reuses the cached file,
+        # and every bundle that ever ran stays on disk for auditing.
+        digest = hashlib.sha256(script.encode("utf-8")).hexdigest()[:16]
+        temp_dir = os.environ.get("TEMP", tempfile.gettempdir())
+        path = os.path.join(temp_dir, "talon", "bundles", f"bundle-{digest}.ps1")
+        if os.path.exists(path):
+            logger.info(f"Reusing cached PowerShell bundle: {path}")
+            return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Windows PowerShell 5 reads BOM-less scripts as ANSI, so write UTF-8 with a BOM.
+    with open(path, "w", encoding="utf-8-sig", newline="\r\n") as f:
+        f.write(script)
+    logger.info(f"Wrote PowerShell bundle with {script.count('Invoke-TalonAction -Id')} actions: {path}")
+    return path
+
+
+
+def run_bundle(
+    actions: List[BundleAction],
+    *,
+    timeout: Optional[float] = None,
+    on_action_start: Optional[Callable[[BundleAction], None]] = None,
+    on_action_end: Optional[Callable[[BundleAction], None]] = None,
+) -> List[BundleAction]:
+    if not actions:
+        return actions
+    path = write_bundle(compile_bundle(actions))
+    started: Dict[int, float] = {}
+
+    def _on_output(line: str):
+        if not line.startswith(MARKER_PREFIX):
+            return
+        kind, _, rest = line[len(MARKER_PREFIX):].partition(" ")
+        index_text, _, detail = rest.partition(" ")
+        try:
+            action = actions[int(index_text)]
+        except (ValueError, IndexError):
+            return
+        if kind == "BEGIN":
+            started[int(index_text)] = time.monotonic()
+            logger.info(f"Bundle: starting {action.step} / {action.action}")
+            if on_action_start is not None:
+                on_action_start(action)
+        elif kind == "ERROR":
+            action.error = detail
+        elif kind == "END":
+            try:
+                action.status = int(detail)
+            except ValueError:
+                action.status = 1
+            begin = started.get(int(index_text))
+            if begin is not None:
+                action.duration = time.monotonic() - begin
+            logger.info(f"Bundle: {action.step} / {action.action} finished with status {action.status}")
+            if on_action_end is not None:
+                on_action_end(action)
+
+    run_powershell_script(path, timeout=timeout, on_output=_on_output)
+    return actions
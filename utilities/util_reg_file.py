@@ -0,0 +1,400 @@
+import codecs
+import locale
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+from utilities.util_logger import logger
+from utilities.util_trace import span
+from utilities.util_registry_backend import (
+    HKEY_CLASSES_ROOT, HKEY_CURRENT_CONFIG, HKEY_CURRENT_USER, HKEY_LOCAL_MACHINE, HKEY_USERS,
+    REG_BINARY, REG_DWORD, REG_EXPAND_SZ, REG_MULTI_SZ, REG_QWORD, REG_SZ, get_backend,
+)
+from utilities.util_registry_journal import read_journal
+from utilities.util_modify_registry import (
+    RegistryChange, resolve_hive, apply_batch, create_key, delete_key, delete_value, walk_tree,
+)
+
+
+
+# Reader and writer for the text format regedit imports and exports:
+#
+#   Windows Registry Editor Version 5.00      (REGEDIT4 for the old ANSI flavour)
+#   [HKEY_CURRENT_USER\Software\Example]      key, created if missing
+#   [-HKEY_CURRENT_USER\Software\Old]         key deleted with everything below it
+#   "Name"="text"  @="default"  "Count"=dword:00000001
+#   "Data"=hex:01,02,\                        hex(2)/hex(7)/hex(b) for expand, multi, qword
+#     03,04                                   trailing backslash continues the line
+#   "Gone"=-                                  value deleted
+#
+# Files are read line by line and applied in batches, so a large export is never held
+# in memory as a whole.
+HEADER_V5 = "Windows Registry Editor Version 5.00"
+HEADER_V4 = "REGEDIT4"
+BATCH_SIZE = 1000
+_WRAP = 80
+
+SET = "set"
+DELETE_VALUE = "delete value"
+DELETE_KEY = "delete key"
+KEY = "key"
+
+_LONG_HIVE_NAMES = {
+    HKEY_LOCAL_MACHINE: "HKEY_LOCAL_MACHINE",
+    HKEY_CURRENT_USER: "HKEY_CURRENT_USER",
+    HKEY_CLASSES_ROOT: "HKEY_CLASSES_ROOT",
+    HKEY_USERS: "HKEY_USERS",
+    HKEY_CURRENT_CONFIG: "HKEY_CURRENT_CONFIG",
+}
+
+
+
+class RegOperation:
+
+    __slots__ = ("op", "hive", "key_path", "name", "value", "value_type", "line")
+
+    def __init__(self, op: str, hive: str, key_path: str, name: Optional[str] = None,
+                 value: Any = None, value_type: Optional[int] = None, line: int = 0):
+        # name is "" for the default value (@); line is where the entry starts.
+        self.op = op
+        self.hive = hive
+        self.key_path = key_path
+        self.name = name
+        self.value = value
+        self.value_type = value_type
+        self.line = line
+
+
+
+def _open_text(path: str) -> TextIO:
+    # regedit writes version 5 files as UTF-16 LE with a BOM; hand-written ones are
+    # usually UTF-8, and REGEDIT4 files are in the ANSI code page.
+    with open(path, "rb") as f:
+        start = f.read(4)
+    if start.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    elif start.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    else:
+        encoding = "utf-8"
+        try:
+            with open(path, "r", encoding=encoding) as f:
+                for _ in f:
+                    pass
+        except UnicodeDecodeError:
+            encoding = locale.getpreferredencoding(False)
+    return open(path, "r", encoding=encoding, errors="replace")
+
+
+
+def _logical_lines(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    # Joins continued lines (hex data ending in a backslash) and drops blanks and
+    # comments. Yields (first line number, text).
+    pending = None
+    start = 0
+    for number, raw in enumerate(lines, 1):
+        line = raw.rstrip("\r\n")
+        if pending is not None:
+            line = pending + line.lstrip()
+        else:
+            start = number
+            if not line.strip() or line.lstrip().startswith(";"):
+                continue
+        if line.endswith("\\"):
+            pending = line[:-1]
+            continue
+        pending = None
+        yield start, line.strip()
+    if pending is not None:
+        yield start, pending.strip()
+
+
+
+def _parse_quoted(text: str, pos: int, where: str) -> Tuple[str, int]:
+    # text[pos] is the opening quote; returns the unescaped string and the index after
+    # the closing quote. Only \\ and \" are escapes in .reg strings.
+    out = []
+    i = pos + 1
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\" and i + 1 < len(text):
+            out.append(text[i + 1])
+            i += 2
+            continue
+        if ch == '"':
+            return "".join(out), i + 1
+        out.append(ch)
+        i += 1
+    raise ValueError(f"{where}: unterminated string")
+
+
+
+def _hex_bytes(text: str, where: str) -> bytes:
+    text = "".join(text.split())
+    if not text:
+        return b""
+    try:
+        return bytes(int(part, 16) for part in text.split(",") if part)
+    except ValueError:
+        raise ValueError(f"{where}: bad hex data")
+
+
+
+def _decode_hex(data: bytes, value_type: int, unicode: bool) -> Any:
+    # Strings in hex() form are UTF-16 LE in version 5 files and ANSI in REGEDIT4.
+    def text(raw):
+        return raw.decode("utf-16-le", "replace") if unicode else raw.decode(locale.getpreferredencoding(False), "replace")
+    if value_type in (REG_SZ, REG_EXPAND_SZ):
+        return text(data).split("\0", 1)[0]
+    if value_type == REG_MULTI_SZ:
+        items = text(data).split("\0")
+        while items and items[-1] == "":
+            items.pop()
+        return items
+    if value_type == REG_DWORD and len(data) == 4:
+        return int.from_bytes(data, "little")
+    if value_type == REG_QWORD and len(data) == 8:
+        return int.from_bytes(data, "little")
+    return data
+
+
+
+def _parse_value(text: str, unicode: bool, where: str) -> Tuple[Any, int]:
+    if text.startswith('"'):
+        value, end = _parse_quoted(text, 0, where)
+        if text[end:].strip():
+            raise ValueError(f"{where}: unexpected text after string value")
+        return value, REG_SZ
+    lowered = text.lower()
+    if lowered.startswith("dword:"):
+        try:
+            return int(text[6:].strip(), 16), REG_DWORD
+        except ValueError:
+            raise ValueError(f"{where}: bad dword value")
+    if lowered.startswith("hex:"):
+        return _hex_bytes(text[4:], where), REG_BINARY
+    if lowered.startswith("hex("):
+        close = text.find("):")
+        if close < 0:
+            raise ValueError(f"{where}: bad hex() type")
+        try:
+            value_type = int(text[4:close], 16)
+        except ValueError:
+            raise ValueError(f"{where}: bad hex() type")
+        return _decode_hex(_hex_bytes(text[close + 2:], where), value_type, unicode), value_type
+    raise ValueError(f"{where}: unrecognised value {text[:40]!r}")
+
+
+
+def parse_reg(lines: Iterable[str], source: str = "<reg>") -> Iterator[RegOperation]:
+    # Yields the operations of a .reg file in file order.
+    unicode = True
+    hive = key_path = None
+    seen_header = False
+    for number, line in _logical_lines(lines):
+        where = f"{source}:{number}"
+        if not seen_header:
+            if line == HEADER_V5:
+                unicode = True
+            elif line == HEADER_V4:
+                unicode = False
+            else:
+                raise ValueError(f"{where}: not a registry file (missing '{HEADER_V5}' header)")
+            seen_header = True
+            continue
+        if line.startswith("["):
+            if not line.endswith("]"):
+                raise ValueError(f"{where}: unterminated key")
+            path = line[1:-1].strip()
+            deleting = path.startswith("-")
+            hive, _, key_path = path.lstrip("-").partition("\\")
+            try:
+                resolve_hive(hive)
+            except ValueError as e:
+                raise ValueError(f"{where}: {e}")
+            if deleting:
+                yield RegOperation(DELETE_KEY, hive, key_path, line=number)
+                hive = key_path = None
+            else:
+                yield RegOperation(KEY, hive, key_path, line=number)
+            continue
+        if hive is None:
+            raise ValueError(f"{where}: value outside of a key")
+        if line.startswith("@"):
+            name, rest = "", line[1:].lstrip()
+        elif line.startswith('"'):
+            name, end = _parse_quoted(line, 0, where)
+            rest = line[end:].lstrip()
+        else:
+            raise ValueError(f"{where}: expected a value name")
+        if not rest.startswith("="):
+            raise ValueError(f"{where}: expected '=' after the value name")
+        rest = rest[1:].strip()
+        if rest == "-":
+            yield RegOperation(DELETE_VALUE, hive, key_path, name, line=number)
+        else:
+            value, value_type = _parse_value(rest, unicode, where)
+            yield RegOperation(SET, hive, key_path, name, value, value_type, line=number)
+
+
+
+def read_reg_file(path: str) -> Iterator[RegOperation]:
+    with _open_text(path) as f:
+        yield from parse_reg(f, path)
+
+
+
+def import_reg_file(path: str, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    # Value writes are collected and applied with apply_batch, which opens each key
+    # once and skips values that already match; deletions flush the pending batch
+    # first so the file's order is kept. Keys listed without values are created.
+    counts = {"written": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+    pending: List[RegistryChange] = []
+    empty_keys: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+    def flush():
+        for hive, key_path in empty_keys.values():
+            try:
+                create_key(hive, key_path)
+            except Exception:
+                counts["failed"] += 1
+        empty_keys.clear()
+        if pending:
+            result = apply_batch(pending)
+            for status, count in result.counts().items():
+                counts[status] = counts.get(status, 0) + count
+            pending.clear()
+
+    with span("reg import", cat="registry", file=path) as trace:
+        for op in read_reg_file(path):
+            if op.op == KEY:
+                empty_keys[(op.hive.upper(), op.key_path.lower())] = (op.hive, op.key_path)
+            elif op.op == SET:
+                empty_keys.pop((op.hive.upper(), op.key_path.lower()), None)
+                pending.append(RegistryChange(op.hive, op.key_path, op.name, op.value, op.value_type))
+                if len(pending) >= batch_size:
+                    flush()
+            else:
+                flush()
+                try:
+                    if op.op == DELETE_KEY:
+                        delete_key(op.hive, op.key_path, recursive=True)
+                    else:
+                        delete_value(op.hive, op.key_path, op.name)
+                    counts["deleted"] += 1
+                except Exception:
+                    counts["failed"] += 1
+        flush()
+        trace.set(**counts)
+    logger.info(
+        f"Imported {path}: {counts['written']} written, {counts['unchanged']} unchanged, "
+        f"{counts['deleted']} deleted, {counts['failed']} failed"
+    )
+    return counts
+
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+
+def _hex_line(prefix: str, data: bytes) -> str:
+    # Wraps like regedit: lines of about 80 columns continued with a backslash.
+    parts = [f"{b:02x}" for b in data]
+    lines = []
+    line = prefix
+    for i, part in enumerate(parts):
+        piece = part + ("," if i < len(parts) - 1 else "")
+        if len(line) + len(piece) > _WRAP - 2 and line.strip():
+            lines.append(line + "\\")
+            line = "  "
+        line += piece
+    lines.append(line)
+    return "\r\n".join(lines)
+
+
+
+def format_value(name: str, value: Any, value_type: int) -> str:
+    lhs = "@=" if name == "" else f'"{_escape(name)}"='
+    if value_type == REG_SZ and isinstance(value, str):
+        return f'{lhs}"{_escape(value)}"'
+    if value_type == REG_DWORD and isinstance(value, int):
+        return f"{lhs}dword:{value:08x}"
+    if value_type in (REG_SZ, REG_EXPAND_SZ) and isinstance(value, str):
+        data = (value + "\0").encode("utf-16-le")
+    elif value_type == REG_MULTI_SZ and isinstance(value, (list, tuple)):
+        data = "".join(item + "\0" for item in value).encode("utf-16-le") + b"\0\0"
+    elif value_type in (REG_DWORD, REG_QWORD) and isinstance(value, int):
+        data = value.to_bytes(4 if value_type == REG_DWORD else 8, "little")
+    elif value is None:
+        data = b""
+    else:
+        data = bytes(value)
+    tag = "hex:" if value_type == REG_BINARY else f"hex({value_type:x}):"
+    return _hex_line(lhs + tag, data)
+
+
+
+def _write_key(out: TextIO, hive_const: int, key_path: str, counts: Dict[str, int]):
+    for path, values, _ in walk_tree(hive_const, key_path):
+        out.write(f"[{_LONG_HIVE_NAMES[hive_const]}\\{path}]\r\n")
+        for name, value, value_type in values:
+            out.write(format_value(name, value, value_type) + "\r\n")
+        out.write("\r\n")
+        counts["keys"] += 1
+        counts["values"] += len(values)
+
+
+
+def _collapse(keys: Iterable[Tuple[Union[str, int], str]]) -> List[Tuple[int, str]]:
+    # Drops keys that sit below another key in the list; each subtree is exported once.
+    # Sorting on path components (not the joined string, where "Foo Bar" falls between
+    # "Foo" and "Foo\\Sub") puts every key right after the root it belongs to.
+    roots = []
+    last = None
+    entries = {(resolve_hive(h), p.strip("\\")) for h, p in keys}
+    for hive_const, key_path in sorted(entries, key=lambda k: (k[0], tuple(k[1].lower().split("\\")))):
+        parts = tuple(key_path.lower().split("\\"))
+        if last is not None and last[0] == hive_const and parts[:len(last[1])] == last[1]:
+            continue
+        last = (hive_const, parts)
+        roots.append((hive_const, key_path))
+    return roots
+
+
+
+def export_reg_file(path: str, keys: Iterable[Tuple[Union[str, int], str]]) -> Dict[str, int]:
+    # Writes the current contents of each key and everything below it, in regedit's
+    # version 5 format (UTF-16 LE with a BOM). Keys that no longer exist are written as
+    # deletions, so importing the file reproduces the current state.
+    keys = list(keys)
+    counts = {"keys": 0, "values": 0, "deleted": 0}
+    backend = get_backend()
+    with span("reg export", cat="registry", file=path) as trace:
+        with open(path, "w", encoding="utf-16", newline="") as out:
+            out.write(HEADER_V5 + "\r\n\r\n")
+            existing = []
+            for hive_const, key_path in sorted({(resolve_hive(h), p.strip("\\")) for h, p in keys}):
+                try:
+                    backend.open_key(hive_const, key_path).Close()
+                    existing.append((hive_const, key_path))
+                except FileNotFoundError:
+                    out.write(f"[-{_LONG_HIVE_NAMES[hive_const]}\\{key_path}]\r\n\r\n")
+                    counts["deleted"] += 1
+            for hive_const, key_path in _collapse(existing):
+                _write_key(out, hive_const, key_path, counts)
+        trace.set(**counts)
+    logger.info(f"Exported {counts['keys']} registry keys ({counts['values']} values, {counts['deleted']} deleted) to {path}")
+    return counts
+
+
+
+def touched_keys(journal_path: Optional[str] = None) -> List[Tuple[str, str]]:
+    # Keys a run wrote to, created or deleted, from its registry undo journal.
+    seen = {}
+    for record in read_journal(journal_path):
+        seen.setdefault((record.hive.upper(), record.key_path.lower()), (record.hive, record.key_path))
+    return list(seen.values())
+
+
+
+def export_touched(path: str, journal_path: Optional[str] = None) -> Dict[str, int]:
+    return export_reg_file(path, touched_keys(journal_path))
@@ -0,0 +1,320 @@
+import threading
+from typing import Any, List, Optional, Tuple
+from utilities.util_logger import logger
+
+try:
+    import winreg
+except ImportError:
+    # Off Windows the in-memory backend stands in; the constants keep their Windows
+    # values so journals and tweak tables mean the same thing everywhere.
+    winreg = None
+
+
+
+if winreg is not None:
+    HKEY_CLASSES_ROOT = winreg.HKEY_CLASSES_ROOT
+    HKEY_CURRENT_USER = winreg.HKEY_CURRENT_USER
+    HKEY_LOCAL_MACHINE = winreg.HKEY_LOCAL_MACHINE
+    HKEY_USERS = winreg.HKEY_USERS
+    HKEY_CURRENT_CONFIG = winreg.HKEY_CURRENT_CONFIG
+    REG_NONE = winreg.REG_NONE
+    REG_SZ = winreg.REG_SZ
+    REG_EXPAND_SZ = winreg.REG_EXPAND_SZ
+    REG_BINARY = winreg.REG_BINARY
+    REG_DWORD = winreg.REG_DWORD
+    REG_MULTI_SZ = winreg.REG_MULTI_SZ
+    REG_QWORD = winreg.REG_QWORD
+else:
+    HKEY_CLASSES_ROOT = 0x80000000
+    HKEY_CURRENT_USER = 0x80000001
+    HKEY_LOCAL_MACHINE = 0x80000002
+    HKEY_USERS = 0x80000003
+    HKEY_CURRENT_CONFIG = 0x80000005
+    REG_NONE = 0
+    REG_SZ = 1
+    REG_EXPAND_SZ = 2
+    REG_BINARY = 3
+    REG_DWORD = 4
+    REG_MULTI_SZ = 7
+    REG_QWORD = 11
+
+
+
+class RegistryBackend:
+
+    # Key handles are whatever the backend returns from open_key/create_key; callers
+    # use them as context managers. Missing keys and values raise FileNotFoundError,
+    # as winreg does.
+    name = "abstract"
+
+    def open_key(self, hive: int, key_path: str, write: bool = False):
+        raise NotImplementedError
+
+    def create_key(self, hive: int, key_path: str):
+        raise NotImplementedError
+
+    def query_value(self, key, name: str) -> Tuple[Any, int]:
+        raise NotImplementedError
+
+    def set_value(self, key, name: str, value_type: int, value: Any):
+        raise NotImplementedError
+
+    def delete_value(self, key, name: str):
+        raise NotImplementedError
+
+    def enum_values(self, key) -> List[Tuple[str, Any, int]]:
+        raise NotImplementedError
+
+    def enum_keys(self, key) -> List[str]:
+        raise NotImplementedError
+
+    def delete_key(self, hive: int, key_path: str):
+        # Removes a key without subkeys.
+        raise NotImplementedError
+
+
+
+class WinregBackend(RegistryBackend):
+
+    name = "winreg"
+
+    def __init__(self):
+        if winreg is None:
+            raise RuntimeError("winreg is not available on this platform")
+        self.view_flag = getattr(winreg, "KEY_WOW64_64KEY", 0)
+
+    def open_key(self, hive, key_path, write=False):
+        access = winreg.KEY_READ | (winreg.KEY_WRITE if write else 0) | self.view_flag
+        return winreg.OpenKey(hive, key_path, 0, access)
+
+    def create_key(self, hive, key_path):
+        return winreg.CreateKeyEx(hive, key_path, 0, winreg.KEY_READ | winreg.KEY_WRITE | self.view_flag)
+
+    def query_value(self, key, name):
+        return winreg.QueryValueEx(key, name)
+
+    def set_value(self, key, name, value_type, value):
+        winreg.SetValueEx(key, name, 0, value_type, value)
+
+    def delete_value(self, key, name):
+        winreg.DeleteValue(key, name)
+
+    def enum_values(self, key):
+        # QueryInfoKey gives the counts up front, so enumeration is one call per entry
+        # without probing past the end for the terminating error.
+        return [winreg.EnumValue(key, index) for index in range(winreg.QueryInfoKey(key)[1])]
+
+    def enum_keys(self, key):
+        return [winreg.EnumKey(key, index) for index in range(winreg.QueryInfoKey(key)[0])]
+
+    def delete_key(self, hive, key_path):
+        if hasattr(winreg, 'DeleteKeyEx'):
+            winreg.DeleteKeyEx(hive, key_path, self.view_flag, 0)
+        else:
+            parent_path, _, sub_key = key_path.rpartition('\\')
+            with winreg.OpenKey(hive, parent_path, 0, winreg.KEY_WRITE | self.view_flag) as parent:
+                winreg.DeleteKey(parent, sub_key)
+
+
+
+class _Node:
+
+    __slots__ = ("name", "values", "subkeys", "deleted")
+
+    def __init__(self, name: str):
+        # Names keep the case they were created with; lookups ignore case.
+        self.name = name
+        self.values = {}
+        self.subkeys = {}
+        self.deleted = False
+
+
+
+class _MemoryKey:
+
+    __slots__ = ("node", "write")
+
+    def __init__(self, node: _Node, write: bool):
+        self.node = node
+        self.write = write
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def Close(self):
+        pass
+
+
+
+def check_value(value_type: int, value: Any):
+    # Raises for the same values winreg.SetValueEx refuses.
+    if value_type == REG_DWORD:
+        if not isinstance(value, int) or not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError(f"REG_DWORD needs an int in 0..2**32-1, got {value!r}")
+    elif value_type == REG_QWORD:
+        if not isinstance(value, int) or not 0 <= value <= 0xFFFFFFFFFFFFFFFF:
+            raise ValueError(f"REG_QWORD needs an int in 0..2**64-1, got {value!r}")
+    elif value_type in (REG_SZ, REG_EXPAND_SZ):
+        if not isinstance(value, str):
+            raise TypeError(f"REG_SZ needs a str, got {type(value).__name__}")
+    elif value_type == REG_MULTI_SZ:
+        if not isinstance(value, (list, tuple)) or not all(isinstance(item, str) for item in value):
+            raise TypeError("REG_MULTI_SZ needs a list of str")
+    elif value_type in (REG_BINARY, REG_NONE):
+        if value is not None and not isinstance(value, (bytes, bytearray)):
+            raise TypeError(f"REG_BINARY needs bytes, got {type(value).__name__}")
+
+
+
+class MemoryBackend(RegistryBackend):
+
+    # A registry tree in memory with winreg's behaviour where code relies on it:
+    # case-insensitive, case-preserving names; FileNotFoundError for missing keys
+    # and values; PermissionError for writes through a read-only handle and for
+    # deleting a key that still has subkeys; type checks on writes.
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._hives = {
+            hive: _Node(name)
+            for hive, name in (
+                (HKEY_CLASSES_ROOT, "HKEY_CLASSES_ROOT"),
+                (HKEY_CURRENT_USER, "HKEY_CURRENT_USER"),
+                (HKEY_LOCAL_MACHINE, "HKEY_LOCAL_MACHINE"),
+                (HKEY_USERS, "HKEY_USERS"),
+                (HKEY_CURRENT_CONFIG, "HKEY_CURRENT_CONFIG"),
+            )
+        }
+
+    def _root(self, hive: int) -> _Node:
+        try:
+            return self._hives[hive]
+        except KeyError:
+            raise OSError(f"Invalid registry hive handle: {hive!r}")
+
+    @staticmethod
+    def _parts(key_path: str) -> List[str]:
+        return [part for part in key_path.split("\\") if part]
+
+    def _find(self, hive: int, key_path: str) -> _Node:
+        node = self._root(hive)
+        for part in self._parts(key_path):
+            child = node.subkeys.get(part.lower())
+            if child is None:
+                raise FileNotFoundError(2, "The system cannot find the file specified", key_path)
+            node = child
+        return node
+
+    def _live(self, key: _MemoryKey) -> _Node:
+        if key.node.deleted:
+            raise OSError(1018, "Illegal operation attempted on a registry key that has been marked for deletion")
+        return key.node
+
+    def _writable(self, key: _MemoryKey) -> _Node:
+        if not key.write:
+            raise PermissionError(5, "Access is denied")
+        return self._live(key)
+
+    def open_key(self, hive, key_path, write=False):
+        with self._lock:
+            return _MemoryKey(self._find(hive, key_path), write)
+
+    def create_key(self, hive, key_path):
+        with self._lock:
+            node = self._root(hive)
+            for part in self._parts(key_path):
+                child = node.subkeys.get(part.lower())
+                if child is None:
+                    child = node.subkeys[part.lower()] = _Node(part)
+                node = child
+            return _MemoryKey(node, True)
+
+    def query_value(self, key, name):
+        with self._lock:
+            try:
+                _, value, value_type = self._live(key).values[name.lower()]
+            except KeyError:
+                raise FileNotFoundError(2, "The system cannot find the file specified", name)
+            return (list(value) if isinstance(value, list) else value), value_type
+
+    def set_value(self, key, name, value_type, value):
+        check_value(value_type, value)
+        if isinstance(value, (list, tuple)):
+            value = list(value)
+        elif isinstance(value, bytearray):
+            value = bytes(value)
+        with self._lock:
+            values = self._writable(key).values
+            # Overwriting keeps the case the value was first created with.
+            existing = values.get(name.lower())
+            values[name.lower()] = (existing[0] if existing else name, value, value_type)
+
+    def delete_value(self, key, name):
+        with self._lock:
+            try:
+                del self._writable(key).values[name.lower()]
+            except KeyError:
+                raise FileNotFoundError(2, "The system cannot find the file specified", name)
+
+    def enum_values(self, key):
+        with self._lock:
+            return [
+                (name, list(value) if isinstance(value, list) else value, value_type)
+                for name, value, value_type in self._live(key).values.values()
+            ]
+
+    def enum_keys(self, key):
+        with self._lock:
+            return [child.name for child in self._live(key).subkeys.values()]
+
+    def delete_key(self, hive, key_path):
+        with self._lock:
+            parts = self._parts(key_path)
+            if not parts:
+                raise PermissionError(5, "Access is denied")
+            parent = self._find(hive, "\\".join(parts[:-1]))
+            node = parent.subkeys.get(parts[-1].lower())
+            if node is None:
+                raise FileNotFoundError(2, "The system cannot find the file specified", key_path)
+            if node.subkeys:
+                raise PermissionError(5, "Access is denied")
+            node.deleted = True
+            del parent.subkeys[parts[-1].lower()]
+
+    def count_values(self) -> int:
+        with self._lock:
+            stack = list(self._hives.values())
+            total = 0
+            while stack:
+                node = stack.pop()
+                total += len(node.values)
+                stack.extend(node.subkeys.values())
+            return total
+
+
+
+_backend: Optional[RegistryBackend] = None
+
+
+
+def get_backend() -> RegistryBackend:
+    global _backend
+    if _backend is None:
+        if winreg is not None:
+            _backend = WinregBackend()
+        else:
+            logger.warning("winreg is not available; registry changes go to an in-memory registry")
+            _backend = MemoryBackend()
+    return _backend
+
+
+
+def set_backend(backend: Optional[RegistryBackend]) -> Optional[RegistryBackend]:
+    # Returns the previous backend so tests and benchmarks can put it back.
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
@@ -0,0 +1,153 @@
+import os
+import time
+import logging
+import argparse
+import tempfile
+from utilities.util_logger import logger
+from utilities.util_registry_backend import HKEY_CURRENT_USER, REG_DWORD, REG_SZ, MemoryBackend, set_backend
+from utilities.util_registry_journal import close_registry_journal, start_registry_journal
+from utilities.util_modify_registry import RegistryChange, apply_batch, read_batch, set_value
+
+
+
+# Measures the registry layer against the in-memory backend, so the numbers are the
+# cost of talon's own bookkeeping (grouping, read-before-write, diff, journal) rather
+# than of the Windows registry:
+#
+#   python -m utilities.util_registry_benchmark --values 5000 --per-key 50 --repeat 3
+_ROOT = r"Software\TalonBenchmark"
+
+
+
+def _changes(values: int, per_key: int, generation: int = 0):
+    changes = []
+    for i in range(values):
+        key_path = f"{_ROOT}\\Key{i // per_key:05d}"
+        if i % 2:
+            changes.append(RegistryChange(HKEY_CURRENT_USER, key_path, f"Value{i}", (i + generation) & 0xFFFFFFFF, REG_DWORD))
+        else:
+            changes.append(RegistryChange(HKEY_CURRENT_USER, key_path, f"Value{i}", f"setting {i + generation}", REG_SZ))
+    return changes
+
+
+
+def _populated(changes):
+    backend = MemoryBackend()
+    set_backend(backend)
+    apply_batch(changes, skip_unchanged=False)
+    return backend
+
+
+
+def _run_set_value(changes, journal_dir):
+    set_backend(MemoryBackend())
+    start = time.perf_counter()
+    for change in changes:
+        set_value(change.hive, change.key_path, change.name, change.value, change.value_type)
+    return time.perf_counter() - start
+
+
+
+def _run_batch(changes, journal_dir):
+    set_backend(MemoryBackend())
+    start = time.perf_counter()
+    result = apply_batch(changes)
+    elapsed = time.perf_counter() - start
+    assert result.ok
+    return elapsed
+
+
+
+def _run_batch_journal(changes, journal_dir):
+    set_backend(MemoryBackend())
+    start_registry_journal(os.path.join(journal_dir, "registry_undo.bin"))
+    try:
+        start = time.perf_counter()
+        apply_batch(changes)
+        elapsed = time.perf_counter() - start
+    finally:
+        close_registry_journal()
+    return elapsed
+
+
+
+def _run_read(changes, journal_dir):
+    _populated(changes)
+    start = time.perf_counter()
+    current = read_batch(changes)
+    elapsed = time.perf_counter() - start
+    assert all(value is not None for value in current)
+    return elapsed
+
+
+
+def _run_unchanged(changes, journal_dir):
+    # A re-run on a configured machine: every value is read and compared, none written.
+    _populated(changes)
+    start = time.perf_counter()
+    result = apply_batch(changes)
+    elapsed = time.perf_counter() - start
+    assert not result.changes("written")
+    return elapsed
+
+
+
+def _run_diff(changes, journal_dir):
+    # Every value differs from what is stored, so each one is read, written and diffed.
+    _populated(_changes(len(changes), _per_key(changes), generation=1))
+    start = time.perf_counter()
+    result = apply_batch(changes)
+    elapsed = time.perf_counter() - start
+    assert len(result.diff()) == len(changes)
+    return elapsed
+
+
+
+def _per_key(changes) -> int:
+    first = changes[0].key_path
+    return sum(1 for change in changes if change.key_path == first)
+
+
+
+MODES = {
+    "set_value": _run_set_value,
+    "batch": _run_batch,
+    "batch+journal": _run_batch_journal,
+    "read_batch": _run_read,
+    "batch unchanged": _run_unchanged,
+    "batch diff": _run_diff,
+}
+
+
+
+def run_benchmark(values: int = 5000, per_key: int = 50, repeat: int = 3):
+    changes = _changes(values, max(1, per_key))
+    # Per-value INFO lines would dominate the timings and fill talon.log.
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    previous = set_backend(None)
+    print(f"Registry benchmark: {values} values in {-(-values // max(1, per_key))} keys, in-memory backend, best of {repeat}")
+    print(f"{'mode':<16} {'wall s':>8} {'values/s':>10}")
+    try:
+        with tempfile.TemporaryDirectory() as journal_dir:
+            for name, runner in MODES.items():
+                best = min(runner(changes, journal_dir) for _ in range(repeat))
+                print(f"{name:<16} {best:>8.3f} {values / best if best else 0:>10.0f}")
+    finally:
+        set_backend(previous)
+        logger.setLevel(level)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure bulk registry set, read and diff throughput")
+    parser.add_argument("--values", type=int, default=5000, help="Number of registry values per run.")
+    parser.add_argument("--per-key", type=int, default=50, help="Values stored under each key.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the fastest is reported.")
+    args = parser.parse_args(argv)
+    run_benchmark(args.values, args.per_key, args.repeat)
+
+
+
+if __name__ == "__main__":
+    main()
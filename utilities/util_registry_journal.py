@@ -0,0 +1,274 @@
+import os
+import time
+import struct
+import tempfile
+import threading
+from typing import Any, Iterator, List, Optional, Tuple
+from utilities.util_logger import logger
+
+
+
+# Undo journal for registry changes. Every record is the state *before* a change, so
+# replaying the records newest-first puts the registry back as it was when the run
+# started. Records are length-prefixed so a torn tail after a crash is detected and
+# ignored; the file is flushed after every registry call but never fsynced per write.
+MAGIC = b"TRUJ"
+VERSION = 1
+VALUE = 1          # the value existed: restore it
+ABSENT = 2         # the value did not exist: delete it
+KEY_CREATED = 3    # the key did not exist: delete it with everything below it
+TREE = 4           # the key was deleted: recreate it with its values and subkeys
+
+_HEADER = struct.Struct("<4sBd")
+_LENGTH = struct.Struct("<I")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+# A tree is (values, subkeys): values are (name, value, type), subkeys (name, tree).
+Tree = Tuple[List[Tuple[str, Any, int]], List[Tuple[str, Any]]]
+
+
+
+def _get_journal_path(filename: str = 'registry_undo.bin') -> str:
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', filename)
+
+
+
+def _pack_str(out: List[bytes], text: str):
+    data = text.encode("utf-8", "surrogatepass")
+    out.append(_U16.pack(len(data)) if len(data) < 0xFFFF else _U16.pack(0xFFFF) + _U32.pack(len(data)))
+    out.append(data)
+
+
+def _unpack_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    (size,) = _U16.unpack_from(buf, pos)
+    pos += 2
+    if size == 0xFFFF:
+        (size,) = _U32.unpack_from(buf, pos)
+        pos += 4
+    return buf[pos:pos + size].decode("utf-8", "surrogatepass"), pos + size
+
+
+def _pack_value(out: List[bytes], value: Any, value_type: int):
+    out.append(_U32.pack(value_type))
+    if value is None:
+        out.append(b"\x00")
+    elif isinstance(value, int):
+        out.append(b"\x01" + struct.pack("<Q", value) if value >= 0 else b"\x05" + struct.pack("<q", value))
+    elif isinstance(value, str):
+        out.append(b"\x02")
+        data = value.encode("utf-8", "surrogatepass")
+        out.append(_U32.pack(len(data)))
+        out.append(data)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(b"\x03" + _U32.pack(len(value)))
+        out.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        out.append(b"\x04" + _U32.pack(len(value)))
+        for item in value:
+            _pack_str(out, item)
+    else:
+        raise ValueError(f"Cannot journal registry value of type {type(value)}")
+
+
+def _unpack_value(buf: bytes, pos: int) -> Tuple[Any, int, int]:
+    (value_type,) = _U32.unpack_from(buf, pos)
+    tag = buf[pos + 4]
+    pos += 5
+    if tag == 0:
+        return None, value_type, pos
+    if tag == 1:
+        return struct.unpack_from("<Q", buf, pos)[0], value_type, pos + 8
+    if tag == 5:
+        return struct.unpack_from("<q", buf, pos)[0], value_type, pos + 8
+    if tag in (2, 3):
+        (size,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        data = buf[pos:pos + size]
+        return (data.decode("utf-8", "surrogatepass") if tag == 2 else bytes(data)), value_type, pos + size
+    if tag == 4:
+        (count,) = _U32.unpack_from(buf, pos)
+        pos += 4
+        items = []
+        for _ in range(count):
+            item, pos = _unpack_str(buf, pos)
+            items.append(item)
+        return items, value_type, pos
+    raise ValueError(f"Unknown value tag {tag}")
+
+
+def _pack_tree(out: List[bytes], tree: Tree):
+    values, subkeys = tree
+    out.append(_U32.pack(len(values)))
+    for name, value, value_type in values:
+        _pack_str(out, name)
+        _pack_value(out, value, value_type)
+    out.append(_U32.pack(len(subkeys)))
+    for name, subtree in subkeys:
+        _pack_str(out, name)
+        _pack_tree(out, subtree)
+
+
+def _unpack_tree(buf: bytes, pos: int) -> Tuple[Tree, int]:
+    values = []
+    (count,) = _U32.unpack_from(buf, pos)
+    pos += 4
+    for _ in range(count):
+        name, pos = _unpack_str(buf, pos)
+        value, value_type, pos = _unpack_value(buf, pos)
+        values.append((name, value, value_type))
+    subkeys = []
+    (count,) = _U32.unpack_from(buf, pos)
+    pos += 4
+    for _ in range(count):
+        name, pos = _unpack_str(buf, pos)
+        subtree, pos = _unpack_tree(buf, pos)
+        subkeys.append((name, subtree))
+    return (values, subkeys), pos
+
+
+
+class JournalRecord:
+
+    __slots__ = ("kind", "hive", "key_path", "name", "value", "value_type", "tree")
+
+    def __init__(self, kind, hive, key_path, name=None, value=None, value_type=None, tree=None):
+        self.kind = kind
+        self.hive = hive
+        self.key_path = key_path
+        self.name = name
+        self.value = value
+        self.value_type = value_type
+        self.tree = tree
+
+
+
+class RegistryJournal:
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        # Only the first snapshot of a value matters for undo: replayed newest-first,
+        # it is applied last and restores the original.
+        self._seen = set()
+        self.records = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fresh = not append or not os.path.exists(path) or os.path.getsize(path) < _HEADER.size
+        self._fh = open(path, "wb" if fresh else "ab")
+        if fresh:
+            self._fh.write(_HEADER.pack(MAGIC, VERSION, time.time()))
+            self._fh.flush()
+
+    def _write(self, kind: int, parts: List[bytes]):
+        payload = bytes([kind]) + b"".join(parts)
+        with self._lock:
+            self._fh.write(_LENGTH.pack(len(payload)) + payload)
+            self.records += 1
+
+    def value(self, hive: str, key_path: str, name: str, previous: Optional[Tuple[Any, int]]):
+        seen = (hive, key_path.lower(), name.lower())
+        if seen in self._seen:
+            return
+        self._seen.add(seen)
+        parts = []
+        _pack_str(parts, hive)
+        _pack_str(parts, key_path)
+        _pack_str(parts, name)
+        if previous is None:
+            self._write(ABSENT, parts)
+        else:
+            _pack_value(parts, previous[0], previous[1])
+            self._write(VALUE, parts)
+
+    def key_created(self, hive: str, key_path: str):
+        parts = []
+        _pack_str(parts, hive)
+        _pack_str(parts, key_path)
+        self._write(KEY_CREATED, parts)
+
+    def tree(self, hive: str, key_path: str, tree: Tree):
+        parts = []
+        _pack_str(parts, hive)
+        _pack_str(parts, key_path)
+        _pack_tree(parts, tree)
+        self._write(TREE, parts)
+
+    def flush(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+                self._fh.close()
+
+
+
+def read_journal(path: Optional[str] = None) -> List[JournalRecord]:
+    path = path or _get_journal_path()
+    with open(path, "rb") as f:
+        buf = f.read()
+    if len(buf) < _HEADER.size:
+        raise ValueError(f"{path} is not a registry undo journal")
+    magic, version, _ = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a registry undo journal (version {version})")
+    records = []
+    pos = _HEADER.size
+    while pos + _LENGTH.size <= len(buf):
+        (size,) = _LENGTH.unpack_from(buf, pos)
+        start = pos + _LENGTH.size
+        end = start + size
+        if end > len(buf):
+            logger.warning(f"Ignoring a torn record at the end of {path}")
+            break
+        kind = buf[start]
+        hive, p = _unpack_str(buf, start + 1)
+        key_path, p = _unpack_str(buf, p)
+        if kind in (VALUE, ABSENT):
+            name, p = _unpack_str(buf, p)
+            if kind == VALUE:
+                value, value_type, p = _unpack_value(buf, p)
+                records.append(JournalRecord(kind, hive, key_path, name, value, value_type))
+            else:
+                records.append(JournalRecord(kind, hive, key_path, name))
+        elif kind == KEY_CREATED:
+            records.append(JournalRecord(kind, hive, key_path))
+        elif kind == TREE:
+            tree, p = _unpack_tree(buf, p)
+            records.append(JournalRecord(kind, hive, key_path, tree=tree))
+        else:
+            raise ValueError(f"Unknown record kind {kind} in {path}")
+        pos = end
+    return records
+
+
+
+_journal: Optional[RegistryJournal] = None
+
+
+
+def start_registry_journal(path: Optional[str] = None, append: bool = False) -> RegistryJournal:
+    global _journal
+    if _journal is not None:
+        _journal.close()
+    _journal = RegistryJournal(path or _get_journal_path(), append=append)
+    logger.info(f"Recording registry undo journal to {_journal.path}")
+    return _journal
+
+
+
+def get_registry_journal() -> Optional[RegistryJournal]:
+    return _journal
+
+
+
+def close_registry_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional, Tuple
+from utilities.util_logger import logger
+from utilities.util_modify_registry import RegistryChange, resolve_hive, short_hive_name
+
+
+
+# Collects the registry writes every step declares (through a registry_writes hook),
+# in step order, before anything runs. Writes a step performs itself through
+# util_modify_registry are "owned" and can be planned away; writes made inside an
+# external script are only known so owned writes can be checked against them.
+#
+# An owned write is dropped when the value it writes is already what the registry will
+# hold at that point (an earlier step wrote the same value) or when the next write to
+# the same value is another owned write, which replaces it. Writes an external script
+# makes are listed as "covered" instead: the step reads them back after the script has
+# run and writes only those the script did not leave as expected. Values written with different data by different steps are
+# reported as conflicts; the step that runs last wins.
+
+
+
+class PlannedWrite:
+
+    __slots__ = ("step", "source", "change", "owned")
+
+    def __init__(self, step: str, source: str, change: RegistryChange, owned: bool):
+        self.step = step
+        self.source = source
+        self.change = change
+        self.owned = owned
+
+    @property
+    def data(self) -> Tuple[Any, Optional[int]]:
+        return self.change.value, self.change.value_type
+
+    def describe(self) -> str:
+        return f"{self.step} ({self.source}) sets {self.change.value!r}"
+
+
+
+class RegistryPlan:
+
+    def __init__(self):
+        self._writes: List[PlannedWrite] = []
+        self._kept: List[PlannedWrite] = []
+        self._covered: List[PlannedWrite] = []
+        self.duplicates: List[List[PlannedWrite]] = []
+        self.conflicts: List[List[PlannedWrite]] = []
+
+    def add(self, step: str, source: str, change: RegistryChange, owned: bool = True):
+        self._writes.append(PlannedWrite(step, source, change, owned))
+
+    def resolve(self) -> "RegistryPlan":
+        groups: Dict[Tuple[int, str, str], List[PlannedWrite]] = {}
+        for write in self._writes:
+            change = write.change
+            groups.setdefault((resolve_hive(change.hive), change.key_path.lower(), change.name.lower()), []).append(write)
+        kept = set()
+        covered = set()
+        self.duplicates = []
+        self.conflicts = []
+        for writers in groups.values():
+            if len(writers) > 1:
+                if len({repr(write.data) for write in writers}) > 1:
+                    self.conflicts.append(writers)
+                else:
+                    self.duplicates.append(writers)
+            current = None
+            for index, write in enumerate(writers):
+                if not write.owned:
+                    current = write
+                    continue
+                following = writers[index + 1] if index + 1 < len(writers) else None
+                if following is not None and following.owned:
+                    continue
+                if current is not None and current.data == write.data:
+                    if not current.owned:
+                        covered.add(id(write))
+                    continue
+                kept.add(id(write))
+                current = write
+        self._kept = [write for write in self._writes if id(write) in kept]
+        self._covered = [write for write in self._writes if id(write) in covered]
+        return self
+
+    def writes(self, step: Optional[str] = None) -> List[RegistryChange]:
+        # The minimal write set, in declaration order.
+        return [write.change for write in self._kept if step is None or write.step == step]
+
+    def covered(self, step: Optional[str] = None) -> List[RegistryChange]:
+        # Owned writes an external script makes before the step runs; the step only
+        # verifies them.
+        return [write.change for write in self._covered if step is None or write.step == step]
+
+    def declared(self, step: Optional[str] = None) -> int:
+        return sum(1 for write in self._writes if write.owned and (step is None or write.step == step))
+
+    def conflict_lines(self) -> List[str]:
+        lines = []
+        for writers in self.conflicts:
+            change = writers[-1].change
+            path = f"{short_hive_name(resolve_hive(change.hive))}\\{change.key_path}\\{change.name}"
+            lines.append(f"{path}: " + ", ".join(write.describe() for write in writers) + f"; {writers[-1].step} wins")
+        return lines
+
+    def summary(self) -> str:
+        owned = self.declared()
+        return (
+            f"{len(self._writes)} registry writes declared ({owned} by Talon itself): "
+            f"{len(self._kept)} to write, {len(self._covered)} to verify after external scripts, "
+            f"{owned - len(self._kept) - len(self._covered)} dropped as redundant, "
+            f"{len(self.duplicates)} values written more than once, {len(self.conflicts)} conflicts"
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            'declared': len(self._writes),
+            'owned': self.declared(),
+            'writes': len(self._kept),
+            'covered': len(self._covered),
+            'duplicates': len(self.duplicates),
+            'conflicts': self.conflict_lines(),
+        }
+
+
+
+_plan: Optional[RegistryPlan] = None
+
+
+
+def set_registry_plan(plan: Optional[RegistryPlan]):
+    global _plan
+    _plan = plan
+
+
+
+def get_registry_plan() -> Optional[RegistryPlan]:
+    return _plan
+
+
+
+def log_registry_plan(plan: RegistryPlan):
+    conflicts = plan.conflict_lines()
+    logger.info(plan.summary())
+    if conflicts:
+        logger.warning("Conflicting registry writes between steps:\n" + "\n".join(conflicts))
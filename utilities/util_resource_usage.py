@@ -0,0 +1,380 @@
+import os
+import sys
+import time
+import ctypes
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+from utilities.util_logger import logger
+
+
+
+class ResourceUsage:
+
+    __slots__ = ("wall", "user_cpu", "system_cpu", "peak_memory", "read_bytes", "write_bytes")
+
+    def __init__(self, wall=0.0, user_cpu=0.0, system_cpu=0.0, peak_memory=0, read_bytes=0, write_bytes=0):
+        # Seconds for the times, bytes for the rest. peak_memory is the peak working set
+        # (maximum resident set size on POSIX).
+        self.wall = wall
+        self.user_cpu = user_cpu
+        self.system_cpu = system_cpu
+        self.peak_memory = peak_memory
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+    def add(self, other: "ResourceUsage"):
+        self.wall += other.wall
+        self.user_cpu += other.user_cpu
+        self.system_cpu += other.system_cpu
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        self.read_bytes += other.read_bytes
+        self.write_bytes += other.write_bytes
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def bound_by(self) -> str:
+        # Rough reading of where the time went: CPU time close to wall time means the
+        # child was computing; heavy I/O with little CPU means disk; neither, waiting
+        # (usually on the network or another process).
+        if self.wall <= 0:
+            return "unknown"
+        cpu = (self.user_cpu + self.system_cpu) / self.wall
+        if cpu >= 0.5:
+            return "cpu"
+        if (self.read_bytes + self.write_bytes) / self.wall >= 5 * 1024 * 1024:
+            return "disk"
+        return "waiting"
+
+
+
+class _Counters:
+
+    __slots__ = ("user_cpu", "system_cpu", "peak_memory", "read_bytes", "write_bytes")
+
+    def __init__(self, user_cpu, system_cpu, peak_memory, read_bytes, write_bytes):
+        self.user_cpu = user_cpu
+        self.system_cpu = system_cpu
+        self.peak_memory = peak_memory
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+
+
+class WindowsCollector:
+
+    # Each measured process is put in a job object, and CPU time and I/O are read from
+    # the job's basic-and-I/O accounting, so installers and other grandchildren the
+    # process starts are charged to it too. Peak memory is the process's own peak
+    # working set. Handles stay valid after the process exits as long as they are held
+    # open, so the final sample sees the whole lifetime. A process keeps one job across
+    # measurements (a pooled PowerShell host is measured once per command); the job is
+    # closed once the process has exited.
+    approximate = False
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    PROCESS_SET_QUOTA = 0x0100
+    PROCESS_TERMINATE = 0x0001
+    STILL_ACTIVE = 259
+    JobObjectBasicLimitInformation = 2
+    JobObjectBasicAndIoAccountingInformation = 8
+    # Installers that start helpers outside their job still work; those helpers are
+    # simply not counted.
+    JOB_OBJECT_LIMIT_BREAKAWAY_OK = 0x0800
+
+    def __init__(self):
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        class IO_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("ReadOperationCount", ctypes.c_ulonglong),
+                ("WriteOperationCount", ctypes.c_ulonglong),
+                ("OtherOperationCount", ctypes.c_ulonglong),
+                ("ReadTransferCount", ctypes.c_ulonglong),
+                ("WriteTransferCount", ctypes.c_ulonglong),
+                ("OtherTransferCount", ctypes.c_ulonglong),
+            ]
+
+        class JOBOBJECT_BASIC_ACCOUNTING_INFORMATION(ctypes.Structure):
+            _fields_ = [
+                ("TotalUserTime", ctypes.c_longlong),
+                ("TotalKernelTime", ctypes.c_longlong),
+                ("ThisPeriodTotalUserTime", ctypes.c_longlong),
+                ("ThisPeriodTotalKernelTime", ctypes.c_longlong),
+                ("TotalPageFaultCount", wintypes.DWORD),
+                ("TotalProcesses", wintypes.DWORD),
+                ("ActiveProcesses", wintypes.DWORD),
+                ("TotalTerminatedProcesses", wintypes.DWORD),
+            ]
+
+        class JOBOBJECT_BASIC_AND_IO_ACCOUNTING_INFORMATION(ctypes.Structure):
+            _fields_ = [
+                ("BasicInfo", JOBOBJECT_BASIC_ACCOUNTING_INFORMATION),
+                ("IoInfo", IO_COUNTERS),
+            ]
+
+        class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+            _fields_ = [
+                ("PerProcessUserTimeLimit", ctypes.c_longlong),
+                ("PerJobUserTimeLimit", ctypes.c_longlong),
+                ("LimitFlags", wintypes.DWORD),
+                ("MinimumWorkingSetSize", ctypes.c_size_t),
+                ("MaximumWorkingSetSize", ctypes.c_size_t),
+                ("ActiveProcessLimit", wintypes.DWORD),
+                ("Affinity", ctypes.c_size_t),
+                ("PriorityClass", wintypes.DWORD),
+                ("SchedulingClass", wintypes.DWORD),
+            ]
+
+        self._wintypes = wintypes
+        self._memory_counters = PROCESS_MEMORY_COUNTERS
+        self._io_counters = IO_COUNTERS
+        self._job_accounting = JOBOBJECT_BASIC_AND_IO_ACCOUNTING_INFORMATION
+        self._job_limits = JOBOBJECT_BASIC_LIMIT_INFORMATION
+        self._kernel32 = ctypes.windll.kernel32
+        self._kernel32.OpenProcess.restype = wintypes.HANDLE
+        self._kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+        self._jobs: Dict[int, int] = {}
+        self._jobs_lock = threading.Lock()
+
+    def _create_job(self, process):
+        job = self._kernel32.CreateJobObjectW(None, None)
+        if not job:
+            return None
+        limits = self._job_limits()
+        limits.LimitFlags = self.JOB_OBJECT_LIMIT_BREAKAWAY_OK
+        self._kernel32.SetInformationJobObject(
+            job, self.JobObjectBasicLimitInformation, ctypes.byref(limits), ctypes.sizeof(limits)
+        )
+        if not self._kernel32.AssignProcessToJobObject(job, process):
+            self._kernel32.CloseHandle(job)
+            return None
+        return job
+
+    def open(self, pid: int):
+        process = self._kernel32.OpenProcess(
+            self.PROCESS_QUERY_LIMITED_INFORMATION | self.PROCESS_SET_QUOTA | self.PROCESS_TERMINATE, False, pid
+        ) or self._kernel32.OpenProcess(self.PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not process:
+            return None
+        with self._jobs_lock:
+            job = self._jobs.get(pid)
+            if job is None:
+                # Without a job (no quota access, or Windows refused the assignment) the
+                # counters fall back to the process alone.
+                job = self._create_job(process)
+                if job is not None:
+                    self._jobs[pid] = job
+        return (pid, process, job)
+
+    def sample(self, handle) -> Optional[_Counters]:
+        if handle is None:
+            return None
+        _, process, job = handle
+        memory = self._memory_counters()
+        memory.cb = ctypes.sizeof(memory)
+        peak = memory.PeakWorkingSetSize if self._kernel32.K32GetProcessMemoryInfo(
+            process, ctypes.byref(memory), memory.cb
+        ) else 0
+        if job is not None:
+            info = self._job_accounting()
+            if self._kernel32.QueryInformationJobObject(
+                job, self.JobObjectBasicAndIoAccountingInformation, ctypes.byref(info), ctypes.sizeof(info), None
+            ):
+                return _Counters(
+                    info.BasicInfo.TotalUserTime / 10_000_000,
+                    info.BasicInfo.TotalKernelTime / 10_000_000,
+                    peak,
+                    info.IoInfo.ReadTransferCount,
+                    info.IoInfo.WriteTransferCount,
+                )
+        created, exited, kernel, user = (self._wintypes.FILETIME() for _ in range(4))
+        if not self._kernel32.GetProcessTimes(
+            process, ctypes.byref(created), ctypes.byref(exited), ctypes.byref(kernel), ctypes.byref(user)
+        ):
+            return None
+
+        def seconds(ft):
+            return ((ft.dwHighDateTime << 32) | ft.dwLowDateTime) / 10_000_000
+        io = self._io_counters()
+        read_bytes = write_bytes = 0
+        if self._kernel32.GetProcessIoCounters(process, ctypes.byref(io)):
+            read_bytes, write_bytes = io.ReadTransferCount, io.WriteTransferCount
+        return _Counters(seconds(user), seconds(kernel), peak, read_bytes, write_bytes)
+
+    def close(self, handle):
+        if handle is None:
+            return
+        pid, process, job = handle
+        code = self._wintypes.DWORD()
+        if job is not None and self._kernel32.GetExitCodeProcess(process, ctypes.byref(code)) \
+                and code.value != self.STILL_ACTIVE:
+            with self._jobs_lock:
+                if self._jobs.get(pid) == job:
+                    del self._jobs[pid]
+                    self._kernel32.CloseHandle(job)
+        self._kernel32.CloseHandle(process)
+
+
+
+class RusageCollector:
+
+    # POSIX has no per-pid counters for an exited child, so this measures the change in
+    # RUSAGE_CHILDREN (or RUSAGE_SELF for the calling process) across the child's life.
+    # The numbers are approximate: children that overlap are charged for each other's
+    # time, a grandchild only counts once its parent has waited for it, and ru_maxrss
+    # is the largest of them. Use them to compare runs, not to attribute exact costs.
+    approximate = True
+
+    def __init__(self):
+        import resource
+        self._resource = resource
+
+    def open(self, pid: int):
+        return self._resource.RUSAGE_SELF if pid == os.getpid() else self._resource.RUSAGE_CHILDREN
+
+    def sample(self, handle) -> Optional[_Counters]:
+        usage = self._resource.getrusage(handle)
+        # ru_maxrss is KiB on Linux and bytes on macOS; blocks are 512 bytes.
+        peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        return _Counters(usage.ru_utime, usage.ru_stime, peak, usage.ru_inblock * 512, usage.ru_oublock * 512)
+
+    def close(self, handle):
+        pass
+
+
+
+class Measurement:
+
+    def __init__(self, collector, pid: int):
+        self._collector = collector
+        self._start = time.monotonic()
+        self._handle = None
+        self._initial = None
+        try:
+            self._handle = collector.open(pid)
+            self._initial = collector.sample(self._handle)
+        except Exception as e:
+            logger.debug(f"Resource accounting unavailable for pid={pid}: {e}")
+
+    def finish(self) -> ResourceUsage:
+        # CPU and I/O are the change since start, so a long-lived process (a pooled
+        # PowerShell host) is charged only for this command. Peak memory is the
+        # process's peak so far.
+        usage = ResourceUsage(time.monotonic() - self._start)
+        try:
+            final = self._collector.sample(self._handle) if self._initial is not None else None
+            if final is not None:
+                usage.user_cpu = max(0.0, final.user_cpu - self._initial.user_cpu)
+                usage.system_cpu = max(0.0, final.system_cpu - self._initial.system_cpu)
+                usage.peak_memory = final.peak_memory
+                usage.read_bytes = max(0, final.read_bytes - self._initial.read_bytes)
+                usage.write_bytes = max(0, final.write_bytes - self._initial.write_bytes)
+        except Exception as e:
+            logger.debug(f"Failed to read resource usage: {e}")
+        finally:
+            try:
+                self._collector.close(self._handle)
+            except Exception:
+                pass
+            self._handle = None
+        return usage
+
+
+
+_collector = None
+_lock = threading.Lock()
+_step_totals: Dict[str, ResourceUsage] = {}
+_step_children: Dict[str, int] = {}
+_current_step = contextvars.ContextVar("talon_resource_step", default=None)
+
+
+
+def get_collector():
+    global _collector
+    if _collector is None:
+        try:
+            _collector = WindowsCollector() if sys.platform == "win32" else RusageCollector()
+        except Exception as e:
+            logger.warning(f"Resource accounting disabled: {e}")
+            _collector = False
+    return _collector or None
+
+
+
+def set_collector(collector):
+    global _collector
+    _collector = collector
+
+
+
+def start_measurement(pid: int) -> Optional[Measurement]:
+    collector = get_collector()
+    if collector is None:
+        return None
+    return Measurement(collector, pid)
+
+
+
+@contextmanager
+def charge_to(step: str):
+    # Children started in this context (threads started through copy_context included)
+    # are added to the step's totals.
+    token = _current_step.set(step)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+
+def record_usage(name: str, usage: ResourceUsage):
+    step = _current_step.get() or "other"
+    with _lock:
+        _step_totals.setdefault(step, ResourceUsage()).add(usage)
+        _step_children[step] = _step_children.get(step, 0) + 1
+    logger.debug(
+        f"{name}: wall {usage.wall:.1f}s, cpu {usage.user_cpu:.1f}s user + {usage.system_cpu:.1f}s system, "
+        f"peak {usage.peak_memory // (1024 * 1024)} MB, read {usage.read_bytes // 1024} KB, "
+        f"written {usage.write_bytes // 1024} KB"
+    )
+
+
+
+def usage_summary() -> dict:
+    with _lock:
+        return {
+            step: dict(total.as_dict(), children=_step_children[step], bound_by=total.bound_by())
+            for step, total in _step_totals.items()
+        }
+
+
+
+def log_usage_summary():
+    summary = usage_summary()
+    if not summary:
+        return
+    lines = [f"{'step':<28} {'children':>8} {'wall s':>8} {'user s':>8} {'sys s':>8} {'peak MB':>8} {'read MB':>8} {'write MB':>8}  bound by"]
+    for step, row in sorted(summary.items()):
+        lines.append(
+            f"{step:<28} {row['children']:>8} {row['wall']:>8.1f} {row['user_cpu']:>8.1f} {row['system_cpu']:>8.1f} "
+            f"{row['peak_memory'] / 1048576:>8.0f} {row['read_bytes'] / 1048576:>8.1f} {row['write_bytes'] / 1048576:>8.1f}  {row['bound_by']}"
+        )
+    collector = get_collector()
+    note = " (approximate: concurrent children overlap)" if collector is not None and collector.approximate else ""
+    logger.info(f"Child process resource usage by step{note}:\n" + "\n".join(lines))
@@ -0,0 +1,134 @@
+import re
+import random
+import threading
+from typing import Callable, Iterable, Optional, Sequence, TypeVar
+from utilities.util_logger import logger
+from utilities.util_run_report import record_attempt
+from utilities.util_watchdog import cancellation_requested
+
+
+
+T = TypeVar("T")
+# Waits between attempts are sliced so a cancelled run or an expired deadline stops
+# the backoff instead of sleeping it out.
+_WAIT_SLICE = 0.5
+
+
+
+class TransientFailure(Exception):
+
+    # Raised by an attempt whose failure the policy classified as worth another try.
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+
+class RetryPolicy:
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        *,
+        base_delay: float = 5.0,
+        max_delay: float = 60.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.5,
+        exit_codes: Iterable[int] = (),
+        patterns: Sequence[str] = (),
+    ):
+        # A failure is retryable when its exit code is listed or its output matches one
+        # of the patterns. Jitter takes up to that share off each delay, so parallel
+        # steps that hit the same lock do not all come back at the same moment.
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = max(0.0, min(1.0, jitter))
+        self.exit_codes = frozenset(exit_codes)
+        self.patterns = list(patterns)
+        self._regex = re.compile("|".join(f"(?:{p})" for p in self.patterns), re.MULTILINE | re.IGNORECASE) if self.patterns else None
+
+    def classify(self, returncode: Optional[int], output: Sequence[str] = ()) -> Optional[str]:
+        # Returns why the failure looks transient, or None when it does not.
+        if returncode in self.exit_codes:
+            return f"exit code {returncode}"
+        if self._regex is not None and output:
+            m = self._regex.search("\n".join(output))
+            if m is not None:
+                return m.group(0).strip()
+        return None
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+
+
+def _wait(seconds: float, cancelled: Optional[Callable[[], bool]]) -> bool:
+    event = threading.Event()
+    remaining = seconds
+    while remaining > 0:
+        if cancellation_requested() or (cancelled is not None and cancelled()):
+            return False
+        event.wait(min(_WAIT_SLICE, remaining))
+        remaining -= _WAIT_SLICE
+    return True
+
+
+
+def run_with_retry(
+    name: str,
+    policy: Optional[RetryPolicy],
+    attempt: Callable[[int, bool], T],
+    *,
+    cancelled: Optional[Callable[[], bool]] = None,
+) -> T:
+    # attempt(number, last) runs one try. On the last one it reports failure the
+    # usual way (popup, exception); before that it raises TransientFailure for a
+    # failure the policy classifies as transient, and the call is repeated.
+    if policy is None:
+        return attempt(1, True)
+    number = 1
+    while True:
+        last = number >= policy.max_attempts
+        try:
+            result = attempt(number, last)
+        except TransientFailure as e:
+            if last:
+                record_attempt(name, number, "failed", e.reason)
+                raise
+            delay = policy.delay(number)
+            record_attempt(name, number, "retry", e.reason, round(delay, 2))
+            logger.warning(f"{name} failed ({e.reason}); retrying in {delay:.1f}s (attempt {number + 1} of {policy.max_attempts})")
+            if not _wait(delay, cancelled):
+                record_attempt(name, number, "cancelled", e.reason)
+                raise
+            number += 1
+            continue
+        except BaseException as e:
+            record_attempt(name, number, "failed", repr(e))
+            raise
+        record_attempt(name, number, "succeeded")
+        return result
+
+
+
+# Service control that lands while the service is mid-transition ("cannot accept
+# control messages at this time") clears up once it settles; wuauserv is the usual one.
+SERVICE_BUSY_PATTERNS = (
+    r"cannot accept control messages at this time",
+    r"Cannot (?:stop|start) service",
+    r"Failed to (?:stop|start) service",
+)
+# AppX removal fails while a package's files are in use or another deployment holds
+# them; the same removal succeeds a little later.
+APPX_CONFLICT_PATTERNS = (
+    r"0x80073D02",
+    r"0x80073D05",
+    r"0x80070020",
+    r"being used by another process",
+)
+
+SERVICE_BUSY_RETRY = RetryPolicy(3, base_delay=10.0, exit_codes=(1061,), patterns=SERVICE_BUSY_PATTERNS)
+APPX_DEPLOYMENT_RETRY = RetryPolicy(3, base_delay=10.0, patterns=APPX_CONFLICT_PATTERNS + SERVICE_BUSY_PATTERNS)
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Optional, Union
+from utilities.util_logger import logger
+
+
+
+def _get_journal_path(filename: str = 'run_journal.jsonl') -> str:
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', filename)
+
+
+
+def compute_config_hash(*parts: Union[str, bytes, None]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b''
+        elif isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()[:16]
+
+
+
+class RunJournal:
+
+    def __init__(self, path: str, config_hash: str, resume: bool = False):
+        self.path = path
+        self.config_hash = config_hash
+        self._committed = set()
+        # Steps with an action that failed in this run (the user chose to continue);
+        # the step itself is not committed so --resume goes back to that action.
+        self._incomplete = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if resume:
+            self._load()
+            mode = 'a'
+        else:
+            mode = 'w'
+        self._fh = open(path, mode, encoding='utf-8')
+        if resume and self._fh.tell() and not self._ends_with_newline():
+            self._fh.write('\n')
+        self._append({'event': 'run-start', 'resume': resume})
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.info(f"No run journal found at {self.path}; starting from the beginning")
+            return
+        ignored = 0
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write is expected; skip it.
+                    continue
+                if record.get('event') != 'commit':
+                    continue
+                if record.get('config') != self.config_hash:
+                    ignored += 1
+                    continue
+                self._committed.add((record.get('step'), record.get('action')))
+        if ignored:
+            logger.warning(f"Ignoring {ignored} journal entries recorded with a different configuration")
+        logger.info(f"Loaded {len(self._committed)} committed entries from run journal {self.path}")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _append(self, record: dict):
+        record['config'] = self.config_hash
+        record['ts'] = time.time()
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._fh.write(line + '\n')
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def is_committed(self, step: str, action: Optional[str] = None) -> bool:
+        return (step, action) in self._committed
+
+    def commit(self, step: str, action: Optional[str] = None):
+        if action is None and step in self._incomplete:
+            logger.info(f"Not committing {step}: some of its actions failed and will run again on --resume")
+            return
+        self._append({'event': 'commit', 'step': step, 'action': action})
+        self._committed.add((step, action))
+        logger.debug(f"Journal commit: {step}{'/' + action if action else ''}")
+
+    def record_outcome(self, step: str, outcome: str, action: Optional[str] = None):
+        if outcome == 'failed' and action is not None:
+            self._incomplete.add(step)
+        self._append({'event': outcome, 'step': step, 'action': action})
+
+    def close(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+
+
+_journal = None
+
+
+
+def start_journal(config_hash: str, resume: bool = False, path: Optional[str] = None) -> RunJournal:
+    global _journal
+    if _journal is not None:
+        _journal.close()
+    _journal = RunJournal(path or _get_journal_path(), config_hash, resume=resume)
+    return _journal
+
+
+
+def is_committed(step: str, action: Optional[str] = None) -> bool:
+    return _journal is not None and _journal.is_committed(step, action)
+
+
+
+def commit(step: str, action: Optional[str] = None):
+    if _journal is None:
+        return
+    try:
+        _journal.commit(step, action)
+    except Exception as e:
+        logger.error(f"Failed to write run journal entry for {step}: {e}")
+
+
+
+def record_outcome(step: str, outcome: str, action: Optional[str] = None):
+    if _journal is None:
+        return
+    try:
+        _journal.record_outcome(step, outcome, action)
+    except Exception as e:
+        logger.error(f"Failed to write run journal outcome for {step}: {e}")
@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from typing import Optional
+from utilities.util_logger import logger
+from utilities.util_resource_usage import log_usage_summary, usage_summary
+
+
+
+# One entry per retried or retry-enabled action: how many attempts it took, why the
+# earlier ones failed and how it ended. Written next to the journal when the run ends,
+# together with the per-step resource usage of child processes, the old -> new diff
+# of every registry value written and what the registry write planner made of the
+# writes the steps declared.
+_lock = threading.Lock()
+_entries = {}
+_registry_diff = []
+_registry_plan = {}
+
+
+
+def _get_report_path(filename: str = 'run_report.json') -> str:
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', filename)
+
+
+
+def record_attempt(name: str, attempt: int, outcome: str, reason: Optional[str] = None, delay: Optional[float] = None):
+    with _lock:
+        entry = _entries.setdefault(name, {'attempts': 0, 'retries': 0, 'failures': [], 'outcome': None})
+        entry['attempts'] = max(entry['attempts'], attempt)
+        entry['outcome'] = outcome
+        entry['last'] = time.time()
+        if outcome == 'retry':
+            entry['retries'] += 1
+            entry['failures'].append({'attempt': attempt, 'reason': reason, 'delay': delay})
+        elif reason is not None:
+            entry['reason'] = reason
+
+
+
+def record_registry_diff(lines):
+    with _lock:
+        _registry_diff.extend(lines)
+
+
+
+def record_registry_plan(summary: dict):
+    with _lock:
+        _registry_plan.clear()
+        _registry_plan.update(summary)
+
+
+
+def retry_counts() -> dict:
+    with _lock:
+        return {name: entry['retries'] for name, entry in _entries.items() if entry['retries']}
+
+
+
+def write_report(path: Optional[str] = None) -> Optional[str]:
+    path = path or _get_report_path()
+    with _lock:
+        entries = {name: dict(entry) for name, entry in _entries.items()}
+        registry_diff = list(_registry_diff)
+        registry_plan = dict(_registry_plan)
+    retried = {name: entry for name, entry in entries.items() if entry['retries']}
+    for name, entry in retried.items():
+        logger.info(f"{name}: {entry['outcome']} after {entry['attempts']} attempts ({entry['retries']} retries)")
+    log_usage_summary()
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                'actions': entries,
+                'retried_actions': len(retried),
+                'total_retries': sum(entry['retries'] for entry in entries.values()),
+                'resources': usage_summary(),
+                'registry_changes': registry_diff,
+                'registry_plan': registry_plan,
+            }, f, indent=1, sort_keys=True, default=str)
+        logger.info(f"Wrote run report to {path}")
+    except Exception as e:
+        logger.error(f"Failed to write run report {path}: {e}")
+        return None
+    return path
@@ -0,0 +1,274 @@
+import io
+import os
+import sys
+import time
+import queue
+import runpy
+import atexit
+import threading
+import traceback
+import multiprocessing
+from contextlib import redirect_stderr, redirect_stdout
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional
+from utilities.util_logger import logger
+from utilities.util_output_capture import OutputCapture
+from utilities.util_resource_usage import ResourceUsage, start_measurement
+from utilities.util_watchdog import kill_process_tree
+
+
+
+class ScriptResult:
+
+    __slots__ = ("script", "exit_code", "duration", "pid", "error_type", "error_message", "traceback", "output", "spill_path", "usage")
+
+    def __init__(self, script, exit_code, duration, pid, error_type=None, error_message=None,
+                 traceback=None, output=(), spill_path=None, usage=None):
+        self.script = script
+        self.exit_code = exit_code
+        self.duration = duration
+        self.pid = pid
+        self.error_type = error_type
+        self.error_message = error_message
+        self.traceback = traceback
+        self.output: List[str] = list(output)
+        self.spill_path = spill_path
+        self.usage: Optional[ResourceUsage] = usage
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0 and self.error_type is None
+
+    def summary(self, max_lines: int = 12) -> str:
+        parts = []
+        if self.error_type:
+            parts.append(f"{self.error_type}: {self.error_message}")
+        if self.output:
+            parts.append("Last output:\n" + "\n".join(self.output[-max_lines:]))
+        if self.spill_path:
+            parts.append(f"Full output: {self.spill_path}")
+        return "\n\n".join(parts)
+
+
+
+class _CaptureWriter(io.TextIOBase):
+
+    def __init__(self, capture: OutputCapture, label: str):
+        self._capture = capture
+        self._label = label
+        self._pending = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        if lines:
+            self._capture.write_many(self._label, lines)
+        return len(text)
+
+    def flush(self):
+        if self._pending:
+            self._capture.write(self._label, self._pending)
+            self._pending = ""
+
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+
+def run_script_in_worker(script_path: str) -> ScriptResult:
+    # Runs inside a pool worker: the script executes as __main__ in the worker's
+    # interpreter, so a crash or leaked state stays out of the orchestrator, and its
+    # output and any exception travel back as a ScriptResult.
+    capture = OutputCapture(os.path.basename(script_path))
+    stdout = _CaptureWriter(capture, "STDOUT")
+    stderr = _CaptureWriter(capture, "STDERR")
+    start = time.monotonic()
+    # Measured from inside the worker, so only this script's share of its life counts.
+    measurement = start_measurement(os.getpid())
+    exit_code = 0
+    error = (None, None, None)
+    saved_argv = sys.argv
+    sys.argv = [script_path]
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            stderr.write(f"{e.code}\n")
+            exit_code = 1
+    except BaseException as e:
+        exit_code = 1
+        error = (type(e).__name__, str(e), traceback.format_exc())
+    finally:
+        sys.argv = saved_argv
+        stdout.flush()
+        stderr.flush()
+        capture.close()
+    return ScriptResult(
+        script_path,
+        exit_code,
+        time.monotonic() - start,
+        os.getpid(),
+        *error,
+        output=capture.tail(),
+        spill_path=capture.spill_path,
+        usage=measurement.finish() if measurement is not None else None,
+    )
+
+
+
+class _WorkerHandle:
+
+    # Popen-like view of the worker running one script, so deadline scopes can kill
+    # it. The worker counts as running until the script's future is done.
+    def __init__(self, pid: int, future: Future):
+        self.pid = pid
+        self._future = future
+
+    def poll(self) -> Optional[int]:
+        return 0 if self._future.done() else None
+
+    def kill(self):
+        kill_process_tree(self.pid)
+
+
+
+class _Lane:
+
+    # One pre-started worker with an executor of its own. A script runs on exactly one
+    # lane, so a deadline or cancellation kills that worker and nothing else. The
+    # worker's pid comes from the warm-up call it answers before taking scripts.
+    def __init__(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._warm_up: Optional[Future] = None
+        self.pid: Optional[int] = None
+
+    def warm_up(self) -> "Future[int]":
+        if self._warm_up is None:
+            self._warm_up = self._executor.submit(_warm_up)
+        return self._warm_up
+
+    def start(self):
+        if self.pid is None:
+            self.pid = self.warm_up().result()
+
+    def submit(self, script_path: str) -> "Future[ScriptResult]":
+        return self._executor.submit(run_script_in_worker, script_path)
+
+    def worker_handle(self, future: Future) -> _WorkerHandle:
+        return _WorkerHandle(self.pid, future)
+
+    def kill(self):
+        if self.pid is None:
+            return
+        logger.warning(f"Killing script worker pid={self.pid}")
+        try:
+            kill_process_tree(self.pid)
+        except Exception as e:
+            logger.error(f"Failed to kill script worker pid={self.pid}: {e}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+
+class ScriptWorkerPool:
+
+    def __init__(self, max_workers: int):
+        # Spawned workers start the interpreter (or the frozen Talon.exe) once each and
+        # then take script after script, instead of paying start-up for every script.
+        self.max_workers = 0
+        self._lanes: List[_Lane] = []
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self.grow(max_workers)
+        logger.info(f"Started script worker pool with {max_workers} workers")
+
+    def grow(self, max_workers: int):
+        # Adds lanes up to max_workers; scripts already running keep theirs.
+        with self._lock:
+            lanes = [_Lane() for _ in range(max_workers - self.max_workers)]
+            self._lanes.extend(lanes)
+            self.max_workers = max(self.max_workers, max_workers)
+        for lane in lanes:
+            lane.warm_up()
+        for lane in lanes:
+            lane.start()
+            self._idle.put(lane)
+
+    def acquire(self) -> _Lane:
+        # Blocks until a worker is free. A replacement lane starts its worker here.
+        lane = self._idle.get()
+        try:
+            lane.start()
+        except BaseException:
+            self.release(lane, broken=True)
+            raise
+        return lane
+
+    def release(self, lane: _Lane, broken: bool = False):
+        # The caller reports a worker that was killed or died (its future raised
+        # BrokenProcessPool); that lane is replaced by a fresh one.
+        if broken:
+            lane.shutdown()
+            replacement = _Lane()
+            with self._lock:
+                self._lanes[self._lanes.index(lane)] = replacement
+            lane = replacement
+        self._idle.put(lane)
+
+    def kill_workers(self):
+        with self._lock:
+            lanes = list(self._lanes)
+        for lane in lanes:
+            lane.kill()
+
+    def shutdown(self):
+        with self._lock:
+            lanes = list(self._lanes)
+        for lane in lanes:
+            lane.shutdown()
+
+
+
+_pool: Optional[ScriptWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+
+def get_script_pool(max_workers: Optional[int] = None) -> ScriptWorkerPool:
+    global _pool
+    size = max_workers or min(4, os.cpu_count() or 1)
+    with _pool_lock:
+        # A caller asking for more workers grows the shared pool; scripts other
+        # callers are running on it carry on undisturbed.
+        if _pool is None:
+            _pool = ScriptWorkerPool(size)
+        elif _pool.max_workers < size:
+            _pool.grow(size)
+        return _pool
+
+
+
+def shutdown_script_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+
+atexit.register(shutdown_script_pool)
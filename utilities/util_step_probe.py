@@ -0,0 +1,45 @@
+from typing import Callable, Iterable
+from utilities.util_logger import logger
+
+
+
+SATISFIED = "satisfied"
+PARTIAL = "partial"
+NOT_APPLIED = "not-applied"
+
+
+
+_enabled = True
+
+
+
+def set_probes_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+
+def probes_enabled() -> bool:
+    return _enabled
+
+
+
+def summarize(checks: Iterable[bool]) -> str:
+    results = list(checks)
+    if results and all(results):
+        return SATISFIED
+    if any(results):
+        return PARTIAL
+    return NOT_APPLIED
+
+
+
+def run_probe(slug: str, probe: Callable[[], str]) -> str:
+    try:
+        state = probe()
+    except Exception as e:
+        # A probe is only an optimisation; if it cannot decide, the step runs as usual.
+        logger.warning(f"Probe for {slug} failed, assuming not applied: {e}")
+        return NOT_APPLIED
+    logger.info(f"Probe for {slug}: {state}")
+    return state
@@ -0,0 +1,99 @@
+from importlib import import_module
+from typing import Callable, List, Optional, Sequence
+from utilities.util_logger import logger
+
+
+
+ENTRY_POINT_GROUP = "talon.steps"
+
+
+
+class StepSpec:
+
+    __slots__ = ("slug", "message", "target", "depends_on", "resources", "timeout", "takes_config", "_module")
+
+    def __init__(
+        self,
+        slug: str,
+        message: str,
+        target: str,
+        depends_on: Sequence[str] = (),
+        resources: Sequence[str] = (),
+        timeout: Optional[float] = None,
+        takes_config: bool = False,
+    ):
+        # The target is "package.module:function"; nothing is imported until the step
+        # is scheduled, so skipped steps never pull in winreg, urllib, ctypes and friends.
+        module_name, sep, attr = target.partition(":")
+        if not sep or not module_name or not attr:
+            raise ValueError(f"Step target must look like 'module:function', got {target!r}")
+        self.slug = slug
+        self.message = message
+        self.target = target
+        self.depends_on = tuple(depends_on)
+        self.resources = tuple(resources)
+        self.timeout = timeout
+        self.takes_config = takes_config
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            module_name = self.target.partition(":")[0]
+            logger.debug(f"Loading step {self.slug} from {module_name}")
+            self._module = import_module(module_name)
+        return self._module
+
+    def load(self) -> Callable:
+        return getattr(self.module, self.target.partition(":")[2])
+
+    def hook(self, name: str) -> Optional[Callable]:
+        return getattr(self.module, name, None)
+
+    def run(self, config: Optional[str] = None):
+        func = self.load()
+        if self.takes_config:
+            return func(config)
+        return func()
+
+
+
+def _iter_entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    try:
+        eps = entry_points()
+    except Exception as e:
+        logger.warning(f"Failed to read installed step entry points: {e}")
+        return []
+    if hasattr(eps, "select"):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
+
+
+
+def discover_steps(builtin: Sequence[StepSpec]) -> List[StepSpec]:
+    # Third-party packages add steps by exposing a StepSpec (or a callable returning
+    # one) under the "talon.steps" entry point group. Built-in slugs cannot be replaced.
+    steps = list(builtin)
+    known = {spec.slug for spec in steps}
+    for ep in _iter_entry_points():
+        try:
+            spec = ep.load()
+            if callable(spec) and not isinstance(spec, StepSpec):
+                spec = spec()
+        except Exception as e:
+            logger.error(f"Failed to load step entry point {ep.name}: {e}")
+            continue
+        if not isinstance(spec, StepSpec):
+            logger.error(f"Step entry point {ep.name} did not provide a StepSpec; ignoring it")
+            continue
+        if spec.slug in known:
+            logger.warning(f"Step entry point {ep.name} reuses the slug {spec.slug}; ignoring it")
+            continue
+        logger.info(f"Registered third-party step {spec.slug} from {spec.target}")
+        steps.append(spec)
+        known.add(spec.slug)
+    return steps
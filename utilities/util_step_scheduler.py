@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+from utilities.util_logger import logger
+
+
+
+StepDeclaration = Tuple[str, Sequence[str], Sequence[str]]
+
+
+
+def _check_declarations(steps: List[StepDeclaration]) -> None:
+    slugs = [slug for slug, _, _ in steps]
+    if len(set(slugs)) != len(slugs):
+        raise ValueError(f"Duplicate step slugs in schedule: {slugs}")
+    position = {slug: index for index, slug in enumerate(slugs)}
+    for slug, depends_on, _ in steps:
+        for dep in depends_on:
+            # Dependencies on steps that are not scheduled (skipped) are already satisfied,
+            # but a dependency on a later step would deadlock the schedule.
+            if dep in position and position[dep] >= position[slug]:
+                raise ValueError(f"Step '{slug}' depends on '{dep}', which is declared after it")
+
+
+
+def run_steps(
+    steps: Iterable[StepDeclaration],
+    run_step: Callable[[str], None],
+    max_workers: Optional[int] = None,
+    idle: Optional[Callable[[], None]] = None,
+) -> None:
+    pending = list(steps)
+    _check_declarations(pending)
+    scheduled = {slug for slug, _, _ in pending}
+    workers = max_workers or len(pending) or 1
+    logger.info(f"Scheduling {len(pending)} steps with up to {workers} running concurrently")
+    done = set()
+    held = set()
+    running = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="debloat-step") as executor:
+        while pending or running:
+            if failure is None:
+                # Conflicting steps are serialised in declaration order: a step may not start
+                # while an earlier step that needs one of its resources is still waiting.
+                reserved = set()
+                for declaration in list(pending):
+                    slug, depends_on, resources = declaration
+                    if len(running) >= workers:
+                        break
+                    ready = all(dep in done or dep not in scheduled for dep in depends_on)
+                    free = not (set(resources) & (held | reserved))
+                    if ready and free:
+                        pending.remove(declaration)
+                        held.update(resources)
+                        logger.debug(f"Starting step {slug} (resources: {', '.join(resources) or 'none'})")
+                        running[executor.submit(run_step, slug)] = declaration
+                    else:
+                        reserved.update(resources)
+            elif pending:
+                logger.info(f"Not starting {len(pending)} remaining steps due to an earlier failure")
+                pending.clear()
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Unable to schedule steps: {[slug for slug, _, _ in pending]}")
+                break
+            finished, _ = wait(
+                running,
+                timeout=0.05 if idle is not None else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if idle is not None:
+                idle()
+            for future in finished:
+                slug, _, resources = running.pop(future)
+                held.difference_update(resources)
+                try:
+                    future.result()
+                except BaseException as e:
+                    logger.error(f"Step {slug} failed: {e!r}")
+                    if failure is None:
+                        failure = e
+                    continue
+                done.add(slug)
+                logger.debug(f"Step {slug} finished")
+    if failure is not None:
+        raise failure
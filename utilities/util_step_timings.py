@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from utilities.util_logger import logger
+
+
+
+# Weight of the newest sample in the moving average, so estimates follow
+# hardware or config changes without being thrown off by one slow run.
+SMOOTHING = 0.3
+
+
+
+def _get_timings_path(filename: str = 'step_timings.json') -> str:
+    temp_dir = os.environ.get('TEMP', tempfile.gettempdir())
+    return os.path.join(temp_dir, 'talon', filename)
+
+
+
+def _timing_key(step: str, action: Optional[str] = None) -> str:
+    return f"{step}/{action}" if action else step
+
+
+
+class StepTimings:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._entries = data
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable step timings file {self.path}: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def record(self, step: str, action: Optional[str], seconds: float):
+        key = _timing_key(step, action)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'mean': seconds, 'count': 0}
+            else:
+                entry['mean'] = entry['mean'] + SMOOTHING * (seconds - entry['mean'])
+            entry['count'] += 1
+            entry['last'] = seconds
+            self._entries[key] = entry
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning(f"Failed to save step timings to {self.path}: {e}")
+        logger.debug(f"Recorded timing for {key}: {seconds:.1f}s")
+
+    def estimate(self, step: str, action: Optional[str] = None) -> Optional[float]:
+        entry = self._entries.get(_timing_key(step, action))
+        return entry['mean'] if entry else None
+
+
+
+_timings = None
+
+
+
+def get_timings(path: Optional[str] = None) -> StepTimings:
+    global _timings
+    if _timings is None or (path and _timings.path != path):
+        _timings = StepTimings(path or _get_timings_path())
+    return _timings
+
+
+
+def estimate(step: str, action: Optional[str] = None) -> Optional[float]:
+    return get_timings().estimate(step, action)
+
+
+
+@contextmanager
+def timed(step: str, action: Optional[str] = None):
+    start = time.monotonic()
+    yield
+    # Only successful runs are recorded; a failure part way through says little about cost.
+    get_timings().record(step, action, time.monotonic() - start)
+
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "unknown"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes}m {seconds:02d}s"
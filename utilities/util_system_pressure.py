@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import ctypes
+import threading
+from typing import Optional
+from utilities.util_logger import logger
+
+
+
+# Rough resident cost of one child (powershell.exe with modules, or a Python step),
+# used to decide how many can run side by side without pushing the machine into paging.
+CHILD_MEMORY_MB = 300
+# Memory kept free for Windows, Explorer and Talon's own UI.
+RESERVED_MEMORY_MB = 1024
+SAMPLE_INTERVAL = 1.0
+
+
+
+class Pressure:
+
+    __slots__ = ("cpu_busy", "memory_available_mb", "io_busy")
+
+    def __init__(self, cpu_busy: Optional[float], memory_available_mb: Optional[float], io_busy: Optional[float]):
+        # Each figure is None when the platform cannot report it; busy values are 0..1.
+        self.cpu_busy = cpu_busy
+        self.memory_available_mb = memory_available_mb
+        self.io_busy = io_busy
+
+    def __repr__(self):
+        return (
+            f"Pressure(cpu_busy={self.cpu_busy}, memory_available_mb={self.memory_available_mb}, "
+            f"io_busy={self.io_busy})"
+        )
+
+
+
+class _WindowsSampler:
+
+    def __init__(self):
+        from ctypes import wintypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", wintypes.DWORD),
+                ("dwMemoryLoad", wintypes.DWORD),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        class PDH_FMT_COUNTERVALUE(ctypes.Structure):
+            _fields_ = [("CStatus", wintypes.DWORD), ("doubleValue", ctypes.c_double)]
+
+        self._wintypes = wintypes
+        self._memory_status = MEMORYSTATUSEX
+        self._counter_value = PDH_FMT_COUNTERVALUE
+        self._kernel32 = ctypes.windll.kernel32
+        self._last_times = self._system_times()
+        self._pdh = None
+        self._query = None
+        self._disk_idle = None
+        try:
+            # "% Idle Time" of all physical disks; busy = 1 - idle. PDH needs two samples,
+            # so the first read after start-up reports nothing.
+            pdh = ctypes.windll.pdh
+            query = wintypes.HANDLE()
+            counter = wintypes.HANDLE()
+            if pdh.PdhOpenQueryW(None, None, ctypes.byref(query)) == 0 and pdh.PdhAddEnglishCounterW(
+                query, "\\PhysicalDisk(_Total)\\% Idle Time", None, ctypes.byref(counter)
+            ) == 0:
+                pdh.PdhCollectQueryData(query)
+                self._pdh, self._query, self._disk_idle = pdh, query, counter
+        except Exception as e:
+            logger.debug(f"Disk counters unavailable: {e}")
+
+    def _system_times(self):
+        idle, kernel, user = (self._wintypes.FILETIME() for _ in range(3))
+        if not self._kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+
+        def value(ft):
+            return (ft.dwHighDateTime << 32) | ft.dwLowDateTime
+        return value(idle), value(kernel) + value(user)
+
+    def cpu_busy(self) -> Optional[float]:
+        current = self._system_times()
+        previous, self._last_times = self._last_times, current
+        if current is None or previous is None:
+            return None
+        idle = current[0] - previous[0]
+        total = current[1] - previous[1]
+        if total <= 0:
+            return None
+        return max(0.0, min(1.0, 1.0 - idle / total))
+
+    def memory_available_mb(self) -> Optional[float]:
+        status = self._memory_status()
+        status.dwLength = ctypes.sizeof(status)
+        if not self._kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+        return status.ullAvailPhys / (1024 * 1024)
+
+    def io_busy(self) -> Optional[float]:
+        if self._pdh is None:
+            return None
+        value = self._counter_value()
+        PDH_FMT_DOUBLE = 0x00000200
+        if self._pdh.PdhCollectQueryData(self._query) != 0:
+            return None
+        if self._pdh.PdhGetFormattedCounterValue(self._disk_idle, PDH_FMT_DOUBLE, None, ctypes.byref(value)) != 0:
+            return None
+        return max(0.0, min(1.0, 1.0 - value.doubleValue / 100.0))
+
+
+
+class _PosixSampler:
+
+    def __init__(self):
+        self._last_stat = self._read_cpu()
+
+    def _read_cpu(self):
+        try:
+            with open("/proc/stat", "r") as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+            return fields[3] + fields[4], sum(fields)
+        except Exception:
+            return None
+
+    def cpu_busy(self) -> Optional[float]:
+        current = self._read_cpu()
+        previous, self._last_stat = self._last_stat, current
+        if current is None or previous is None or current[1] <= previous[1]:
+            return None
+        return max(0.0, min(1.0, 1.0 - (current[0] - previous[0]) / (current[1] - previous[1])))
+
+    def memory_available_mb(self) -> Optional[float]:
+        try:
+            with open("/proc/meminfo", "r") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) / 1024
+        except Exception:
+            pass
+        return None
+
+    def io_busy(self) -> Optional[float]:
+        # Pressure stall information: share of time some task waited on I/O (avg10, %).
+        try:
+            with open("/proc/pressure/io", "r") as f:
+                for part in f.readline().split():
+                    if part.startswith("avg10="):
+                        return min(1.0, float(part[6:]) / 100.0)
+        except Exception:
+            pass
+        return None
+
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, max_limit: Optional[int] = None, min_limit: int = 1):
+        # The ceiling is the CPU count (or the caller's max); memory headroom and disk
+        # saturation pull the limit down from there, and it recovers as pressure eases.
+        self.max_limit = max(min_limit, max_limit or os.cpu_count() or 1)
+        self.min_limit = min_limit
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._sampled_at = 0.0
+        self._limit = self.max_limit
+        self.pressure = Pressure(None, None, None)
+        try:
+            self._sampler = _WindowsSampler() if sys.platform == "win32" else _PosixSampler()
+        except Exception as e:
+            logger.warning(f"System pressure sampling unavailable, using a fixed limit: {e}")
+
+    def limit(self, running: int = 0) -> int:
+        with self._lock:
+            now = time.monotonic()
+            if self._sampler is None or now - self._sampled_at < SAMPLE_INTERVAL:
+                return self._limit
+            self._sampled_at = now
+            try:
+                pressure = Pressure(
+                    self._sampler.cpu_busy(),
+                    self._sampler.memory_available_mb(),
+                    self._sampler.io_busy(),
+                )
+            except Exception as e:
+                logger.debug(f"System pressure sample failed: {e}")
+                return self._limit
+            self.pressure = pressure
+            limit = self.max_limit
+            if pressure.memory_available_mb is not None:
+                # Children already running are part of the used memory; allow as many
+                # more as the remaining headroom covers.
+                headroom = pressure.memory_available_mb - RESERVED_MEMORY_MB
+                limit = min(limit, running + max(0, int(headroom // CHILD_MEMORY_MB)))
+            if pressure.io_busy is not None and pressure.io_busy > 0.9:
+                limit = min(limit, max(self.min_limit, running))
+            if pressure.cpu_busy is not None and pressure.cpu_busy > 0.95:
+                limit = min(limit, max(self.min_limit, running))
+            limit = max(self.min_limit, limit)
+            if limit != self._limit:
+                logger.info(f"Concurrency limit {self._limit} -> {limit} ({pressure})")
+            self._limit = limit
+            return limit
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from utilities.util_logger import logger
+
+
+
+# Spans are recorded as Trace Event "complete" events, which chrome://tracing and
+# ui.perfetto.dev load directly. Timestamps are microseconds since tracing started.
+_lock = threading.Lock()
+_events = []
+_thread_names = {}
+_trace_path = None
+_epoch = time.perf_counter()
+
+
+
+class Span:
+
+    __slots__ = ("name", "cat", "args")
+
+    def __init__(self, name: str, cat: str, args: dict):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+
+def enable_tracing(path: str):
+    global _trace_path, _epoch
+    first = _trace_path is None
+    _trace_path = os.path.abspath(path)
+    _epoch = time.perf_counter()
+    if first:
+        atexit.register(write_trace)
+    logger.info(f"Recording trace to {_trace_path}")
+
+
+
+def tracing_enabled() -> bool:
+    return _trace_path is not None
+
+
+
+def _now_us() -> float:
+    return (time.perf_counter() - _epoch) * 1_000_000
+
+
+
+@contextmanager
+def span(name: str, cat: str = "talon", **args):
+    current = Span(name, cat, args)
+    if _trace_path is None:
+        yield current
+        return
+    start = _now_us()
+    try:
+        yield current
+    except BaseException as e:
+        current.args.setdefault("error", repr(e))
+        raise
+    finally:
+        end = _now_us()
+        thread = threading.current_thread()
+        event = {
+            "name": current.name,
+            "cat": current.cat,
+            "ph": "X",
+            "ts": round(start, 3),
+            "dur": round(end - start, 3),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": current.args,
+        }
+        with _lock:
+            _events.append(event)
+            _thread_names.setdefault(thread.ident, thread.name)
+
+
+
+def write_trace(path: Optional[str] = None) -> Optional[str]:
+    path = path or _trace_path
+    if path is None:
+        return None
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "Talon"}}
+        ] + [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in _thread_names.items()
+        ]
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
+        logger.info(f"Wrote {len(events)} trace events to {path}")
+    except Exception as e:
+        logger.error(f"Failed to write trace file {path}: {e}")
+        return None
+    return path
@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import marshal
+import hashlib
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from utilities.util_logger import logger
+from utilities.util_registry_backend import (
+    REG_BINARY, REG_DWORD, REG_EXPAND_SZ, REG_MULTI_SZ, REG_NONE, REG_QWORD, REG_SZ, check_value,
+)
+from utilities.util_modify_registry import RegistryChange, resolve_hive, short_hive_name
+
+
+
+# Registry tweaks are declared in configs/registry_tweaks.json and compiled by build.bat
+# into registry_tweaks.bin next to it: a marshal dump of plain tuples, already grouped
+# by key, with hive and type constants resolved and the key and tag indexes built, so
+# loading it is a single marshal.loads. The .bin carries the hash of the JSON it came
+# from; when the JSON is newer (a development tree, an edited shop catalog) the JSON is
+# compiled in memory instead.
+#
+#   python -m utilities.util_tweak_catalog [SOURCE.json] [TARGET.bin]
+MAGIC = "talon-tweak-catalog"
+FORMAT = 1
+CATALOG_NAME = "registry_tweaks"
+
+_TYPES = {
+    "REG_NONE": REG_NONE,
+    "REG_SZ": REG_SZ,
+    "REG_EXPAND_SZ": REG_EXPAND_SZ,
+    "REG_BINARY": REG_BINARY,
+    "REG_DWORD": REG_DWORD,
+    "REG_MULTI_SZ": REG_MULTI_SZ,
+    "REG_QWORD": REG_QWORD,
+}
+
+
+
+class Tweak:
+
+    __slots__ = ("hive", "hive_name", "key_path", "name", "value_type", "value", "tags")
+
+    def __init__(self, hive: int, hive_name: str, key_path: str, name: str, value_type: int, value: Any, tags: Tuple[str, ...]):
+        self.hive = hive
+        self.hive_name = hive_name
+        self.key_path = key_path
+        self.name = name
+        self.value_type = value_type
+        self.value = value
+        self.tags = tags
+
+    @property
+    def path(self) -> str:
+        return f"{self.hive_name}\\{self.key_path}\\{self.name}"
+
+    def change(self) -> RegistryChange:
+        return RegistryChange(self.hive_name, self.key_path, self.name, self.value, self.value_type)
+
+
+
+class CatalogKey:
+
+    __slots__ = ("hive", "hive_name", "key_path", "tweaks")
+
+    def __init__(self, hive: int, hive_name: str, key_path: str, tweaks: List[Tweak]):
+        self.hive = hive
+        self.hive_name = hive_name
+        self.key_path = key_path
+        self.tweaks = tweaks
+
+
+
+class TweakCatalog:
+
+    def __init__(self, keys: List[CatalogKey], key_index: Dict[Tuple[int, str], int], tag_index: Dict[str, Tuple[Tuple[int, int], ...]]):
+        self.keys = keys
+        self._key_index = key_index
+        self._tag_index = tag_index
+
+    def __len__(self) -> int:
+        return sum(len(key.tweaks) for key in self.keys)
+
+    def __iter__(self) -> Iterator[Tweak]:
+        for key in self.keys:
+            yield from key.tweaks
+
+    def key(self, hive, key_path: str) -> Optional[CatalogKey]:
+        index = self._key_index.get((resolve_hive(hive), key_path.lower()))
+        return None if index is None else self.keys[index]
+
+    def tags(self) -> List[str]:
+        return sorted(self._tag_index)
+
+    def tagged(self, *tags: str) -> List[Tweak]:
+        # Tweaks carrying any of the tags, in catalog order, each once.
+        positions = sorted({position for tag in tags for position in self._tag_index.get(tag.lower(), ())})
+        return [self.keys[key].tweaks[value] for key, value in positions]
+
+    def changes(self, tags: Optional[Iterable[str]] = None) -> List[RegistryChange]:
+        tweaks = self if tags is None else self.tagged(*tags)
+        return [tweak.change() for tweak in tweaks]
+
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+
+def _entry_value(entry: dict, value_type: int, where: str) -> Any:
+    value = entry.get("value")
+    # JSON has no bytes; binary values are written as hex strings.
+    if value_type in (REG_BINARY, REG_NONE) and isinstance(value, str):
+        try:
+            value = bytes.fromhex(value)
+        except ValueError:
+            raise ValueError(f"{where}: binary value must be a hex string")
+    try:
+        check_value(value_type, value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{where}: {e}")
+    return value
+
+
+
+def compile_catalog(source: bytes, origin: str = "<catalog>") -> tuple:
+    # Returns the marshal-ready catalog: (MAGIC, FORMAT, source hash, keys, key index,
+    # tag index). keys are (hive, hive name, key path, values); values are (name, type,
+    # value, tags). A value listed twice with the same data merges its tags; with
+    # different data it is an error.
+    document = json.loads(source.decode("utf-8-sig"))
+    groups: Dict[Tuple[int, str], list] = {}
+    seen: Dict[Tuple[int, str, str], list] = {}
+    for number, entry in enumerate(document.get("tweaks", []), 1):
+        where = f"{origin}: tweak {number}"
+        try:
+            hive = resolve_hive(entry["hive"])
+            key_path = entry["key"].strip("\\")
+            name = entry["name"]
+            value_type = _TYPES[entry.get("type", "REG_DWORD").upper()]
+        except KeyError as e:
+            raise ValueError(f"{where}: missing or unknown {e}")
+        value = _entry_value(entry, value_type, where)
+        tags = [tag.lower() for tag in entry.get("tags", ())]
+        identity = (hive, key_path.lower(), name.lower())
+        existing = seen.get(identity)
+        if existing is not None:
+            if (existing[1], existing[2]) != (value_type, value):
+                raise ValueError(f"{where}: {short_hive_name(hive)}\\{key_path}\\{name} is already set to {existing[2]!r}")
+            existing[3].extend(tag for tag in tags if tag not in existing[3])
+            continue
+        record = [name, value_type, value, tags]
+        seen[identity] = record
+        group = groups.get((hive, key_path.lower()))
+        if group is None:
+            group = groups[(hive, key_path.lower())] = [hive, short_hive_name(hive), key_path, []]
+        group[3].append(record)
+    keys = []
+    key_index = {}
+    tag_index: Dict[str, list] = {}
+    for key_number, (index_key, (hive, hive_name, key_path, records)) in enumerate(groups.items()):
+        key_index[index_key] = key_number
+        values = []
+        for value_number, (name, value_type, value, tags) in enumerate(records):
+            values.append((name, value_type, value, tuple(tags)))
+            for tag in tags:
+                tag_index.setdefault(tag, []).append((key_number, value_number))
+        keys.append((hive, hive_name, key_path, tuple(values)))
+    return (
+        MAGIC, FORMAT, _hash(source), tuple(keys), key_index,
+        {tag: tuple(positions) for tag, positions in tag_index.items()},
+    )
+
+
+
+def _from_compiled(data: tuple) -> TweakCatalog:
+    _, _, _, keys, key_index, tag_index = data
+    catalog_keys = []
+    for hive, hive_name, key_path, values in keys:
+        tweaks = [Tweak(hive, hive_name, key_path, name, value_type, value, tags) for name, value_type, value, tags in values]
+        catalog_keys.append(CatalogKey(hive, hive_name, key_path, tweaks))
+    return TweakCatalog(catalog_keys, key_index, tag_index)
+
+
+
+def build_catalog(source_path: str, target_path: Optional[str] = None) -> str:
+    target_path = target_path or os.path.splitext(source_path)[0] + ".bin"
+    with open(source_path, "rb") as f:
+        compiled = compile_catalog(f.read(), source_path)
+    with open(target_path, "wb") as f:
+        marshal.dump(compiled, f)
+    logger.info(f"Compiled {sum(len(key[3]) for key in compiled[3])} tweaks in {len(compiled[3])} keys to {target_path}")
+    return target_path
+
+
+
+def _get_base_path() -> str:
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    utilities_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.dirname(utilities_dir)
+
+
+
+def catalog_path(name: str = CATALOG_NAME) -> str:
+    return os.path.join(_get_base_path(), 'configs', f'{name}.json')
+
+
+
+def load_catalog(path: Optional[str] = None) -> TweakCatalog:
+    # path names the JSON source; the compiled .bin beside it is used when it is
+    # current. Either file alone is enough.
+    source_path = path or catalog_path()
+    binary_path = os.path.splitext(source_path)[0] + ".bin"
+    source = None
+    if os.path.exists(source_path):
+        with open(source_path, "rb") as f:
+            source = f.read()
+    if os.path.exists(binary_path):
+        try:
+            with open(binary_path, "rb") as f:
+                data = marshal.load(f)
+            if data[0] != MAGIC or data[1] != FORMAT:
+                raise ValueError(f"unsupported catalog format {data[1]!r}")
+            if source is None or data[2] == _hash(source):
+                return _from_compiled(data)
+            logger.debug(f"{binary_path} is older than {source_path}; compiling the catalog from source")
+        except Exception as e:
+            logger.warning(f"Ignoring compiled tweak catalog {binary_path}: {e}")
+    if source is None:
+        raise FileNotFoundError(2, "No tweak catalog found", source_path)
+    return _from_compiled(compile_catalog(source, source_path))
+
+
+
+_catalog: Optional[TweakCatalog] = None
+
+
+
+def get_catalog() -> TweakCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the registry tweak catalog")
+    parser.add_argument("source", nargs="?", default=None, help="Catalog JSON (default: configs/registry_tweaks.json).")
+    parser.add_argument("target", nargs="?", default=None, help="Output file (default: the source with a .bin extension).")
+    args = parser.parse_args(argv)
+    build_catalog(args.source or catalog_path(), args.target)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import sys
+import time
+import heapq
+import signal
+import itertools
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+from typing import Optional
+from utilities.util_logger import logger
+
+
+
+class StepTimeoutError(RuntimeError):
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"{name} exceeded its deadline of {timeout:g}s")
+        self.name = name
+        self.timeout = timeout
+
+
+
+# Children started through the process engine and the PowerShell pool lead a session
+# of their own on POSIX, so kill_process_tree can take their descendants down with
+# them. Processes started elsewhere share Talon's group and only lose the one pid.
+OWN_SESSION = sys.platform != "win32"
+
+
+
+def kill_process_tree(pid: int):
+    if sys.platform == "win32":
+        # taskkill walks the parent/child links itself, so grandchildren such as the
+        # installers Chocolatey or WinUtil start are taken down with the parent.
+        subprocess.run(
+            ["taskkill", "/PID", str(pid), "/T", "/F"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+        return
+    try:
+        pgid = os.getpgid(pid)
+        if pgid == pid:
+            os.killpg(pgid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+
+class DeadlineScope:
+
+    def __init__(self, name: str, timeout: Optional[float], parent: Optional["DeadlineScope"] = None):
+        self.name = name
+        self.timeout = timeout
+        self.parent = parent
+        self.cancel_event = threading.Event()
+        self.timed_out = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def chain(self):
+        scope = self
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+    def register(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+            expired = self.timed_out
+        if expired:
+            self._kill(proc)
+
+    def unregister(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+    def cancelled(self) -> bool:
+        return any(scope.cancel_event.is_set() for scope in self.chain())
+
+    def expired(self) -> Optional["DeadlineScope"]:
+        return next((scope for scope in self.chain() if scope.timed_out), None)
+
+    def expire(self):
+        with self._lock:
+            self.timed_out = True
+            processes = list(self._processes)
+        logger.error(f"Deadline exceeded: {self.name} ran longer than {self.timeout:g}s; cancelling")
+        self.cancel_event.set()
+        for proc in processes:
+            self._kill(proc)
+
+    def _kill(self, proc):
+        if proc.poll() is not None:
+            return
+        logger.warning(f"Killing process tree of pid={proc.pid} ({self.name} timed out)")
+        try:
+            kill_process_tree(proc.pid)
+        except Exception as e:
+            logger.error(f"Failed to kill process tree of pid={proc.pid}: {e}")
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+
+
+class Watchdog:
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+            self._thread.start()
+
+    def watch(self, scope: DeadlineScope, deadline: float):
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), scope))
+            self._ensure_thread()
+            self._condition.notify()
+
+    def release(self, scope: DeadlineScope):
+        with self._condition:
+            self._heap = [entry for entry in self._heap if entry[2] is not scope]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    remaining = self._heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        _, _, scope = heapq.heappop(self._heap)
+                        break
+                    self._condition.wait(remaining)
+            try:
+                scope.expire()
+            except Exception as e:
+                logger.error(f"Watchdog failed to cancel {scope.name}: {e}")
+
+
+
+_watchdog = Watchdog()
+_current_scope = contextvars.ContextVar("talon_deadline_scope", default=None)
+
+
+
+def current_scope() -> Optional[DeadlineScope]:
+    return _current_scope.get()
+
+
+
+def register_process(proc):
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    for s in scope.chain():
+        s.register(proc)
+
+
+
+def unregister_process(proc):
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    for s in scope.chain():
+        s.unregister(proc)
+
+
+
+def cancellation_requested() -> bool:
+    scope = _current_scope.get()
+    return scope is not None and scope.cancelled()
+
+
+
+@contextmanager
+def deadline(name: str, timeout: Optional[float]):
+    scope = DeadlineScope(name, timeout, parent=_current_scope.get())
+    token = _current_scope.set(scope)
+    if timeout:
+        _watchdog.watch(scope, time.monotonic() + timeout)
+    try:
+        yield scope
+    except Exception as e:
+        if scope.timed_out and not isinstance(e, StepTimeoutError):
+            raise StepTimeoutError(name, timeout) from e
+        raise
+    finally:
+        if timeout:
+            _watchdog.release(scope)
+        _current_scope.reset(token)
+    if scope.timed_out:
+        raise StepTimeoutError(name, timeout)